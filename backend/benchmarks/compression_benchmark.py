@@ -0,0 +1,156 @@
+"""Memory/recall tradeoff of compressed vector encodings.
+
+Fills a VectorStore with synthetic embeddings (low-rank plus noise, like real
+text embeddings) or vectors from a .npy file, converts it to each index type
+and encoding in turn, and measures index memory, search latency and recall@k
+against exact float32 search, with and without the exact re-rank stage.
+Results are written as JSON.
+
+Example:
+    python benchmarks/compression_benchmark.py --num-vectors 50000 --index-types flat,hnsw --output compression.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from services.vector_store import VectorStore  # noqa: E402
+
+def make_vectors(num_vectors: int, dimension: int, rank: int, seed: int) -> np.ndarray:
+    """Normalized synthetic embeddings concentrated near a rank-dimensional subspace"""
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dimension)).astype(np.float32)
+    vectors = rng.standard_normal((num_vectors, rank)).astype(np.float32) @ basis
+    vectors += 0.5 * np.sqrt(rank / dimension) * rng.standard_normal((num_vectors, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def index_bytes(store: VectorStore) -> int:
+    """Serialized size of every shard, close to the memory the index holds"""
+    return sum(len(faiss.serialize_index(shard)) for shard in store.index.shards)
+
+def measure(store: VectorStore, queries: np.ndarray, expected: List[set], top_k: int) -> Dict[str, Any]:
+    """Latency and recall@top_k of dense search over the queries"""
+    latencies = []
+    recalls = []
+    for query, truth in zip(queries, expected):
+        start = time.perf_counter()
+        results = store.search(query, top_k=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({int(result.note_id) for result in results} & truth) / top_k)
+    return {
+        "recall": round(float(np.mean(recalls)), 4),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3)
+    }
+
+def run(args) -> List[Dict[str, Any]]:
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+        faiss.normalize_L2(vectors)
+    else:
+        vectors = make_vectors(args.num_vectors + args.queries, args.dimension, args.rank, args.seed)
+    vectors, queries = vectors[:-args.queries], vectors[-args.queries:]
+
+    # Exact float32 neighbours of every query
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.top_k]
+    expected = [set(row.tolist()) for row in truth]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="compression-bench-") as workdir:
+        for index_type in args.index_types:
+            directory = os.path.join(workdir, index_type)
+            os.makedirs(directory)
+            store = VectorStore(
+                index_path=os.path.join(directory, "faiss_index.bin"),
+                metadata_path=os.path.join(directory, "metadata.db"),
+                dimension=vectors.shape[1],
+                ann_min_vectors=len(vectors) + 1,
+                exact_rerank=True,
+                rerank_factor=args.rerank_factor
+            )
+            for start in range(0, len(vectors), args.batch_size):
+                ids = range(start, min(start + args.batch_size, len(vectors)))
+                store.add_vectors([str(i) for i in ids], vectors[ids.start:ids.stop],
+                                  [{"subject_id": i, "hadm_id": 0, "charttime": "", "cleaned_text": ""} for i in ids])
+
+            for encoding in args.encodings:
+                start_time = time.perf_counter()
+                store.convert_index(index_type, encoding)
+                build_seconds = time.perf_counter() - start_time
+                size = index_bytes(store)
+
+                # Without the vector file the store searches the compressed index only
+                vector_file, store.vector_file = store.vector_file, None
+                plain = measure(store, queries, expected, args.top_k)
+                store.vector_file = vector_file
+                reranked = measure(store, queries, expected, args.top_k) if store._reranks() else None
+
+                results.append({
+                    "index_type": index_type,
+                    "encoding": store.current_encoding(),
+                    "index_mb": round(size / (1024 * 1024), 2),
+                    "bytes_per_vector": round(size / len(vectors), 1),
+                    "build_seconds": round(build_seconds, 2),
+                    "search": plain,
+                    "search_reranked": reranked
+                })
+                print(f"{index_type} {store.current_encoding()}: {results[-1]['index_mb']} MB, "
+                      f"recall {plain['recall']}" + (f" ({reranked['recall']} re-ranked)" if reranked else ""),
+                      file=sys.stderr)
+            # Leave nothing for the store to save once the directory is gone
+            store.save_index(snapshot=True)
+            store.close()
+            store.metadata_store.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure index memory, latency and recall for each vector encoding")
+    parser.add_argument("--num-vectors", type=int, default=20000, help="Synthetic vectors to store")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--rank", type=int, default=64, help="Dimensions the synthetic vectors mostly vary in")
+    parser.add_argument("--vectors", help="Store these vectors (.npy, one row per vector) instead of synthetic ones")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--index-types", type=lambda value: value.split(","), default=["flat", "hnsw"])
+    parser.add_argument("--encodings", type=lambda value: value.split(","), default=["float32", "fp16", "int8"])
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Vectors per add_vectors call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "faiss": faiss.__version__
+        },
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": run(args)
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote benchmark report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
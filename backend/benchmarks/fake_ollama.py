@@ -0,0 +1,119 @@
+"""Local stand-in for the Ollama API used by the benchmark harness.
+
+Serves /api/tags, /api/embeddings, /api/embed and /api/chat with deterministic
+vectors (seeded from the input text) and configurable latency and jitter, so
+backend performance can be measured without a GPU or a real model.
+
+Run standalone with:
+    python benchmarks/fake_ollama.py --port 11435 --latency-ms 20 --jitter-ms 5
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_MODEL = "nomic-embed-text:latest"
+CHAT_MODEL = "llama3.2:latest"
+
+def fake_embedding(text: str, dimension: int) -> List[float]:
+    """Deterministic unit vector for a text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+def create_app(latency_ms: float = 20.0,
+               jitter_ms: float = 5.0,
+               per_input_ms: float = 2.0,
+               dimension: int = 768,
+               chat_tokens: int = 64,
+               token_latency_ms: float = 10.0,
+               first_token_ms: float = 150.0) -> FastAPI:
+    """Build the fake Ollama app with the given timing profile"""
+    app = FastAPI(title="Fake Ollama")
+
+    async def delay(base_ms: float):
+        jitter = random.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0.0
+        await asyncio.sleep(max(base_ms + jitter, 0.0) / 1000)
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": EMBEDDING_MODEL}, {"name": CHAT_MODEL}]}
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await delay(latency_ms + per_input_ms)
+        return {"embedding": fake_embedding(body.get("prompt", ""), dimension)}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await delay(latency_ms + per_input_ms * len(inputs))
+        return {"model": body.get("model"), "embeddings": [fake_embedding(text, dimension) for text in inputs]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get("model", CHAT_MODEL)
+        words = [f" token{i}" for i in range(chat_tokens)]
+        prompt_chars = sum(len(message.get("content", "")) for message in body.get("messages", []))
+        final = {
+            "model": model,
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "prompt_eval_count": prompt_chars // 4,
+            "eval_count": chat_tokens
+        }
+
+        if not body.get("stream", True):
+            await delay(first_token_ms + token_latency_ms * chat_tokens)
+            return JSONResponse({**final, "message": {"role": "assistant", "content": "".join(words)}})
+
+        async def generate():
+            await delay(first_token_ms)
+            for word in words:
+                yield json.dumps({"model": model, "message": {"role": "assistant", "content": word}, "done": False}) + "\n"
+                await asyncio.sleep(token_latency_ms / 1000)
+            yield json.dumps(final) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Base latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="Uniform +/- jitter added to each delay")
+    parser.add_argument("--per-input-ms", type=float, default=2.0, help="Extra latency per embedded text")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--chat-tokens", type=int, default=64, help="Tokens generated per chat response")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--first-token-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    app = create_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        per_input_ms=args.per_input_ms,
+        dimension=args.dimension,
+        chat_tokens=args.chat_tokens,
+        token_latency_ms=args.token_latency_ms,
+        first_token_ms=args.first_token_ms
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""Benchmark harness for the Medical RAG backend.
+
+Starts the fake Ollama server and the backend as subprocesses in a scratch
+directory, then drives /vectorize, /search (each mode), /search/batch, /stats
+and /rag at the configured corpus size and concurrency. Results are written as
+JSON with throughput and p50/p95/p99 latency per stage, so runs can be
+compared across versions.
+
+Example:
+    python benchmarks/run_benchmark.py --corpus-size 5000 --concurrency 16 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Vocabulary for synthetic notes and queries
+CONDITIONS = ["sepsis", "pneumonia", "atrial fibrillation", "acute kidney injury", "heart failure",
+              "COPD exacerbation", "diabetic ketoacidosis", "stroke", "GI bleed", "cellulitis",
+              "pulmonary embolism", "hyponatremia", "delirium", "pancreatitis", "UTI"]
+MEDICATIONS = ["vancomycin", "piperacillin-tazobactam", "heparin", "metoprolol", "furosemide",
+               "insulin glargine", "lisinopril", "warfarin", "apixaban", "pantoprazole",
+               "ceftriaxone", "albuterol", "prednisone", "amiodarone", "acetaminophen"]
+LABS = ["creatinine", "lactate", "troponin", "BNP", "WBC", "hemoglobin", "potassium", "INR", "A1c", "lipase"]
+CODES = ["I48.91", "N17.9", "J18.9", "A41.9", "I50.9", "E11.10", "K92.2", "I63.9", "L03.90", "E87.1"]
+SECTIONS = ["Chief Complaint", "History of Present Illness", "Past Medical History", "Medications on Admission",
+            "Hospital Course", "Discharge Medications", "Discharge Diagnosis", "Discharge Instructions"]
+
+def make_note(rng: random.Random, sentences_per_section: int) -> str:
+    """Synthetic discharge-summary style note"""
+    sections = []
+    for section in SECTIONS:
+        sentences = []
+        for _ in range(rng.randint(1, sentences_per_section)):
+            sentences.append(
+                f"Patient with {rng.choice(CONDITIONS)} ({rng.choice(CODES)}) was treated with "
+                f"{rng.choice(MEDICATIONS)} {rng.randint(5, 500)} mg; {rng.choice(LABS)} "
+                f"{rng.choice(['trended down', 'was elevated', 'remained stable', 'normalized'])} at {rng.uniform(0.1, 20):.1f}."
+            )
+        sections.append(f"{section}:\n" + " ".join(sentences))
+    return "\n\n".join(sections)
+
+def make_corpus(size: int, sentences_per_section: int, seed: int) -> List[Dict[str, Any]]:
+    """Deterministic synthetic records"""
+    rng = random.Random(seed)
+    return [
+        {
+            "note_id": f"bench-{i}",
+            "subject_id": 10_000 + i % max(size // 5, 1),
+            "hadm_id": 20_000 + i,
+            "charttime": f"2150-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00",
+            "cleaned_text": make_note(rng, sentences_per_section)
+        }
+        for i in range(size)
+    ]
+
+def make_queries(count: int, seed: int) -> List[str]:
+    """Deterministic query strings mixing conditions, drugs, labs and codes"""
+    rng = random.Random(seed + 1)
+    templates = [
+        lambda: f"{rng.choice(CONDITIONS)} treated with {rng.choice(MEDICATIONS)}",
+        lambda: f"elevated {rng.choice(LABS)} in {rng.choice(CONDITIONS)}",
+        lambda: f"{rng.choice(CODES)} {rng.choice(MEDICATIONS)}",
+        lambda: f"{rng.choice(MEDICATIONS)} dosing and {rng.choice(LABS)} trend"
+    ]
+    return [f"{rng.choice(templates)()} #{i}" for i in range(count)]
+
+def percentile_summary(latencies: List[float]) -> Dict[str, float]:
+    """Latency distribution in milliseconds"""
+    if not latencies:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    values = np.asarray(latencies) * 1000
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2)
+    }
+
+def summarize(latencies: List[float], units: int, errors: int, duration: float, unit_name: str) -> Dict[str, Any]:
+    """Stage result: request counts, throughput and latency percentiles"""
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "unit": unit_name,
+        "units": units,
+        "throughput_per_s": round(units / duration, 2) if duration > 0 else 0.0,
+        "latency_ms": percentile_summary(latencies)
+    }
+
+async def run_concurrently(count: int,
+                           concurrency: int,
+                           make_request: Callable[[int], Awaitable[int]]) -> Tuple[List[float], int, int, float]:
+    """Run count requests with at most concurrency in flight.
+
+    make_request returns the number of units (records, queries) it processed.
+    Returns (latencies, units, errors, wall-clock duration).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    totals = {"units": 0, "errors": 0}
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                units = await make_request(i)
+                latencies.append(time.perf_counter() - start)
+                totals["units"] += units
+            except Exception as e:
+                totals["errors"] += 1
+                print(f"request {i} failed: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies, totals["units"], totals["errors"], time.perf_counter() - start
+
+async def bench_vectorize(client: httpx.AsyncClient, corpus: List[Dict[str, Any]], batch_size: int, concurrency: int) -> Dict[str, Any]:
+    batches = [corpus[i:i + batch_size] for i in range(0, len(corpus), batch_size)]
+
+    async def request(i: int) -> int:
+        response = await client.post("/vectorize", json={"records": batches[i]})
+        response.raise_for_status()
+        final = json.loads(response.text.strip().split("\n")[-1])
+        if not final.get("success"):
+            raise RuntimeError(final.get("message"))
+        return final["vectorized_count"]
+
+    latencies, units, errors, duration = await run_concurrently(len(batches), concurrency, request)
+    return summarize(latencies, units, errors, duration, "records")
+
+async def bench_search(client: httpx.AsyncClient, queries: List[str], count: int, concurrency: int, mode: str, top_k: int) -> Dict[str, Any]:
+    async def request(i: int) -> int:
+        response = await client.get("/search", params={"query": queries[i % len(queries)], "top_k": top_k, "mode": mode})
+        response.raise_for_status()
+        return 1
+
+    latencies, units, errors, duration = await run_concurrently(count, concurrency, request)
+    return summarize(latencies, units, errors, duration, "queries")
+
+async def bench_search_batch(client: httpx.AsyncClient, queries: List[str], count: int, batch_size: int, concurrency: int, top_k: int) -> Dict[str, Any]:
+    num_batches = max(count // batch_size, 1)
+
+    async def request(i: int) -> int:
+        batch = [
+            {"query": queries[(i * batch_size + j) % len(queries)], "top_k": top_k}
+            for j in range(batch_size)
+        ]
+        response = await client.post("/search/batch", json={"queries": batch})
+        response.raise_for_status()
+        return response.json()["total_queries"]
+
+    latencies, units, errors, duration = await run_concurrently(num_batches, concurrency, request)
+    return summarize(latencies, units, errors, duration, "queries")
+
+async def bench_stats(client: httpx.AsyncClient, count: int, concurrency: int) -> Dict[str, Any]:
+    async def request(i: int) -> int:
+        response = await client.get("/stats")
+        response.raise_for_status()
+        return 1
+
+    latencies, units, errors, duration = await run_concurrently(count, concurrency, request)
+    return summarize(latencies, units, errors, duration, "requests")
+
+async def bench_rag(client: httpx.AsyncClient, queries: List[str], count: int, concurrency: int, top_k: int) -> Dict[str, Any]:
+    first_token_latencies: List[float] = []
+
+    async def request(i: int) -> int:
+        start = time.perf_counter()
+        got_first_token = False
+        async with client.stream("POST", "/rag", json={"query": queries[i % len(queries)], "top_k": top_k}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["type"] == "token" and not got_first_token:
+                    first_token_latencies.append(time.perf_counter() - start)
+                    got_first_token = True
+                elif event["type"] == "error":
+                    raise RuntimeError(event["error"])
+        return 1
+
+    latencies, units, errors, duration = await run_concurrently(count, concurrency, request)
+    result = summarize(latencies, units, errors, duration, "answers")
+    result["time_to_first_token_ms"] = percentile_summary(first_token_latencies)
+    return result
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    """Poll url until it answers, failing early if the process exits"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+            try:
+                if (await client.get(url, timeout=2.0)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+async def run(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    ollama_port = free_port()
+    backend_port = free_port()
+    processes: List[subprocess.Popen] = []
+    log_file = open(os.path.join(workdir, "servers.log"), "w")
+
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCHMARK_DIR, "fake_ollama.py"),
+             "--port", str(ollama_port),
+             "--latency-ms", str(args.ollama_latency_ms),
+             "--jitter-ms", str(args.ollama_jitter_ms),
+             "--per-input-ms", str(args.ollama_per_input_ms),
+             "--chat-tokens", str(args.chat_tokens),
+             "--token-latency-ms", str(args.token_latency_ms),
+             "--first-token-ms", str(args.first_token_ms)],
+            stdout=log_file, stderr=subprocess.STDOUT
+        ))
+        await wait_until_ready(f"http://127.0.0.1:{ollama_port}/api/tags", processes[0])
+
+        # The backend keeps its index files in the scratch directory
+        env = {**os.environ, "OLLAMA_URL": f"http://127.0.0.1:{ollama_port}"}
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+             "--host", "127.0.0.1", "--port", str(backend_port), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        ))
+        await wait_until_ready(f"http://127.0.0.1:{backend_port}/stats", processes[1])
+
+        corpus = make_corpus(args.corpus_size, args.sentences_per_section, args.seed)
+        queries = make_queries(args.query_pool or args.queries, args.seed)
+        results: Dict[str, Any] = {}
+
+        timeout = httpx.Timeout(600.0, connect=10.0)
+        limits = httpx.Limits(max_connections=max(args.concurrency, 1) * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{backend_port}", timeout=timeout, limits=limits) as client:
+            print(f"Vectorizing {len(corpus)} records...", file=sys.stderr)
+            results["vectorize"] = await bench_vectorize(client, corpus, args.vectorize_batch, args.vectorize_concurrency)
+
+            for mode in args.search_modes:
+                print(f"Running {args.queries} {mode} searches...", file=sys.stderr)
+                results[f"search_{mode}"] = await bench_search(client, queries, args.queries, args.concurrency, mode, args.top_k)
+
+            if args.batch_size > 0:
+                print(f"Running batch searches of {args.batch_size} queries...", file=sys.stderr)
+                # Fresh queries so the batch path is not served from the search result cache
+                batch_queries = [f"{query} (batch)" for query in queries]
+                results["search_batch"] = await bench_search_batch(
+                    client, batch_queries, args.queries, args.batch_size, max(args.concurrency // 4, 1), args.top_k
+                )
+
+            if args.stats_requests > 0:
+                results["stats"] = await bench_stats(client, args.stats_requests, args.concurrency)
+
+            if args.rag_requests > 0:
+                print(f"Running {args.rag_requests} RAG requests...", file=sys.stderr)
+                results["rag"] = await bench_rag(client, queries, args.rag_requests, max(args.concurrency // 4, 1), args.top_k)
+
+            results["backend_stats"] = (await client.get("/stats")).json()
+
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log_file.close()
+        if args.keep_workdir:
+            print(f"Kept working directory {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend against a fake Ollama server")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="Records to vectorize")
+    parser.add_argument("--sentences-per-section", type=int, default=4, help="Upper bound on note length")
+    parser.add_argument("--vectorize-batch", type=int, default=250, help="Records per /vectorize request")
+    parser.add_argument("--vectorize-concurrency", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=500, help="Requests per search mode")
+    parser.add_argument("--query-pool", type=int, default=0, help="Distinct query strings (default: one per request, so no cache hits)")
+    parser.add_argument("--search-modes", type=lambda value: value.split(","), default=["dense", "lexical", "hybrid"])
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per /search/batch request (0 to skip)")
+    parser.add_argument("--stats-requests", type=int, default=50)
+    parser.add_argument("--rag-requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--ollama-latency-ms", type=float, default=20.0)
+    parser.add_argument("--ollama-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--ollama-per-input-ms", type=float, default=2.0)
+    parser.add_argument("--chat-tokens", type=int, default=64)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--first-token-ms", type=float, default=150.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep index files and server logs")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep_workdir")},
+        "results": results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote benchmark report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import asyncio
 import json
 import logging
+import os
+import time
 from typing import Optional, List
 import uvicorn
 import atexit
@@ -14,12 +16,30 @@ from models import (
     HealthResponse, 
     VectorizeRequest, 
     VectorizeResponse, 
+    UploadVectorizeResponse,
+    MimicRecord,
+    NoteUpsertResponse,
+    NoteDeleteResponse,
+    JobStatusResponse,
+    JobListResponse,
     SearchResponse, 
+    BatchSearchRequest,
+    BatchSearchResponse,
+    RAGRequest,
     StatsResponse, 
-    ClearResponse
+    ClearResponse,
+    IndexConvertResponse
 )
 from services.embedding_service import EmbeddingService
+from services.llm_service import LLMService
 from services.vector_store import VectorStore
+from services.ttl_cache import TTLCache
+from services.metrics import REGISTRY, HTTP_REQUEST_SECONDS, SEARCH_STAGE_SECONDS
+from services.chunker import NoteChunker
+from services.ingest_service import IngestPipeline
+from services.near_duplicates import NearDuplicateDetector
+from services.job_service import JobManager, JOB_STATUSES
+from services.upload_parser import MultipartFileReader, UploadError, UploadParser, detect_format
 
 # Configure logging
 logging.basicConfig(
@@ -44,16 +64,121 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record request latency per route template (streaming bodies are timed to the first byte)"""
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start_time,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    return response
+
 # Initialize services
 embedding_service = None
+llm_service = None
 vector_store = None
+note_chunker = None
+near_duplicate_detector = None
+job_manager = None
+
+# Vectors per bulk add_vectors call during ingest
+write_batch_size = 64
+
+# Notes at least this similar (estimated Jaccard over word shingles) to a stored
+# note of the same subject are not embedded; "link" records them against that
+# note, "skip" drops them. Off (None) by default, so every note is embedded;
+# 0.9 catches notes copied forward with small edits.
+near_duplicate_threshold = None
+near_duplicate_policy = "link"
+
+# Retrieval modes accepted by /search
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+
+# Queries embedded together and searched with one FAISS call by /search/batch
+search_batch_size = 64
+
+# Cached /search results, keyed on the vector store generation so any add or clear invalidates them
+search_result_cache = TTLCache(max_size=512, ttl_seconds=600.0)
+
+# Multi-worker serving: a single "writer" process ingests and publishes index
+# snapshots to VECTOR_STORE_PUBLISH_DIR; any number of "reader" processes (e.g.
+# uvicorn --workers N) memory-map the latest published snapshot, share it through
+# the page cache and swap to newer generations as they appear. Readers reject writes.
+VECTOR_STORE_ROLES = ("writer", "reader")
+vector_store_role = os.getenv("VECTOR_STORE_ROLE", "writer")
+vector_store_publish_dir = os.getenv("VECTOR_STORE_PUBLISH_DIR") or None
+snapshot_publish_seconds = 30.0
+snapshot_poll_seconds = 2.0
+snapshot_watcher: Optional[asyncio.Task] = None
+
+# Index sharding: None keeps one index; "subject" hashes subjects over
+# vector_store_num_shards shards (subject-filtered searches visit one shard);
+# "time" starts a new shard every vector_store_shard_vectors vectors, so only the
+# newest shard is rewritten by snapshots. Shards are searched in parallel.
+vector_store_shard_by = os.getenv("VECTOR_STORE_SHARD_BY") or None
+vector_store_num_shards = 4
+vector_store_shard_vectors = 1_000_000
+
+# Vector compression: "fp16" halves and "int8" quarters the memory of the
+# vectors in the index. Compressed indexes then re-rank: they fetch
+# vector_store_rerank_factor times the hits and rescore them with float32
+# vectors memory-mapped from disk, which recovers nearly all of the recall.
+vector_store_encoding = os.getenv("VECTOR_STORE_ENCODING") or "float32"
+vector_store_exact_rerank = vector_store_encoding != "float32"
+vector_store_rerank_factor = 4
+
+def cache_counters(counter: str):
+    """Hit or miss counters of every cache, read when /metrics is scraped"""
+    caches = {"search_result": search_result_cache.get_stats()}
+    if embedding_service:
+        caches["query_embedding"] = embedding_service.get_query_cache_stats()
+        caches["embedding"] = embedding_service.get_cache_stats()
+    return [({"cache": name}, stats[counter]) for name, stats in caches.items() if stats]
+
+REGISTRY.callback("rag_cache_hits_total", "Cache hits by cache", "counter",
+                  lambda: cache_counters("hits"), ("cache",))
+REGISTRY.callback("rag_cache_misses_total", "Cache misses by cache", "counter",
+                  lambda: cache_counters("misses"), ("cache",))
+REGISTRY.callback("rag_embedding_concurrency_limit", "Current adaptive limit on concurrent embedding requests", "gauge",
+                  lambda: [({}, embedding_service.get_concurrency_stats()["limit"])] if embedding_service else [])
+REGISTRY.callback("rag_embedding_in_flight", "Embedding requests currently in flight", "gauge",
+                  lambda: [({}, embedding_service.get_concurrency_stats()["in_flight"])] if embedding_service else [])
+REGISTRY.callback("rag_vector_store_vectors", "Vectors in the index", "gauge",
+                  lambda: [({}, vector_store.index.ntotal)] if vector_store and vector_store.is_initialized() else [])
+REGISTRY.callback("rag_vector_store_shard_vectors", "Vectors in each index shard", "gauge",
+                  lambda: [({"shard": str(shard)}, size) for shard, size in enumerate(vector_store.index.sizes())]
+                  if vector_store and vector_store.is_initialized() else [], ("shard",))
 
 def initialize_services():
     """Initialize services with error handling"""
-    global embedding_service, vector_store
+    global embedding_service, llm_service, vector_store, note_chunker, near_duplicate_detector, job_manager
     try:
-        embedding_service = EmbeddingService()
-        vector_store = VectorStore()
+        ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+        embedding_service = EmbeddingService(ollama_url=ollama_url)
+        llm_service = LLMService(ollama_url=ollama_url)
+        if vector_store_role not in VECTOR_STORE_ROLES:
+            raise ValueError(f"Unknown VECTOR_STORE_ROLE '{vector_store_role}', expected one of {VECTOR_STORE_ROLES}")
+        if vector_store_role == "reader":
+            # Serves the writer's published snapshots; ingest and jobs run in the writer only
+            vector_store = VectorStore(publish_dir=vector_store_publish_dir, read_only=True,
+                                       exact_rerank=vector_store_exact_rerank, rerank_factor=vector_store_rerank_factor)
+            logger.info("Services initialized as a read-only worker")
+            return True
+        
+        vector_store = VectorStore(publish_dir=vector_store_publish_dir, publish_interval_seconds=snapshot_publish_seconds,
+                                   shard_by=vector_store_shard_by, num_shards=vector_store_num_shards,
+                                   shard_vectors=vector_store_shard_vectors, vector_encoding=vector_store_encoding,
+                                   exact_rerank=vector_store_exact_rerank, rerank_factor=vector_store_rerank_factor)
+        note_chunker = NoteChunker()
+        if near_duplicate_threshold is not None:
+            near_duplicate_detector = NearDuplicateDetector(threshold=near_duplicate_threshold, policy=near_duplicate_policy)
+        job_manager = JobManager(embedding_service, vector_store, note_chunker, near_duplicate_detector,
+                                 write_batch_size=write_batch_size)
         logger.info("Services initialized successfully")
         return True
     except Exception as e:
@@ -66,11 +191,10 @@ def cleanup_services():
     try:
         if vector_store and vector_store.is_initialized():
             vector_store.save_index()
+            vector_store.wait_for_compaction()
             logger.info("Saved vector store index")
-        
-        if embedding_service:
-            asyncio.create_task(embedding_service.close())
-            logger.info("Closed embedding service")
+        if vector_store:
+            vector_store.close()
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
 
@@ -78,14 +202,66 @@ def cleanup_services():
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
+    global snapshot_watcher
     success = initialize_services()
     if not success:
         logger.error("Failed to initialize services - some endpoints may not work")
+        return
+    
+    # Open the pooled HTTP clients inside the running event loop
+    await embedding_service.start()
+    await llm_service.start()
+    
+    if vector_store_role == "reader":
+        snapshot_watcher = asyncio.create_task(watch_published_snapshots())
+        return
+    
+    # Resume vectorize jobs interrupted by the last shutdown
+    await job_manager.start()
+
+async def watch_published_snapshots():
+    """Swap a read-only worker to each snapshot generation the writer publishes"""
+    while True:
+        await asyncio.sleep(snapshot_poll_seconds)
+        try:
+            await vector_store.run_in_executor(vector_store.refresh)
+        except Exception as e:
+            logger.error(f"Failed to check for a published snapshot: {e}")
+
+def require_writer():
+    """Reject requests that modify the index on a read-only worker"""
+    if vector_store_role == "reader":
+        raise HTTPException(status_code=403, detail="This worker serves a read-only index snapshot; send writes to the writer process")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    if snapshot_watcher:
+        snapshot_watcher.cancel()
+    
+    # Stop the job worker first so its last checkpoint is part of the final save
+    try:
+        if job_manager:
+            await job_manager.close()
+            logger.info("Stopped job worker")
+    except Exception as e:
+        logger.error(f"Error stopping job worker: {e}")
+    
     cleanup_services()
+    
+    try:
+        if embedding_service:
+            await embedding_service.close()
+            logger.info("Closed embedding service")
+    except Exception as e:
+        logger.error(f"Error closing embedding service: {e}")
+    
+    try:
+        if llm_service:
+            await llm_service.close()
+            logger.info("Closed LLM service")
+    except Exception as e:
+        logger.error(f"Error closing LLM service: {e}")
 
 # Register cleanup handlers
 atexit.register(cleanup_services)
@@ -125,6 +301,7 @@ async def health_check():
 @app.post("/vectorize")
 async def vectorize_data(request: VectorizeRequest):
     """Vectorize clinical records with streaming progress and better error handling"""
+    require_writer()
     try:
         if not embedding_service or not vector_store:
             raise HTTPException(status_code=500, detail="Services not initialized")
@@ -133,90 +310,30 @@ async def vectorize_data(request: VectorizeRequest):
         
         async def generate_progress():
             total_records = len(request.records)
-            vectorized_count = 0
-            failed_count = 0
-            metal_error_detected = False
+            pipeline = IngestPipeline(
+                embedding_service,
+                vector_store,
+                note_chunker,
+                total_records=total_records,
+                write_batch_size=write_batch_size,
+                near_duplicates=near_duplicate_detector
+            )
             
-            for i, record in enumerate(request.records):
-                try:
-                    # Generate embedding for the record
-                    embedding = await embedding_service.get_embedding(record.cleaned_text)
-                    
-                    # Store in vector store
-                    vector_store.add_vector(
-                        vector_id=record.note_id,
-                        embedding=embedding,
-                        metadata={
-                            "subject_id": record.subject_id,
-                            "hadm_id": record.hadm_id,
-                            "charttime": record.charttime,
-                            "cleaned_text": record.cleaned_text,
-                            "note_id": record.note_id
-                        }
-                    )
-                    
-                    vectorized_count += 1
-                    progress = int((i + 1) / total_records * 100)
-                    
-                    # Send progress update
-                    progress_data = {
-                        "progress": progress, 
-                        "processed": i + 1, 
-                        "total": total_records,
-                        "successful": vectorized_count,
-                        "failed": failed_count
-                    }
-                    yield f"{json.dumps(progress_data)}\n"
-                    
-                    # Save index periodically
-                    if vectorized_count % 100 == 0:
-                        vector_store.save_index()
-                        logger.info(f"Saved index at {vectorized_count} records")
-                    
-                except Exception as e:
-                    failed_count += 1
-                    error_msg = str(e)
-                    
-                    # Check for Metal backend errors
-                    if "failed to create command queue" in error_msg or "llama runner process has terminated" in error_msg:
-                        metal_error_detected = True
-                        logger.error(f"Metal backend error detected for record {record.note_id}: {e}")
-                    else:
-                        logger.error(f"Error processing record {record.note_id}: {e}")
-                    
-                    # Send error update
-                    error_data = {
-                        "progress": int((i + 1) / total_records * 100),
-                        "processed": i + 1,
-                        "total": total_records,
-                        "successful": vectorized_count,
-                        "failed": failed_count,
-                        "error": "Metal backend issues detected" if metal_error_detected else "Processing error"
-                    }
-                    yield f"{json.dumps(error_data)}\n"
-                    continue
+            async for progress_data in pipeline.run(request.records):
+                yield f"{json.dumps(progress_data)}\n"
             
             # Save final index
             try:
-                vector_store.save_index()
+                await vector_store.run_in_executor(vector_store.save_index)
                 logger.info("Final index save completed")
             except Exception as e:
                 logger.error(f"Failed to save final index: {e}")
             
             # Send final result with troubleshooting info
-            success_rate = (vectorized_count / total_records * 100) if total_records > 0 else 0
-            message = f"Successfully vectorized {vectorized_count} out of {total_records} records ({success_rate:.1f}%)"
-            
-            if metal_error_detected:
-                message += "\n\nIMPORTANT: Metal backend errors detected. To fix this:\n1. Stop Ollama: 'ollama stop'\n2. Restart with CPU mode: 'OLLAMA_NUM_GPU=0 ollama serve'\n3. Or increase available GPU memory"
-            
-            if failed_count > 0:
-                message += f"\n{failed_count} records failed to process."
-            
             result = VectorizeResponse(
-                success=vectorized_count > 0,
-                message=message,
-                vectorized_count=vectorized_count
+                success=pipeline.vectorized_count + pipeline.skipped_count + pipeline.duplicate_count > 0,
+                message=pipeline.summary(),
+                vectorized_count=pipeline.vectorized_count
             )
             yield json.dumps(result.dict())
         
@@ -236,54 +353,537 @@ async def vectorize_data(request: VectorizeRequest):
             error_message += " - Try restarting Ollama with: OLLAMA_NUM_GPU=0 ollama serve"
         raise HTTPException(status_code=500, detail=f"Vectorization failed: {error_message}")
 
+@app.post("/vectorize/upload", response_model=UploadVectorizeResponse)
+async def vectorize_upload(request: Request, format: Optional[str] = None):
+    """Vectorize a CSV, JSONL or Parquet note export as it is uploaded.
+    
+    The body is either the raw file or multipart/form-data with a `file` field.
+    Rows are parsed and embedded while the upload is still arriving, so memory
+    use does not grow with the size of the export.
+    """
+    require_writer()
+    try:
+        if not embedding_service or not vector_store:
+            raise HTTPException(status_code=500, detail="Services not initialized")
+        
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            reader = MultipartFileReader(request.stream(), content_type)
+            await reader.open()
+            upload_format = detect_format(format, reader.filename, None)
+            chunks = reader.chunks()
+        else:
+            upload_format = detect_format(format, None, content_type)
+            chunks = request.stream()
+        parser = UploadParser(upload_format)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to start upload: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    logger.info(f"Starting vectorization of {upload_format} upload")
+    
+    # The body is read here rather than in a StreamingResponse, which would
+    # compete with it for request messages while listening for disconnects
+    pipeline = IngestPipeline(
+        embedding_service,
+        vector_store,
+        note_chunker,
+        total_records=None,
+        write_batch_size=write_batch_size,
+        near_duplicates=near_duplicate_detector
+    )
+    error = None
+    try:
+        async for _ in pipeline.run(parser.records(chunks)):
+            pass
+    except UploadError as e:
+        error = str(e)
+        logger.error(f"Upload stopped early: {e}")
+    except Exception as e:
+        error = f"Upload failed: {e}"
+        logger.error(f"Upload vectorization failed: {e}")
+    
+    # Keep whatever was stored, even if the upload was cut short
+    try:
+        await vector_store.run_in_executor(vector_store.save_index)
+        logger.info("Final index save completed")
+    except Exception as e:
+        logger.error(f"Failed to save final index: {e}")
+    
+    message = pipeline.summary()
+    if parser.rows_invalid:
+        message += f"\n{parser.rows_invalid} of {parser.rows_read} rows were invalid and skipped."
+    if error:
+        message += f"\n{error}"
+    
+    return UploadVectorizeResponse(
+        success=error is None and pipeline.vectorized_count + pipeline.skipped_count + pipeline.duplicate_count > 0,
+        message=message,
+        vectorized_count=pipeline.vectorized_count,
+        upload_format=upload_format,
+        rows_read=parser.rows_read,
+        rows_invalid=parser.rows_invalid,
+        skipped_count=pipeline.skipped_count,
+        duplicate_count=pipeline.duplicate_count,
+        failed_count=pipeline.failed_count,
+        errors=parser.errors
+    )
+
+@app.post("/jobs/vectorize", response_model=JobStatusResponse, status_code=202)
+async def submit_vectorize_job(request: VectorizeRequest):
+    """Queue records for background vectorization and return the job immediately"""
+    require_writer()
+    try:
+        if not job_manager:
+            raise HTTPException(status_code=500, detail="Services not initialized")
+        if not request.records:
+            raise HTTPException(status_code=400, detail="No records to vectorize")
+        
+        return JobStatusResponse(**await job_manager.submit(request.records))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to submit vectorize job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs", response_model=JobListResponse)
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """List recent vectorize jobs, newest first"""
+    require_writer()
+    if not job_manager:
+        raise HTTPException(status_code=500, detail="Services not initialized")
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown status '{status}', expected one of {JOB_STATUSES}")
+    
+    jobs = [JobStatusResponse(**job) for job in await job_manager.list(status, limit)]
+    return JobListResponse(jobs=jobs, total_jobs=len(jobs))
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Get the status and progress of a vectorize job"""
+    require_writer()
+    if not job_manager:
+        raise HTTPException(status_code=500, detail="Services not initialized")
+    
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobStatusResponse(**job)
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobStatusResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running vectorize job; records stored so far are kept"""
+    require_writer()
+    if not job_manager:
+        raise HTTPException(status_code=500, detail="Services not initialized")
+    
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobStatusResponse(**job)
+
+@app.put("/notes/{note_id}", response_model=NoteUpsertResponse)
+async def upsert_note(note_id: str, record: MimicRecord):
+    """Store a note, replacing the vectors of its previous version if it was stored.
+    
+    Only this note is re-embedded; the rest of the index is untouched.
+    """
+    require_writer()
+    try:
+        if not embedding_service or not vector_store:
+            raise HTTPException(status_code=500, detail="Services not initialized")
+        if record.note_id != note_id:
+            raise HTTPException(status_code=400, detail=f"Record note_id '{record.note_id}' does not match '{note_id}'")
+        
+        replaced = bool(vector_store.is_initialized() and await vector_store.run_in_executor(
+            vector_store.metadata_store.existing_parent_ids, [note_id]
+        ))
+        pipeline = IngestPipeline(
+            embedding_service,
+            vector_store,
+            note_chunker,
+            total_records=1,
+            write_batch_size=write_batch_size,
+            near_duplicates=near_duplicate_detector,
+            replace_existing=True
+        )
+        async for _ in pipeline.run([record]):
+            pass
+        if pipeline.vectorized_count == 0:
+            raise HTTPException(status_code=500, detail=f"Failed to store note {note_id}: {pipeline.summary()}")
+        await vector_store.run_in_executor(vector_store.save_index)
+        
+        return NoteUpsertResponse(
+            success=True,
+            message=f"{'Replaced' if replaced else 'Stored'} note {note_id}",
+            note_id=note_id,
+            replaced=replaced,
+            vectors_stored=pipeline.vectors_added
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to upsert note {note_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to upsert note: {str(e)}")
+
+@app.delete("/notes/{note_id}", response_model=NoteDeleteResponse)
+async def delete_note(note_id: str):
+    """Delete a note's vectors and metadata, along with near-duplicates linked to it"""
+    require_writer()
+    try:
+        if not vector_store:
+            raise HTTPException(status_code=500, detail="Vector store not initialized")
+        
+        deleted = await vector_store.run_in_executor(vector_store.delete_notes, [note_id])
+        if deleted["notes"] == 0:
+            raise HTTPException(status_code=404, detail=f"Note {note_id} not found")
+        await vector_store.run_in_executor(vector_store.save_index)
+        
+        return NoteDeleteResponse(
+            success=True,
+            message=f"Deleted note {note_id}",
+            notes_deleted=deleted["notes"],
+            vectors_deleted=deleted["vectors"]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to delete note {note_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete note: {str(e)}")
+
+@app.delete("/subjects/{subject_id}", response_model=NoteDeleteResponse)
+async def delete_subject(subject_id: int):
+    """Delete every note of a subject (e.g. a retracted patient)"""
+    require_writer()
+    try:
+        if not vector_store:
+            raise HTTPException(status_code=500, detail="Vector store not initialized")
+        
+        deleted = {"notes": 0, "vectors": 0}
+        if vector_store.is_initialized():
+            deleted = await vector_store.run_in_executor(vector_store.delete_subject, subject_id)
+        if deleted["notes"] == 0:
+            raise HTTPException(status_code=404, detail=f"No notes stored for subject {subject_id}")
+        await vector_store.run_in_executor(vector_store.save_index)
+        
+        return NoteDeleteResponse(
+            success=True,
+            message=f"Deleted {deleted['notes']} notes of subject {subject_id}",
+            notes_deleted=deleted["notes"],
+            vectors_deleted=deleted["vectors"]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to delete subject {subject_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete subject: {str(e)}")
+
+async def retrieve(query: str,
+                   top_k: int,
+                   subject_id_filter: Optional[int] = None,
+                   nprobe: Optional[int] = None,
+                   ef_search: Optional[int] = None,
+                   mode: str = "dense"):
+    """Run one search in the given mode, serving repeats from the result cache"""
+    cache_key = (query, top_k, subject_id_filter, nprobe, ef_search, mode, vector_store.generation)
+    results = search_result_cache.get(cache_key)
+    
+    if results is None:
+        if mode == "lexical":
+            # Keyword lookup only; no embedding request to Ollama
+            with SEARCH_STAGE_SECONDS.time(stage="search", mode=mode):
+                results = await vector_store.run_in_executor(
+                    vector_store.lexical_search,
+                    query=query,
+                    top_k=top_k,
+                    subject_id_filter=subject_id_filter
+                )
+        else:
+            # Generate embedding for the query
+            with SEARCH_STAGE_SECONDS.time(stage="embed", mode=mode):
+                query_embedding = await embedding_service.get_query_embedding(query)
+            
+            search_start = time.perf_counter()
+            if mode == "hybrid":
+                results = await vector_store.run_in_executor(
+                    vector_store.hybrid_search,
+                    query=query,
+                    query_embedding=query_embedding,
+                    top_k=top_k,
+                    subject_id_filter=subject_id_filter,
+                    nprobe=nprobe,
+                    ef_search=ef_search
+                )
+            else:
+                # Search in vector store
+                results = await vector_store.run_in_executor(
+                    vector_store.search,
+                    query_embedding=query_embedding,
+                    top_k=top_k,
+                    subject_id_filter=subject_id_filter,
+                    nprobe=nprobe,
+                    ef_search=ef_search
+                )
+            SEARCH_STAGE_SECONDS.observe(time.perf_counter() - search_start, stage="search", mode=mode)
+        search_result_cache.put(cache_key, results)
+        
+        logger.info(f"Found {len(results)} similar records")
+    else:
+        logger.info(f"Served {len(results)} cached results")
+    
+    return results
+
 @app.get("/search", response_model=SearchResponse)
 async def search_similar(
     query: str,
     top_k: int = 5,
-    subject_id: Optional[str] = None
+    subject_id: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: str = "dense"
 ):
-    """Search for similar clinical records"""
+    """Search for similar clinical records (dense, lexical BM25, or hybrid)"""
     try:
         if not embedding_service or not vector_store:
             raise HTTPException(status_code=500, detail="Services not initialized")
         
-        logger.info(f"Searching for: '{query}' with top_k={top_k}, subject_id={subject_id}")
+        if mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        
+        logger.info(f"Searching for: '{query}' with top_k={top_k}, subject_id={subject_id}, mode={mode}")
         
         if not vector_store.is_initialized():
             raise HTTPException(status_code=400, detail="Vector store not initialized. Please vectorize data first.")
         
-        # Check if vector store has any data
-        stats = vector_store.get_stats()
-        if stats["total_vectors"] == 0:
+        # Check if vector store has any data (without the full metadata scan in get_stats)
+        if vector_store.index.ntotal == 0:
             raise HTTPException(status_code=400, detail="No vectors in store. Please vectorize data first.")
         
-        # Generate embedding for the query
-        query_embedding = await embedding_service.get_embedding(query)
+        results = await retrieve(query, top_k, int(subject_id) if subject_id else None, nprobe, ef_search, mode)
         
-        # Search in vector store
-        results = vector_store.search(
-            query_embedding=query_embedding,
-            top_k=top_k,
-            subject_id_filter=int(subject_id) if subject_id else None
-        )
+        # Serialize here rather than in FastAPI so the cost shows up as its own stage
+        with SEARCH_STAGE_SECONDS.time(stage="serialize", mode=mode):
+            return JSONResponse(content=SearchResponse(
+                success=True,
+                results=results,
+                query=query,
+                total_results=len(results),
+                mode=mode
+            ).dict())
         
-        logger.info(f"Found {len(results)} similar records")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Search failed: {e}")
+        error_message = str(e)
+        if "Metal backend" in error_message or "failed to create command queue" in error_message:
+            error_message += " - Try restarting Ollama with: OLLAMA_NUM_GPU=0 ollama serve"
+        raise HTTPException(status_code=500, detail=f"Search failed: {error_message}")
+
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    """Run many searches at once, embedding queries in batches and searching each
+    batch with one FAISS call. Results come back in query order, or as NDJSON lines
+    (tagged with the query's position) as each batch completes when stream is set."""
+    try:
+        if not embedding_service or not vector_store:
+            raise HTTPException(status_code=500, detail="Services not initialized")
         
-        return SearchResponse(
+        for item in request.queries:
+            if item.mode not in SEARCH_MODES:
+                raise HTTPException(status_code=400, detail=f"Unknown search mode '{item.mode}', expected one of {SEARCH_MODES}")
+        
+        if not vector_store.is_initialized():
+            raise HTTPException(status_code=400, detail="Vector store not initialized. Please vectorize data first.")
+        
+        if vector_store.index.ntotal == 0:
+            raise HTTPException(status_code=400, detail="No vectors in store. Please vectorize data first.")
+        
+        logger.info(f"Batch search for {len(request.queries)} queries")
+        
+        def make_response(item, results):
+            return SearchResponse(
+                success=True,
+                results=results,
+                query=item.query,
+                total_results=len(results),
+                mode=item.mode
+            )
+        
+        async def run_batches():
+            """Yield (position, SearchResponse) as each query's results become available"""
+            generation = vector_store.generation
+            pending = []
+            
+            # Cached and lexical-only queries are answered without embedding
+            for position, item in enumerate(request.queries):
+                cache_key = (item.query, item.top_k, item.subject_id, request.nprobe, request.ef_search, item.mode, generation)
+                results = search_result_cache.get(cache_key)
+                if results is None and item.mode == "lexical":
+                    results = await vector_store.run_in_executor(
+                        vector_store.lexical_search,
+                        query=item.query,
+                        top_k=item.top_k,
+                        subject_id_filter=item.subject_id
+                    )
+                    search_result_cache.put(cache_key, results)
+                
+                if results is not None:
+                    yield position, make_response(item, results)
+                else:
+                    pending.append((position, item, cache_key))
+            
+            for start in range(0, len(pending), search_batch_size):
+                group = pending[start:start + search_batch_size]
+                query_embeddings = await embedding_service.get_query_embeddings([item.query for _, item, _ in group])
+                group_results = await vector_store.run_in_executor(
+                    vector_store.search_batch,
+                    query_embeddings=query_embeddings,
+                    top_ks=[item.top_k for _, item, _ in group],
+                    subject_id_filters=[item.subject_id for _, item, _ in group],
+                    nprobe=request.nprobe,
+                    ef_search=request.ef_search,
+                    lexical_queries=[item.query if item.mode == "hybrid" else None for _, item, _ in group]
+                )
+                for (position, item, cache_key), results in zip(group, group_results):
+                    search_result_cache.put(cache_key, results)
+                    yield position, make_response(item, results)
+        
+        if request.stream:
+            async def generate_results():
+                try:
+                    async for position, response in run_batches():
+                        yield f"{json.dumps({'index': position, **response.dict()})}\n"
+                except Exception as e:
+                    logger.error(f"Batch search failed: {e}")
+                    yield f"{json.dumps({'success': False, 'error': str(e)})}\n"
+            
+            return StreamingResponse(
+                generate_results(),
+                media_type="application/x-ndjson",
+                headers={"Cache-Control": "no-cache"}
+            )
+        
+        responses = [None] * len(request.queries)
+        async for position, response in run_batches():
+            responses[position] = response
+        
+        return BatchSearchResponse(
             success=True,
-            results=results,
-            query=query,
-            total_results=len(results)
+            results=responses,
+            total_queries=len(responses)
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Search failed: {e}")
+        logger.error(f"Batch search failed: {e}")
         error_message = str(e)
         if "Metal backend" in error_message or "failed to create command queue" in error_message:
             error_message += " - Try restarting Ollama with: OLLAMA_NUM_GPU=0 ollama serve"
-        raise HTTPException(status_code=500, detail=f"Search failed: {error_message}")
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {error_message}")
+
+@app.post("/rag")
+async def rag(request: RAGRequest):
+    """Retrieve records for a query and stream the LLM's answer token by token.
+    
+    Emits a `sources` event with the retrieved records, a `token` event per
+    generated fragment and a final `done` event with per-stage timings, as NDJSON
+    lines or Server-Sent Events depending on `format`."""
+    try:
+        if not embedding_service or not vector_store or not llm_service:
+            raise HTTPException(status_code=500, detail="Services not initialized")
+        
+        if request.mode not in SEARCH_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown search mode '{request.mode}', expected one of {SEARCH_MODES}")
+        
+        if request.format not in ("ndjson", "sse"):
+            raise HTTPException(status_code=400, detail=f"Unknown stream format '{request.format}', expected 'ndjson' or 'sse'")
+        
+        if not vector_store.is_initialized() or vector_store.index.ntotal == 0:
+            raise HTTPException(status_code=400, detail="No vectors in store. Please vectorize data first.")
+        
+        logger.info(f"RAG query: '{request.query}' with top_k={request.top_k}, subject_id={request.subject_id}, mode={request.mode}")
+        
+        def format_event(event: str, data: dict) -> str:
+            if request.format == "sse":
+                return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            return f"{json.dumps({'type': event, **data})}\n"
+        
+        async def generate_answer():
+            timings = {}
+            start_time = time.perf_counter()
+            try:
+                results = await retrieve(request.query, request.top_k, request.subject_id, mode=request.mode)
+                timings["retrieval_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+                yield format_event("sources", {
+                    "results": [result.dict() for result in results],
+                    "retrieval_ms": timings["retrieval_ms"]
+                })
+                
+                prompt_start = time.perf_counter()
+                context = llm_service.context_builder.build(request.query, [result.dict() for result in results])
+                messages = llm_service.build_messages(request.query, context.records)
+                timings["prompt_build_ms"] = round((time.perf_counter() - prompt_start) * 1000, 1)
+                
+                llm_start = time.perf_counter()
+                model_used = request.model or llm_service.default_model
+                final = {}
+                async for chunk in llm_service.stream_chat(messages, model=request.model):
+                    content = (chunk.get("message") or {}).get("content", "")
+                    if content:
+                        if "first_token_ms" not in timings:
+                            # Time-to-first-token, from the start of the request
+                            timings["first_token_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+                            timings["llm_first_token_ms"] = round((time.perf_counter() - llm_start) * 1000, 1)
+                        yield format_event("token", {"content": content})
+                    if chunk.get("done"):
+                        final = chunk
+                        model_used = chunk.get("model", model_used)
+                
+                timings["generation_ms"] = round((time.perf_counter() - llm_start) * 1000, 1)
+                timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+                logger.info(f"RAG answer streamed with timings {timings}")
+                
+                yield format_event("done", {
+                    "model_used": model_used,
+                    "timings": timings,
+                    "context": {
+                        "records_used": len(context.records),
+                        "estimated_tokens": context.estimated_tokens,
+                        "duplicates_dropped": context.duplicates_dropped,
+                        "records_trimmed": context.records_trimmed,
+                        "records_omitted": context.records_omitted
+                    },
+                    "prompt_tokens": final.get("prompt_eval_count"),
+                    "completion_tokens": final.get("eval_count")
+                })
+            except Exception as e:
+                logger.error(f"RAG generation failed: {e}")
+                yield format_event("error", {"error": str(e), "timings": timings})
+        
+        return StreamingResponse(
+            generate_answer(),
+            media_type="text/event-stream" if request.format == "sse" else "application/x-ndjson",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"RAG request failed: {e}")
+        raise HTTPException(status_code=500, detail=f"RAG request failed: {str(e)}")
 
 @app.get("/stats", response_model=StatsResponse)
 async def get_stats():
@@ -297,16 +897,25 @@ async def get_stats():
                 total_vectors=0,
                 vector_dimension=768,
                 unique_subjects=0,
-                store_size_mb=0.0
+                store_size_mb=0.0,
+                index_type=vector_store.index_type,
+                vector_encoding=vector_store.vector_encoding
             )
         
-        stats = vector_store.get_stats()
+        stats = await vector_store.run_in_executor(vector_store.get_stats)
         
         return StatsResponse(
             total_vectors=stats["total_vectors"],
             vector_dimension=stats["vector_dimension"],
             unique_subjects=stats["unique_subjects"],
-            store_size_mb=stats["store_size_mb"]
+            store_size_mb=stats["store_size_mb"],
+            index_type=stats["index_type"],
+            linked_duplicates=stats["linked_duplicates"],
+            tombstoned_vectors=stats["tombstoned_vectors"],
+            snapshot_generation=stats["snapshot_generation"],
+            shards=stats.get("shards"),
+            vector_encoding=stats["vector_encoding"],
+            exact_rerank=stats.get("exact_rerank", False)
         )
         
     except HTTPException:
@@ -318,11 +927,12 @@ async def get_stats():
 @app.delete("/clear", response_model=ClearResponse)
 async def clear_vector_store():
     """Clear the vector store"""
+    require_writer()
     try:
         if not vector_store:
             raise HTTPException(status_code=500, detail="Vector store not initialized")
         
-        vector_store.clear()
+        await vector_store.run_in_executor(vector_store.clear)
         logger.info("Vector store cleared successfully")
         
         return ClearResponse(
@@ -336,21 +946,105 @@ async def clear_vector_store():
         logger.error(f"Failed to clear vector store: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to clear vector store: {str(e)}")
 
+@app.post("/index/convert", response_model=IndexConvertResponse)
+async def convert_index(index_type: str, encoding: Optional[str] = None):
+    """Rebuild the vector index as another type (flat, ivf_flat, ivf_pq, hnsw) and encoding (float32, fp16, int8) without re-embedding"""
+    require_writer()
+    try:
+        if not vector_store:
+            raise HTTPException(status_code=500, detail="Vector store not initialized")
+        
+        await vector_store.run_in_executor(vector_store.convert_index, index_type, encoding)
+        await vector_store.run_in_executor(vector_store.save_index, snapshot=True)
+        
+        return IndexConvertResponse(
+            success=True,
+            message=f"Vector index converted to {vector_store.current_encoding()} {index_type}",
+            index_type=vector_store.current_index_type(),
+            total_vectors=vector_store.index.ntotal,
+            vector_encoding=vector_store.current_encoding()
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to convert index: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to convert index: {str(e)}")
+
+@app.post("/index/rebuild", response_model=IndexConvertResponse)
+async def rebuild_index(shard: Optional[int] = None):
+    """Rebuild the index shards holding deleted (tombstoned) vectors, or one given shard, in the background"""
+    require_writer()
+    try:
+        if not vector_store or not vector_store.is_initialized():
+            raise HTTPException(status_code=500, detail="Vector store not initialized")
+        
+        tombstoned = len(vector_store.tombstones)
+        await vector_store.run_in_executor(vector_store.rebuild_index, background=True, shard=shard)
+        stats = await vector_store.run_in_executor(vector_store.get_stats)
+        
+        if shard is not None:
+            message = f"Rebuilding shard {shard}"
+        elif tombstoned:
+            message = f"Rebuilding index without {tombstoned} deleted vectors"
+        else:
+            message = "No deleted vectors to drop"
+        return IndexConvertResponse(
+            success=True,
+            message=message,
+            index_type=vector_store.current_index_type(),
+            total_vectors=stats["total_vectors"],
+            vector_encoding=vector_store.current_encoding()
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to rebuild index: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild index: {str(e)}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/debug/info")
 async def debug_info():
     """Debug endpoint to check service status"""
+    vector_store_stats = None
+    if vector_store and vector_store.is_initialized():
+        vector_store_stats = await vector_store.run_in_executor(vector_store.get_stats)
     return {
         "embedding_service_initialized": embedding_service is not None,
         "vector_store_initialized": vector_store is not None and vector_store.is_initialized(),
-        "vector_store_stats": vector_store.get_stats() if vector_store and vector_store.is_initialized() else None,
-        "ollama_status": await embedding_service.check_ollama_connection() if embedding_service else False
+        "vector_store_stats": vector_store_stats,
+        "ollama_status": await embedding_service.check_ollama_connection() if embedding_service else False,
+        "embedding_http_pool": embedding_service.get_pool_stats() if embedding_service else None,
+        "llm_http_pool": llm_service.get_pool_stats() if llm_service else None,
+        "embedding_concurrency": embedding_service.get_concurrency_stats() if embedding_service else None,
+        "embedding_cache": embedding_service.get_cache_stats() if embedding_service else None,
+        "query_embedding_cache": embedding_service.get_query_cache_stats() if embedding_service else None,
+        "search_result_cache": search_result_cache.get_stats(),
+        "vector_store_role": vector_store_role,
+        "shard_layout": vector_store.index.layout.tag if vector_store and vector_store.is_initialized() else None,
+        "lexical_index": vector_store.lexical_index.get_stats() if vector_store else None,
+        "jobs": await job_manager.get_stats() if job_manager else None,
+        "near_duplicates": near_duplicate_detector.get_config() if near_duplicate_detector else None
     }
 
 if __name__ == "__main__":
+    # Only read-only workers can share the port as several processes; the writer
+    # owns the vector log and metadata transaction, so there is exactly one
+    workers = int(os.getenv("WORKERS", "1")) if vector_store_role == "reader" else 1
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
-        port=8000,
-        reload=True,
+        port=int(os.getenv("PORT", "8000")),
+        reload=workers == 1,
+        workers=workers,
         log_level="info"
     )
\ No newline at end of file
@@ -10,6 +10,8 @@ class MimicRecord(BaseModel):
 
 class VectorSearchResult(MimicRecord):
     similarity_score: float
+    matched_text: Optional[str] = None  # best-matching chunk, when the note was chunked
+    duplicate_note_ids: List[str] = []  # near-duplicates linked to this note instead of being embedded
 
 class VectorizeRequest(BaseModel):
     records: List[MimicRecord]
@@ -19,11 +21,74 @@ class VectorizeResponse(BaseModel):
     message: str
     vectorized_count: int
 
+class UploadVectorizeResponse(VectorizeResponse):
+    upload_format: str
+    rows_read: int
+    rows_invalid: int
+    skipped_count: int = 0
+    duplicate_count: int = 0
+    failed_count: int = 0
+    errors: List[str] = []  # first few row validation errors
+
+class NoteUpsertResponse(BaseModel):
+    success: bool
+    message: str
+    note_id: str
+    replaced: bool  # False when the note was not stored before
+    vectors_stored: int
+
+class NoteDeleteResponse(BaseModel):
+    success: bool
+    message: str
+    notes_deleted: int
+    vectors_deleted: int
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed, failed or cancelled
+    progress: int
+    total: int
+    processed: int
+    vectorized: int
+    failed: int
+    skipped: int
+    duplicates: int = 0
+    chunks: int
+    attempts: int
+    message: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    updated_at: float
+    finished_at: Optional[float] = None
+
+class JobListResponse(BaseModel):
+    jobs: List[JobStatusResponse]
+    total_jobs: int
+
 class SearchResponse(BaseModel):
     success: bool
     results: List[VectorSearchResult]
     query: str
     total_results: int
+    mode: str = "dense"
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    top_k: int = 5
+    subject_id: Optional[int] = None
+    mode: str = "dense"
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    stream: bool = False  # stream one NDJSON line per query as results complete
+
+class BatchSearchResponse(BaseModel):
+    success: bool
+    results: List[SearchResponse]
+    total_queries: int
 
 class HealthResponse(BaseModel):
     status: str
@@ -36,16 +101,38 @@ class StatsResponse(BaseModel):
     vector_dimension: int
     unique_subjects: int
     store_size_mb: float
+    index_type: str = "flat"
+    linked_duplicates: int = 0
+    tombstoned_vectors: int = 0  # deleted from an HNSW index but not yet rebuilt away
+    snapshot_generation: Optional[int] = None  # published generation written or served, when publishing
+    shards: Optional[List[int]] = None  # vectors per index shard, when sharded
+    vector_encoding: str = "float32"  # float32, fp16 or int8 (pq for IVF-PQ)
+    exact_rerank: bool = False  # hits rescored with full-precision vectors
 
 class ClearResponse(BaseModel):
     success: bool
     message: str
 
+class IndexConvertResponse(BaseModel):
+    success: bool
+    message: str
+    index_type: str
+    total_vectors: int
+    vector_encoding: str = "float32"
+
 class LLMRequest(BaseModel):
     query: str
     context_records: List[dict]
     model: Optional[str] = None
 
+class RAGRequest(BaseModel):
+    query: str
+    top_k: int = 5
+    subject_id: Optional[int] = None
+    mode: str = "dense"
+    model: Optional[str] = None
+    format: str = "ndjson"  # "ndjson" or "sse"
+
 class LLMResponse(BaseModel):
     success: bool
     response: str
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit driven by observed request latency and errors.
+
+    The limit grows by roughly one slot per window of successful requests while
+    latency stays close to the best recently observed latency, and shrinks
+    multiplicatively on errors or when latency degrades (the server is queueing).
+    """
+
+    def __init__(self,
+                 initial_limit: int = 4,
+                 min_limit: int = 1,
+                 max_limit: int = 16,
+                 latency_tolerance: float = 2.0,
+                 backoff_ratio: float = 0.7,
+                 smoothing: float = 0.2):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        self.smoothed_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.total_requests = 0
+        self.total_errors = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        """Create the condition lazily so it binds to the running event loop"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        """Wait until a request slot is available under the current limit"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, success: bool):
+        """Release a slot and adjust the limit from the request outcome"""
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._update(latency, success)
+            condition.notify_all()
+
+    def _update(self, latency: float, success: bool):
+        """Apply additive increase / multiplicative decrease to the limit"""
+        self.total_requests += 1
+        self.error_rate = (1 - self.smoothing) * self.error_rate + self.smoothing * (0.0 if success else 1.0)
+
+        if not success:
+            self.total_errors += 1
+            self._decrease("request failed")
+            return
+
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency = (1 - self.smoothing) * self.smoothed_latency + self.smoothing * latency
+
+        # Let the baseline drift upwards slowly so a permanently slower server is re-learned
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency = min(latency, self.baseline_latency * 1.01)
+
+        if self.smoothed_latency > self.baseline_latency * self.latency_tolerance:
+            self._decrease(f"latency {self.smoothed_latency:.2f}s above baseline {self.baseline_latency:.2f}s")
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def _decrease(self, reason: str):
+        """Shrink the limit multiplicatively, never below min_limit"""
+        new_limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+        if int(new_limit) < int(self.limit):
+            logger.info(f"Reducing embedding concurrency to {int(new_limit)}: {reason}")
+        self.limit = new_limit
+        # Reset the smoothed latency so one slow burst does not keep shrinking the limit
+        if self.baseline_latency is not None:
+            self.smoothed_latency = self.baseline_latency
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the current limit and the signals driving it"""
+        return {
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "smoothed_latency_s": round(self.smoothed_latency, 4) if self.smoothed_latency is not None else None,
+            "baseline_latency_s": round(self.baseline_latency, 4) if self.baseline_latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors
+        }
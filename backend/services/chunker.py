@@ -0,0 +1,109 @@
+import logging
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Section headers in MIMIC notes, e.g. "Chief Complaint:" or "DISCHARGE MEDICATIONS:" at line start
+SECTION_HEADER = re.compile(r"(?m)^[ \t]*[A-Z][A-Za-z0-9 /&(),'-]{1,60}:")
+
+# Preferred cut points inside an oversized section, best first
+BREAK_PATTERNS = (re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"[.!?;]\s"), re.compile(r"\s"))
+WHITESPACE = re.compile(r"\s")
+
+@dataclass
+class Chunk:
+    text: str
+    start: int  # character offset of the chunk in the original note
+    chunk_index: int
+
+class NoteChunker:
+    """Split clinical notes into overlapping, section-aware chunks for embedding.
+
+    Notes are first split at section headers. Sections are packed together up to
+    chunk_size characters, and sections longer than that are windowed with
+    chunk_overlap characters of overlap, cutting at paragraph, line or sentence
+    boundaries where possible.
+    """
+
+    def __init__(self, chunk_size: int = 2000, chunk_overlap: int = 200, min_chunk_size: int = 200):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_chunk_size = min_chunk_size
+
+    def split(self, text: str) -> List[Chunk]:
+        """Split a note into chunks; short notes come back as a single chunk"""
+        spans = self._pack(self._units(text))
+
+        chunks = []
+        for start, end in spans:
+            # Trim surrounding whitespace but keep offsets pointing into the original text
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end > start:
+                chunks.append(Chunk(text=text[start:end], start=start, chunk_index=len(chunks)))
+
+        if not chunks:
+            chunks.append(Chunk(text=text.strip(), start=0, chunk_index=0))
+        return chunks
+
+    def _units(self, text: str) -> List[Tuple[int, int]]:
+        """Sections of the note, with oversized sections windowed into pieces"""
+        boundaries = sorted({0, *(match.start() for match in SECTION_HEADER.finditer(text))})
+        boundaries.append(len(text))
+
+        units = []
+        for start, end in zip(boundaries, boundaries[1:]):
+            if end - start <= self.chunk_size:
+                units.append((start, end))
+            else:
+                units.extend(self._window(text, start, end))
+        return units
+
+    def _window(self, text: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """Overlapping windows over an oversized span, cut at natural boundaries"""
+        windows = []
+        position = start
+        while position < end:
+            limit = min(position + self.chunk_size, end)
+            cut = limit
+            if limit < end:
+                # Look for a break in the last part of the window only
+                search_from = position + (self.chunk_size * 3) // 4
+                for pattern in BREAK_PATTERNS:
+                    matches = list(pattern.finditer(text, search_from, limit))
+                    if matches:
+                        cut = matches[-1].end()
+                        break
+            windows.append((position, cut))
+            if cut >= end:
+                break
+            # Start the overlap on a word boundary
+            overlap_start = max(cut - self.chunk_overlap, position + 1)
+            space = WHITESPACE.search(text, overlap_start, cut)
+            position = space.end() if space else overlap_start
+        return windows
+
+    def _pack(self, units: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Greedily merge consecutive units into chunks of at most chunk_size"""
+        spans: List[Tuple[int, int]] = []
+        for start, end in units:
+            if spans:
+                last_start, last_end = spans[-1]
+                # Units only overlap when they are windows of the same section
+                if start >= last_end and end - last_start <= self.chunk_size:
+                    spans[-1] = (last_start, end)
+                    continue
+            spans.append((start, end))
+
+        # Fold a tiny trailing chunk into its predecessor
+        if len(spans) > 1 and spans[-1][1] - spans[-1][0] < self.min_chunk_size:
+            tail_start, tail_end = spans.pop()
+            last_start, last_end = spans[-1]
+            spans[-1] = (last_start, max(last_end, tail_end))
+        return spans
@@ -0,0 +1,148 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Set
+
+from services.chunker import NoteChunker
+from services.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Marker placed where passages were cut out of a trimmed note
+OMISSION_MARKER = "\n[...]\n"
+
+@dataclass
+class BuiltContext:
+    records: List[Dict[str, Any]]
+    estimated_tokens: int = 0
+    duplicates_dropped: int = 0
+    records_trimmed: int = 0
+    records_omitted: int = 0
+    dropped_note_ids: List[str] = field(default_factory=list)
+
+class ContextBuilder:
+    """Fit retrieved records into a token budget for the LLM prompt.
+
+    Records are taken in rank order. Near-duplicates of a higher-ranked record
+    (copy-forward notes) are dropped, and notes longer than their share of the
+    budget are cut down to the passages that best match the query. Tokens are
+    estimated from character counts, which is close enough for budgeting.
+    """
+
+    def __init__(self,
+                 max_context_tokens: int = 3000,
+                 chars_per_token: float = 4.0,
+                 record_overhead_tokens: int = 40,
+                 min_record_tokens: int = 100,
+                 passage_chars: int = 600,
+                 duplicate_threshold: float = 0.85,
+                 shingle_size: int = 3):
+        self.max_context_tokens = max_context_tokens
+        self.chars_per_token = chars_per_token
+        self.record_overhead_tokens = record_overhead_tokens
+        self.min_record_tokens = min_record_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.shingle_size = shingle_size
+        self.passage_splitter = NoteChunker(chunk_size=passage_chars, chunk_overlap=0, min_chunk_size=passage_chars // 4)
+
+    def estimate_tokens(self, text: str) -> int:
+        """Approximate token count of a text"""
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def build(self, query: str, records: List[Dict[str, Any]]) -> BuiltContext:
+        """Select and trim records (best first) so the context fits max_context_tokens"""
+        context = BuiltContext(records=[])
+        query_terms = set(tokenize(query))
+
+        # Drop records that repeat a higher-ranked one
+        unique_records = []
+        kept_shingles: List[Set[int]] = []
+        for record in records:
+            shingles = self._shingles(record.get('cleaned_text') or "")
+            if any(self._jaccard(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                context.duplicates_dropped += 1
+                context.dropped_note_ids.append(record.get('note_id'))
+                continue
+            kept_shingles.append(shingles)
+            unique_records.append(record)
+
+        remaining = self.max_context_tokens
+        for position, record in enumerate(unique_records):
+            # Split what is left evenly over the records still to place, so short
+            # records leave more room for the ones after them
+            share = remaining // (len(unique_records) - position)
+            text_budget = share - self.record_overhead_tokens
+            if text_budget < self.min_record_tokens:
+                context.records_omitted = len(unique_records) - position
+                context.dropped_note_ids.extend(r.get('note_id') for r in unique_records[position:])
+                break
+
+            text = record.get('cleaned_text') or ""
+            if self.estimate_tokens(text) > text_budget:
+                text = self._trim(text, query_terms, record.get('matched_text'), text_budget)
+                context.records_trimmed += 1
+
+            used = self.estimate_tokens(text) + self.record_overhead_tokens
+            remaining -= used
+            context.estimated_tokens += used
+            context.records.append({**record, 'cleaned_text': text})
+
+        logger.info(f"Built context with {len(context.records)} records (~{context.estimated_tokens} tokens), "
+                    f"dropped {context.duplicates_dropped} duplicates, trimmed {context.records_trimmed}, "
+                    f"omitted {context.records_omitted}")
+        return context
+
+    def _shingles(self, text: str) -> Set[int]:
+        """Hashed word n-grams used to compare notes"""
+        tokens = tokenize(text)
+        if len(tokens) < self.shingle_size:
+            return {hash(" ".join(tokens))} if tokens else set()
+        return {hash(" ".join(tokens[i:i + self.shingle_size])) for i in range(len(tokens) - self.shingle_size + 1)}
+
+    @staticmethod
+    def _jaccard(a: Set[int], b: Set[int]) -> float:
+        """Set overlap between two shingle sets"""
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def _trim(self, text: str, query_terms: Set[str], matched_text: str, token_budget: int) -> str:
+        """Keep the passages that best match the query, in their original order"""
+        passages = self.passage_splitter.split(text)
+
+        # The chunk that matched the search is a strong hint even without shared terms
+        matched_start = text.find(matched_text) if matched_text else -1
+        matched_end = matched_start + len(matched_text) if matched_start >= 0 else -1
+
+        scored = []
+        for passage in passages:
+            term_counts: Dict[str, int] = {}
+            for token in tokenize(passage.text):
+                if token in query_terms:
+                    term_counts[token] = term_counts.get(token, 0) + 1
+            score = sum(1.0 + math.log(count) for count in term_counts.values())
+            if matched_start <= passage.start < matched_end:
+                score += 1.0
+            scored.append((score, passage))
+
+        selected = []
+        used = 0
+        for score, passage in sorted(scored, key=lambda item: (-item[0], item[1].chunk_index)):
+            cost = self.estimate_tokens(passage.text) + self.estimate_tokens(OMISSION_MARKER)
+            if used + cost > token_budget:
+                continue
+            selected.append(passage)
+            used += cost
+
+        if not selected:
+            # Even the best passage is too long; cut it at a word boundary
+            best = max(scored, key=lambda item: item[0])[1].text
+            cut = best[:int(token_budget * self.chars_per_token)]
+            return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+        selected.sort(key=lambda passage: passage.chunk_index)
+        parts = [selected[0].text]
+        for previous, passage in zip(selected, selected[1:]):
+            parts.append("\n" if passage.chunk_index == previous.chunk_index + 1 else OMISSION_MARKER)
+            parts.append(passage.text)
+        return "".join(parts)
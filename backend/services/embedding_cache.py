@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """On-disk, content-addressed embedding cache with LRU eviction.
+
+    Entries are keyed by a hash of (model name, normalized text), so an identical
+    note is only embedded once regardless of its note_id. Switching the model
+    purges the cache because vectors from different models are not comparable.
+    """
+
+    def __init__(self,
+                 cache_path: str = "embedding_cache.db",
+                 model_name: str = "",
+                 max_entries: int = 200_000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Lookups and writes run on worker threads and share one connection
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+        stored = self._conn.execute("SELECT value FROM meta WHERE name = 'model_name'").fetchone()
+        if stored is None or stored[0] != model_name:
+            self.set_model(model_name)
+
+        logger.info(f"Opened embedding cache at {cache_path} with {self._count} entries")
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Collapse whitespace so formatting-only differences share a cache entry"""
+        return " ".join(text.split())
+
+    def make_key(self, text: str) -> str:
+        """Content hash of (model name, normalized text)"""
+        digest = hashlib.sha256()
+        digest.update(self.model_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(self.normalize_text(text).encode("utf-8"))
+        return digest.hexdigest()
+
+    def set_model(self, model_name: str):
+        """Switch models, dropping every entry computed with the previous one"""
+        with self._lock:
+            if self._count:
+                logger.info(f"Embedding model changed to {model_name}, invalidating {self._count} cached embeddings")
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('model_name', ?)", (model_name,)
+            )
+            self._conn.commit()
+            self.model_name = model_name
+            self._count = 0
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for texts, returning None for misses"""
+        with self._lock:
+            keys = [self.make_key(text) for text in texts]
+            found: Dict[str, np.ndarray] = {}
+
+            unique_keys = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).copy()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for result in results if result is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+            return results
+
+    def put_many(self, texts: List[str], embeddings: List[np.ndarray]):
+        """Store embeddings for texts, evicting least recently used entries if full"""
+        if not texts:
+            return
+
+        with self._lock:
+            now = time.time()
+            rows = [
+                (self.make_key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                for text, embedding in zip(texts, embeddings)
+            ]
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._count += self._conn.total_changes - before
+            self._conn.commit()
+
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Drop the least recently used entries down to 90% of capacity"""
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.evictions += excess
+        logger.info(f"Evicted {excess} least recently used embeddings from cache")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        size_bytes = os.path.getsize(self.cache_path) if os.path.exists(self.cache_path) else 0
+        return {
+            "model_name": self.model_name,
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_mb": round(size_bytes / (1024 * 1024), 2)
+        }
+
+    def close(self):
+        """Close the SQLite connection"""
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Failed to close embedding cache: {e}")
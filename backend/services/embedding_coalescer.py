@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCoalescer:
+    """Merge concurrent single-text embedding requests into batched calls.
+
+    The first request opens a short window (max_wait_ms); every request that
+    arrives before it closes, or until max_batch_size is reached, is sent to
+    Ollama in one multi-input call.
+    """
+
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], Awaitable[List[np.ndarray]]],
+                 max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.batches_sent = 0
+        self.requests_coalesced = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Queue a text for the next batch and wait for its embedding"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Send everything queued so far as one batch"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._run_batch(pending))
+
+    async def _run_batch(self, pending: List[Tuple[str, asyncio.Future]]):
+        """Embed a batch, de-duplicating identical texts, and resolve the waiters"""
+        unique_texts: Dict[str, int] = {}
+        for text, _ in pending:
+            unique_texts.setdefault(text, len(unique_texts))
+
+        self.batches_sent += 1
+        self.requests_coalesced += len(pending)
+
+        try:
+            embeddings = await self.embed_batch(list(unique_texts))
+        except Exception as e:
+            logger.error(f"Coalesced embedding batch of {len(pending)} failed: {e}")
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in pending:
+            if not future.done():
+                future.set_result(embeddings[unique_texts[text]])
+
+    def get_stats(self) -> Dict[str, float]:
+        """Get batching statistics"""
+        return {
+            "batches_sent": self.batches_sent,
+            "requests_coalesced": self.requests_coalesced,
+            "avg_batch_size": round(self.requests_coalesced / self.batches_sent, 2) if self.batches_sent else 0.0,
+            "pending": len(self._pending)
+        }
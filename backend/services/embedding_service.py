@@ -1,47 +1,140 @@
 import asyncio
 import logging
 import numpy as np
-from typing import List, Optional
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
 import httpx
 import json
 import time
 
+from services.adaptive_limiter import AdaptiveConcurrencyLimiter
+from services.embedding_cache import EmbeddingCache
+from services.embedding_coalescer import EmbeddingCoalescer
+from services.http_client import create_async_client, get_pool_stats
+from services.metrics import EMBEDDING_FAILURES, EMBEDDING_REQUEST_SECONDS, EMBEDDING_RETRIES, EMBEDDING_TEXTS
+from services.ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+async def iterate_items(items: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+    """Iterate a sync or async iterable from async code"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+class EmbedEndpointNotFound(Exception):
+    """Raised when the Ollama server does not expose an embedding endpoint"""
+    pass
+
 class EmbeddingService:
     def __init__(self, 
                  ollama_url: str = "http://localhost:11434",
-                 model_name: str = "nomic-embed-text:latest"):
+                 model_name: str = "nomic-embed-text:latest",
+                 max_connections: int = 10,
+                 max_keepalive_connections: int = 5,
+                 keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 5.0,
+                 request_timeout: float = 60.0,
+                 initial_concurrency: int = 4,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 8,
+                 embed_batch_size: int = 16,
+                 coalesce_max_batch: int = 16,
+                 coalesce_wait_ms: float = 5.0,
+                 cache_path: Optional[str] = "embedding_cache.db",
+                 cache_max_entries: int = 200_000,
+                 query_cache_size: int = 1024,
+                 query_cache_ttl: float = 3600.0):
         self.ollama_url = ollama_url
         self.model_name = model_name
         self.embedding_dimension = 768  # Nomic embedding dimension
         self.max_retries = 3
         self.retry_delay = 2  # seconds
+        
+        # Shared connection pool, created in start() and reused by every request
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Bounds the number of embedding requests in flight during bulk work
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=initial_concurrency,
+            min_limit=min_concurrency,
+            max_limit=min(max_concurrency, max_connections)
+        )
+        
+        # Texts per /api/embed call; None until the endpoint has been probed
+        self.embed_batch_size = embed_batch_size
+        self.embed_api_supported: Optional[bool] = None
+        
+        # Merges concurrent query embeddings arriving within a few milliseconds
+        self.coalescer = EmbeddingCoalescer(
+            self.get_embeddings,
+            max_batch_size=coalesce_max_batch,
+            max_wait_ms=coalesce_wait_ms
+        )
+        
+        # Persistent content-addressed cache; hits skip the network call entirely
+        self.cache: Optional[EmbeddingCache] = None
+        if cache_path:
+            try:
+                self.cache = EmbeddingCache(cache_path, model_name=model_name, max_entries=cache_max_entries)
+            except Exception as e:
+                logger.error(f"Failed to open embedding cache, continuing without it: {e}")
+        
+        # In-process cache for repeated search queries
+        self.query_cache = TTLCache(max_size=query_cache_size, ttl_seconds=query_cache_ttl)
+    
+    async def start(self):
+        """Create the pooled HTTP client used for all Ollama requests"""
+        if self._client is None or self._client.is_closed:
+            self._client = create_async_client(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+                connect_timeout=self.connect_timeout,
+                request_timeout=self.request_timeout
+            )
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it if start() has not run yet"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        return self._client
+    
+    def get_pool_stats(self):
+        """Get connection pool usage for the embedding client"""
+        return get_pool_stats(self._client)
     
     async def check_ollama_connection(self) -> bool:
         """Check if Ollama is running and accessible"""
         try:
             logger.info(f"Checking Ollama connection at {self.ollama_url}")
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    # Check if embedding model is available
-                    models = [model.get('name', '') for model in data.get('models', [])]
-                    logger.info(f"Available models: {models}")
-                    
-                    # Check for nomic embedding model
-                    model_found = any(self.model_name in model for model in models)
-                    if not model_found:
-                        logger.warning(f"Model {self.model_name} not found. Attempting to pull...")
-                        await self._pull_model()
-                        return await self.check_ollama_connection()  # Recheck after pull
-                    
-                    logger.info(f"Ollama is running with {self.model_name} model")
-                    return True
-                else:
-                    logger.error(f"Ollama responded with status {response.status_code}")
-                    return False
+            client = await self._get_client()
+            response = await client.get(f"{self.ollama_url}/api/tags", timeout=10.0)
+            if response.status_code == 200:
+                data = response.json()
+                # Check if embedding model is available
+                models = [model.get('name', '') for model in data.get('models', [])]
+                logger.info(f"Available models: {models}")
+                
+                # Check for nomic embedding model
+                model_found = any(self.model_name in model for model in models)
+                if not model_found:
+                    logger.warning(f"Model {self.model_name} not found. Attempting to pull...")
+                    await self._pull_model()
+                    return await self.check_ollama_connection()  # Recheck after pull
+                
+                logger.info(f"Ollama is running with {self.model_name} model")
+                return True
+            else:
+                logger.error(f"Ollama responded with status {response.status_code}")
+                return False
         except Exception as e:
             logger.error(f"Failed to connect to Ollama: {e}")
             return False
@@ -50,15 +143,16 @@ class EmbeddingService:
         """Pull the embedding model if not available"""
         try:
             logger.info(f"Attempting to pull model: {self.model_name}")
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                response = await client.post(
-                    f"{self.ollama_url}/api/pull",
-                    json={"name": self.model_name}
-                )
-                if response.status_code == 200:
-                    logger.info(f"Successfully pulled model: {self.model_name}")
-                else:
-                    logger.error(f"Failed to pull model: {response.text}")
+            client = await self._get_client()
+            response = await client.post(
+                f"{self.ollama_url}/api/pull",
+                json={"name": self.model_name},
+                timeout=300.0
+            )
+            if response.status_code == 200:
+                logger.info(f"Successfully pulled model: {self.model_name}")
+            else:
+                logger.error(f"Failed to pull model: {response.text}")
         except Exception as e:
             logger.error(f"Error pulling model: {e}")
     
@@ -69,106 +163,341 @@ class EmbeddingService:
             await asyncio.sleep(3)
             
             # Test with a simple request
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                test_response = await client.post(
-                    f"{self.ollama_url}/api/embeddings",
-                    json={
-                        "model": self.model_name,
-                        "prompt": "test"
-                    }
-                )
-                return test_response.status_code == 200
+            client = await self._get_client()
+            test_response = await client.post(
+                f"{self.ollama_url}/api/embeddings",
+                json={
+                    "model": self.model_name,
+                    "prompt": "test"
+                },
+                timeout=30.0
+            )
+            return test_response.status_code == 200
         except Exception as e:
             logger.error(f"Ollama restart check failed: {e}")
             return False
     
-    async def get_embedding(self, text: str) -> np.ndarray:
-        """Generate embedding for a given text using Ollama with retry logic"""
-        # Clean and truncate text if too long
-        cleaned_text = text.strip()
-        if len(cleaned_text) > 8000:  # Limit text length
-            cleaned_text = cleaned_text[:8000]
+    def _prepare_text(self, text: str) -> str:
+        """Clean text before sending it to Ollama.
         
+        Notes are chunked before embedding, so text is not cut here; anything
+        longer than the model's context is truncated by Ollama itself.
+        """
+        return text.strip()
+    
+    async def _post_embedding_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST to an Ollama embedding endpoint with retry logic for Metal backend failures"""
+        texts = payload.get("input", [payload.get("prompt")])
+        EMBEDDING_TEXTS.observe(len(texts), endpoint=endpoint)
         for attempt in range(self.max_retries):
             try:
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(
-                        f"{self.ollama_url}/api/embeddings",
-                        json={
-                            "model": self.model_name,
-                            "prompt": cleaned_text
-                        }
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        embedding = np.array(result["embedding"], dtype=np.float32)
+                client = await self._get_client()
+                start_time = time.perf_counter()
+                response = await client.post(f"{self.ollama_url}{endpoint}", json=payload)
+                EMBEDDING_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start_time,
+                    endpoint=endpoint,
+                    outcome="success" if response.status_code == 200 else "error"
+                )
+                
+                if response.status_code == 200:
+                    return response.json()
+                
+                elif response.status_code == 404 and "model" not in response.text.lower():
+                    # Route missing entirely (older Ollama), as opposed to a missing model
+                    raise EmbedEndpointNotFound(f"Ollama endpoint {endpoint} not available")
+                
+                elif response.status_code == 500:
+                    error_text = response.text
+                    if "llama runner process has terminated" in error_text or "failed to create command queue" in error_text:
+                        logger.warning(f"Ollama Metal backend failure detected on attempt {attempt + 1}. This is likely due to GPU memory issues.")
                         
-                        # Normalize the embedding
-                        embedding = embedding / np.linalg.norm(embedding)
-                        return embedding
-                    
-                    elif response.status_code == 500:
-                        error_text = response.text
-                        if "llama runner process has terminated" in error_text or "failed to create command queue" in error_text:
-                            logger.warning(f"Ollama Metal backend failure detected on attempt {attempt + 1}. This is likely due to GPU memory issues.")
+                        if attempt < self.max_retries - 1:
+                            EMBEDDING_RETRIES.inc(reason="metal")
+                            logger.info(f"Waiting {self.retry_delay} seconds before retry...")
+                            await asyncio.sleep(self.retry_delay)
                             
-                            if attempt < self.max_retries - 1:
-                                logger.info(f"Waiting {self.retry_delay} seconds before retry...")
-                                await asyncio.sleep(self.retry_delay)
-                                
-                                # Check if Ollama recovered
-                                if await self._restart_ollama_if_needed():
-                                    logger.info("Ollama appears to have recovered, retrying...")
-                                    continue
-                                else:
-                                    logger.error("Ollama has not recovered, continuing with next attempt...")
-                                    continue
+                            # Check if Ollama recovered
+                            if await self._restart_ollama_if_needed():
+                                logger.info("Ollama appears to have recovered, retrying...")
+                                continue
                             else:
-                                raise Exception(f"Ollama Metal backend consistently failing. Please restart Ollama with CPU mode: 'OLLAMA_NUM_GPU=0 ollama serve'")
+                                logger.error("Ollama has not recovered, continuing with next attempt...")
+                                continue
                         else:
-                            raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+                            raise Exception(f"Ollama Metal backend consistently failing. Please restart Ollama with CPU mode: 'OLLAMA_NUM_GPU=0 ollama serve'")
                     else:
                         raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
-                        
+                else:
+                    raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+                    
+            except EmbedEndpointNotFound:
+                raise
             except Exception as e:
                 if attempt < self.max_retries - 1:
+                    EMBEDDING_RETRIES.inc(reason="error")
                     logger.warning(f"Embedding attempt {attempt + 1} failed: {e}. Retrying in {self.retry_delay} seconds...")
                     await asyncio.sleep(self.retry_delay)
                 else:
+                    EMBEDDING_FAILURES.inc(endpoint=endpoint)
                     logger.error(f"Failed to generate embedding after {self.max_retries} attempts: {e}")
                     raise
     
-    async def get_embeddings_batch(self, texts: List[str], batch_size: int = 5) -> List[np.ndarray]:
-        """Generate embeddings for multiple texts in batches with reduced batch size for stability"""
-        embeddings = []
-        failed_count = 0
+    def _cache_get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up texts in the cache, purging it first if the model changed"""
+        if self.cache.model_name != self.model_name:
+            self.cache.set_model(self.model_name)
+        return self.cache.get_many([self._prepare_text(text) for text in texts])
+    
+    async def _lookup_cache(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return cached embeddings for texts, None where not cached"""
+        if self.cache is None:
+            return [None] * len(texts)
+        try:
+            # SQLite reads block, so keep them off the event loop
+            return await asyncio.to_thread(self._cache_get_many, texts)
+        except Exception as e:
+            logger.error(f"Embedding cache lookup failed: {e}")
+            return [None] * len(texts)
+    
+    async def _store_cache(self, texts: List[str], embeddings: List[np.ndarray]):
+        """Store freshly computed embeddings in the cache"""
+        if self.cache is None:
+            return
+        try:
+            await asyncio.to_thread(self.cache.put_many, [self._prepare_text(text) for text in texts], embeddings)
+        except Exception as e:
+            logger.error(f"Embedding cache write failed: {e}")
+    
+    async def get_embedding(self, text: str) -> np.ndarray:
+        """Generate embedding for a given text using Ollama with retry logic"""
+        cached = (await self._lookup_cache([text]))[0]
+        if cached is not None:
+            return cached
+        return await self._fetch_embedding(text)
+    
+    async def _fetch_embedding(self, text: str) -> np.ndarray:
+        """Embed one text with /api/embeddings, skipping the cache lookup the caller already made"""
+        result = await self._post_embedding_request(
+            "/api/embeddings",
+            {
+                "model": self.model_name,
+                "prompt": self._prepare_text(text)
+            }
+        )
+        embedding = np.array(result["embedding"], dtype=np.float32)
         
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = []
-            
-            for text in batch:
-                try:
-                    embedding = await self.get_embedding(text)
-                    batch_embeddings.append(embedding)
-                    # Longer delay to prevent overwhelming Ollama
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Failed to process text in batch: {e}")
-                    failed_count += 1
-                    continue
+        # Normalize the embedding
+        embedding = embedding / np.linalg.norm(embedding)
+        await self._store_cache([text], [embedding])
+        return embedding
+    
+    async def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Generate embeddings for several texts, serving cache hits without a network call"""
+        embeddings = await self._lookup_cache(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fetched = await self._fetch_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = embedding
+        return embeddings
+    
+    async def _fetch_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Generate embeddings for several texts in one /api/embed call.
+        
+        Falls back to one /api/embeddings call per text, made in turn, on Ollama
+        versions that predate the multi-input endpoint. Results are written to
+        the cache.
+        """
+        if not texts:
+            return []
+        
+        if self.embed_api_supported is not False:
+            try:
+                result = await self._post_embedding_request(
+                    "/api/embed",
+                    {
+                        "model": self.model_name,
+                        "input": [self._prepare_text(text) for text in texts]
+                    }
+                )
+                self.embed_api_supported = True
+                
+                embeddings = np.array(result["embeddings"], dtype=np.float32)
+                if embeddings.shape[0] != len(texts):
+                    raise Exception(f"Ollama returned {embeddings.shape[0]} embeddings for {len(texts)} inputs")
+                
+                # Normalize the embeddings
+                embeddings = list(embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True))
+                await self._store_cache(texts, embeddings)
+                return embeddings
+            except EmbedEndpointNotFound:
+                logger.warning("Ollama does not support /api/embed, falling back to single-text /api/embeddings calls")
+                self.embed_api_supported = False
+        
+        # One request at a time: the caller holds a single limiter slot for the batch
+        return [await self._fetch_embedding(text) for text in texts]
+    
+    async def get_query_embedding(self, text: str) -> np.ndarray:
+        """Embed a search query, merging concurrent queries into one batched call"""
+        key = (self.model_name, text)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = await self.coalescer.embed(text)
+            self.query_cache.put(key, embedding)
+        return embedding
+    
+    async def get_query_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed many search queries, serving repeats from the query cache and
+        fetching the rest in concurrent micro-batches"""
+        embeddings = [self.query_cache.get((self.model_name, text)) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        
+        fetched = {}
+        async for text, embedding, error in self.embed_many(missing):
+            if error is not None:
+                raise error
+            fetched[text] = embedding
+            self.query_cache.put((self.model_name, text), embedding)
+        
+        return [embedding if embedding is not None else fetched[text] for text, embedding in zip(texts, embeddings)]
+    
+    async def embed_many(self,
+                         items: Union[Iterable[Any], AsyncIterable[Any]],
+                         text_getter: Optional[Callable[[Any], str]] = None,
+                         batch_size: Optional[int] = None
+                         ) -> AsyncIterator[Tuple[Any, Optional[np.ndarray], Optional[Exception]]]:
+        """Embed items concurrently, yielding (item, embedding, error) as each completes.
+        
+        Items are grouped into micro-batches of batch_size texts per Ollama call. The
+        number of calls in flight is bounded by the adaptive limiter, so the caller
+        can store finished embeddings while later ones are still being computed.
+        items may be an async iterable (e.g. rows parsed from an upload); it is only
+        read as fast as limiter slots free up. An error raised while reading items
+        is re-raised after the embeddings already started have been yielded.
+        """
+        if text_getter is None:
+            text_getter = lambda item: item
+        if batch_size is None:
+            batch_size = self.embed_batch_size
+        
+        results: asyncio.Queue = asyncio.Queue()
+        tasks = set()
+        done = object()
+        
+        async def embed_batch(batch):
+            start_time = time.perf_counter()
+            success = False
+            try:
+                embeddings = await self._fetch_embeddings([text_getter(item) for item in batch])
+                success = True
+                for item, embedding in zip(batch, embeddings):
+                    await results.put((item, embedding, None))
+            except Exception as e:
+                if len(batch) == 1:
+                    await results.put((batch[0], None, e))
+                else:
+                    # Retry one by one so a single bad record does not fail its whole batch
+                    logger.warning(f"Embedding batch of {len(batch)} failed, retrying individually: {e}")
+                    for item in batch:
+                        try:
+                            await results.put((item, await self._fetch_embedding(text_getter(item)), None))
+                        except Exception as item_error:
+                            await results.put((item, None, item_error))
+            finally:
+                await self.limiter.release(time.perf_counter() - start_time, success)
+        
+        async def start_batch(batch):
+            # Serve cache hits immediately; only misses take a limiter slot
+            cached = await self._lookup_cache([text_getter(item) for item in batch])
+            misses = []
+            for item, embedding in zip(batch, cached):
+                if embedding is None:
+                    misses.append(item)
+                else:
+                    await results.put((item, embedding, None))
+            if not misses:
+                return
+            batch = misses
             
-            embeddings.extend(batch_embeddings)
-            logger.info(f"Processed batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}. Success: {len(batch_embeddings)}, Failed: {failed_count}")
+            await self.limiter.acquire()
+            task = asyncio.create_task(embed_batch(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        async def produce():
+            try:
+                batch = []
+                async for item in iterate_items(items):
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        await start_batch(batch)
+                        batch = []
+                if batch:
+                    await start_batch(batch)
+            finally:
+                if tasks:
+                    await asyncio.gather(*list(tasks), return_exceptions=True)
+                await results.put(done)
+        
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                result = await results.get()
+                if result is done:
+                    break
+                yield result
+            await producer
+        finally:
+            # Stop in-flight work if the consumer goes away (e.g. client disconnect)
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+    
+    async def get_embeddings_batch(self, texts: List[str], batch_size: int = 5) -> List[Optional[np.ndarray]]:
+        """Generate embeddings for multiple texts concurrently, one per input in order (None where it failed)"""
+        embeddings = {}
+        failed_count = 0
+        processed = 0
+        total_batches = (len(texts) + batch_size - 1) // batch_size
+        
+        async for index, embedding, error in self.embed_many(range(len(texts)), lambda i: texts[i], batch_size):
+            processed += 1
+            if error is not None:
+                logger.error(f"Failed to process text in batch: {error}")
+                failed_count += 1
+            else:
+                embeddings[index] = embedding
             
-            # Longer delay between batches to give Ollama time to recover
-            if i + batch_size < len(texts):
-                await asyncio.sleep(1.0)
+            if processed % batch_size == 0 or processed == len(texts):
+                logger.info(f"Processed batch {(processed + batch_size - 1) // batch_size}/{total_batches}. Success: {len(embeddings)}, Failed: {failed_count}")
         
         logger.info(f"Batch processing complete. Total successful: {len(embeddings)}, Total failed: {failed_count}")
-        return embeddings
+        return [embeddings.get(i) for i in range(len(texts))]
+    
+    def get_concurrency_stats(self):
+        """Get the adaptive concurrency limiter and batching state"""
+        stats = self.limiter.get_stats()
+        stats["embed_batch_size"] = self.embed_batch_size
+        stats["embed_api_supported"] = self.embed_api_supported
+        stats["query_coalescer"] = self.coalescer.get_stats()
+        return stats
+    
+    def get_cache_stats(self):
+        """Get embedding cache hit/miss counters, or None when caching is disabled"""
+        return self.cache.get_stats() if self.cache else None
+    
+    def get_query_cache_stats(self):
+        """Get query embedding cache hit/miss counters"""
+        return self.query_cache.get_stats()
     
     async def close(self):
-        """Close any resources"""
-        pass
\ No newline at end of file
+        """Close the pooled HTTP client"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Closed embedding service HTTP client")
+        self._client = None
+        
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
\ No newline at end of file
@@ -0,0 +1,51 @@
+import logging
+from typing import Any, Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+def create_async_client(max_connections: int = 10,
+                        max_keepalive_connections: int = 5,
+                        keepalive_expiry: float = 30.0,
+                        connect_timeout: float = 5.0,
+                        request_timeout: float = 60.0) -> httpx.AsyncClient:
+    """Create a long-lived AsyncClient with a bounded keep-alive connection pool"""
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    )
+    timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
+    logger.info(f"Creating HTTP client pool (max_connections={max_connections}, "
+                f"keepalive={max_keepalive_connections}, expiry={keepalive_expiry}s)")
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def get_pool_stats(client: Optional[httpx.AsyncClient]) -> Dict[str, Any]:
+    """Report connection pool usage (connections in use vs idle) for a client"""
+    stats = {
+        "open": client is not None and not client.is_closed,
+        "connections": 0,
+        "in_use": 0,
+        "idle": 0,
+        "pending_requests": 0
+    }
+    if client is None or client.is_closed:
+        return stats
+
+    # httpx does not expose pool usage publicly, so read it from the httpcore pool
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return stats
+
+    try:
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        closed = sum(1 for conn in connections if conn.is_closed())
+        stats["connections"] = len(connections) - closed
+        stats["idle"] = idle
+        stats["in_use"] = len(connections) - closed - idle
+        stats["pending_requests"] = len(getattr(pool, "_requests", []))
+    except Exception as e:
+        logger.debug(f"Could not read connection pool stats: {e}")
+
+    return stats
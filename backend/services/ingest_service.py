@@ -0,0 +1,372 @@
+import logging
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+
+from models import MimicRecord
+from services.chunker import NoteChunker
+from services.embedding_service import iterate_items
+from services.near_duplicates import NearDuplicateDetector
+from services.metrics import INGEST_RECORDS, INGEST_VECTORS, INGEST_VECTORS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+METAL_ERROR_MARKERS = ("failed to create command queue", "llama runner process has terminated", "Metal backend")
+METAL_ERROR_HELP = ("\n\nIMPORTANT: Metal backend errors detected. To fix this:\n1. Stop Ollama: 'ollama stop'\n"
+                    "2. Restart with CPU mode: 'OLLAMA_NUM_GPU=0 ollama serve'\n3. Or increase available GPU memory")
+
+class _RecordState:
+    """Chunks of one record and the embeddings received for them so far"""
+
+    def __init__(self, record: MimicRecord, chunks):
+        self.record = record
+        self.chunks = chunks
+        self.embeddings: List[Optional[np.ndarray]] = [None] * len(chunks)
+        self.remaining = len(chunks)
+        self.error: Optional[Exception] = None
+        # MinHash signature and LSH buckets when near-duplicate detection is on
+        self.signature: Optional[np.ndarray] = None
+        self.buckets: List[int] = []
+        # Later records of this run found to nearly duplicate this one, as (record, similarity)
+        self.duplicates: List[Tuple[MimicRecord, float]] = []
+
+class IngestPipeline:
+    """One vectorize run: chunks records, embeds the chunks concurrently and stores
+    each note once all of its chunks are embedded.
+
+    Finished notes are buffered and written with bulk add_vectors calls, and the
+    index is checkpointed every checkpoint_every stored records. Records whose
+    note_id is already stored are skipped before embedding. With a
+    near_duplicates detector, records that nearly repeat a stored or in-flight
+    note of the same subject are not embedded either; they are skipped or linked
+    to that canonical note once it is stored. Vector store calls run on the
+    store's executor, so the event loop stays free while notes are written. records may be an async iterable,
+    and total_records None when the count is not known up front. run() yields
+    one progress dict per embedded record.
+
+    With replace_existing, stored notes are re-embedded and replace their old
+    vectors instead of being skipped, and records are never treated as
+    near-duplicates (their signatures are still stored).
+    """
+
+    def __init__(self,
+                 embedding_service,
+                 vector_store,
+                 chunker: NoteChunker,
+                 total_records: Optional[int],
+                 write_batch_size: int = 64,
+                 checkpoint_every: int = 100,
+                 near_duplicates: Optional[NearDuplicateDetector] = None,
+                 replace_existing: bool = False):
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+        self.chunker = chunker
+        self.total_records = total_records
+        self.write_batch_size = write_batch_size
+        self.checkpoint_every = checkpoint_every
+        self.near_duplicates = near_duplicates
+        self.replace_existing = replace_existing
+
+        self.processed_count = 0
+        self.vectorized_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+        self.duplicate_count = 0
+        self.chunk_count = 0
+        self.vectors_added = 0
+        self.metal_error_detected = False
+
+        self._pending: List[_RecordState] = []
+        self._pending_chunks = 0
+        # LSH buckets of records accepted in this run but not stored yet
+        self._in_flight_buckets: Dict[Tuple[int, int], List[_RecordState]] = {}
+
+    @staticmethod
+    def chunk_id(note_id: str, chunk_index: int, chunk_total: int) -> str:
+        """Vector id of a chunk; unchunked notes keep their note_id"""
+        return note_id if chunk_total == 1 else f"{note_id}#{chunk_index}"
+
+    async def _expand(self, records: Union[Iterable[MimicRecord], AsyncIterable[MimicRecord]]):
+        """Yield (record state, chunk) pairs for every chunk of every record not yet stored"""
+        async for batch in self._batches(records):
+            # Records stored by an earlier run (e.g. a resumed job) are not embedded again
+            existing = set()
+            if self.vector_store.metadata_store is not None and not self.replace_existing:
+                existing = await self.vector_store.run_in_executor(
+                    self.vector_store.metadata_store.existing_parent_ids, [record.note_id for record in batch]
+                )
+            for record in batch:
+                if record.note_id in existing:
+                    self.skipped_count += 1
+                    self.processed_count += 1
+                    continue
+                
+                signature = None
+                buckets = []
+                if self.near_duplicates is not None:
+                    signature = self.near_duplicates.signature(record.cleaned_text)
+                    if signature is not None:
+                        buckets = self.near_duplicates.band_buckets(signature)
+                        if not self.replace_existing and await self._match_duplicate(record, signature, buckets):
+                            continue
+                
+                state = _RecordState(record, self.chunker.split(record.cleaned_text))
+                if signature is not None:
+                    state.signature = signature
+                    state.buckets = buckets
+                    self._track(state)
+                self.chunk_count += len(state.chunks)
+                for chunk in state.chunks:
+                    yield state, chunk
+
+    async def _match_duplicate(self, record: MimicRecord, signature: np.ndarray, buckets: List[int]) -> bool:
+        """Check a record against stored and in-flight notes of its subject; True if it is a near-duplicate"""
+        stored = await self.vector_store.run_in_executor(
+            self.vector_store.metadata_store.signature_candidates, record.subject_id, buckets
+        )
+        candidates = {note_id: np.frombuffer(blob, dtype=np.uint32) for note_id, blob in stored.items()}
+        in_flight = {}
+        for bucket in buckets:
+            for state in self._in_flight_buckets.get((record.subject_id, bucket), ()):
+                in_flight[state.record.note_id] = state
+                candidates[state.record.note_id] = state.signature
+        candidates.pop(record.note_id, None)
+
+        match = self.near_duplicates.best_match(signature, candidates)
+        if match is None:
+            return False
+
+        canonical_id, similarity = match
+        if canonical_id in in_flight:
+            # Settled when the canonical note is stored (or fails)
+            in_flight[canonical_id].duplicates.append((record, similarity))
+        else:
+            await self._resolve_duplicates(canonical_id, [(record, similarity)], stored=True)
+        return True
+
+    def _track(self, state: _RecordState):
+        for bucket in state.buckets:
+            self._in_flight_buckets.setdefault((state.record.subject_id, bucket), []).append(state)
+
+    def _untrack(self, state: _RecordState):
+        for bucket in state.buckets:
+            key = (state.record.subject_id, bucket)
+            states = self._in_flight_buckets.get(key)
+            if states is None:
+                continue
+            states.remove(state)
+            if not states:
+                del self._in_flight_buckets[key]
+
+    async def _resolve_duplicates(self, canonical_id: str, duplicates: List[Tuple[MimicRecord, float]], stored: bool):
+        """Count near-duplicates once their canonical note is stored, linking them if configured"""
+        if not duplicates:
+            return
+        self.processed_count += len(duplicates)
+        if not stored:
+            # The canonical note failed, so these were never stored in any form
+            self.failed_count += len(duplicates)
+            INGEST_RECORDS.inc(len(duplicates), outcome="failed")
+            return
+
+        self.duplicate_count += len(duplicates)
+        INGEST_RECORDS.inc(len(duplicates), outcome="duplicate")
+        if self.near_duplicates.policy == "link":
+            await self.vector_store.run_in_executor(
+                self.vector_store.link_duplicates,
+                [(record.note_id, canonical_id, record.subject_id, similarity) for record, similarity in duplicates]
+            )
+
+    @staticmethod
+    async def _batches(records: Union[Iterable[MimicRecord], AsyncIterable[MimicRecord]], size: int = 256):
+        """Group records for bulk lookups"""
+        batch = []
+        async for record in iterate_items(records):
+            batch.append(record)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _percent_done(self) -> Optional[int]:
+        """Percentage of records processed, or None while the total is unknown (streamed uploads)"""
+        if self.total_records is None:
+            return None
+        return int(self.processed_count / self.total_records * 100) if self.total_records else 100
+
+    def _progress(self, error: Optional[str] = None) -> Dict[str, Any]:
+        """Progress line for the current counters"""
+        progress_data = {
+            "progress": self._percent_done(),
+            "processed": self.processed_count,
+            "total": self.total_records,
+            "successful": self.vectorized_count,
+            "failed": self.failed_count,
+            "skipped": self.skipped_count,
+            "duplicates": self.duplicate_count,
+            "chunks": self.chunk_count,
+            "concurrency": self.embedding_service.get_concurrency_stats()["limit"]
+        }
+        if error:
+            progress_data["error"] = error
+        return progress_data
+
+    def summary(self) -> str:
+        """Final message for the run, with troubleshooting hints"""
+        total = self.total_records if self.total_records is not None else self.processed_count
+        success_rate = (self.vectorized_count / total * 100) if total > 0 else 0
+        message = f"Successfully vectorized {self.vectorized_count} out of {total} records ({success_rate:.1f}%)"
+        
+        if self.metal_error_detected:
+            message += METAL_ERROR_HELP
+        
+        if self.failed_count > 0:
+            message += f"\n{self.failed_count} records failed to process."
+        
+        if self.skipped_count > 0:
+            message += f"\n{self.skipped_count} records were already stored and skipped."
+        
+        if self.duplicate_count > 0:
+            action = "linked to" if self.near_duplicates.policy == "link" else "skipped as duplicates of"
+            message += f"\n{self.duplicate_count} near-duplicate records were {action} earlier notes without embedding."
+        return message
+
+    async def _flush(self) -> List[Dict[str, Any]]:
+        """Bulk-insert buffered notes and return a progress dict per record"""
+        if not self._pending:
+            return []
+
+        states = self._pending
+        self._pending = []
+        self._pending_chunks = 0
+
+        vector_ids = []
+        embeddings = []
+        metadatas = []
+        for state in states:
+            record = state.record
+            # Chunks drop the whitespace around and between them, so a note they
+            # do not reproduce exactly keeps its full text on the first chunk
+            stitched = len(state.chunks) == 1 and state.chunks[0].text == record.cleaned_text
+            for chunk, embedding in zip(state.chunks, state.embeddings):
+                vector_ids.append(self.chunk_id(record.note_id, chunk.chunk_index, len(state.chunks)))
+                embeddings.append(embedding)
+                metadatas.append({
+                    "subject_id": record.subject_id,
+                    "hadm_id": record.hadm_id,
+                    "charttime": record.charttime,
+                    "cleaned_text": chunk.text,
+                    "note_id": record.note_id,
+                    "parent_id": record.note_id,
+                    "chunk_index": chunk.chunk_index,
+                    "chunk_start": chunk.start,
+                    "parent_text": record.cleaned_text if chunk.chunk_index == 0 and not stitched else None
+                })
+
+        store = self.vector_store.upsert_vectors if self.replace_existing else self.vector_store.add_vectors
+        try:
+            added = await self.vector_store.run_in_executor(
+                store,
+                vector_ids=vector_ids,
+                embeddings=np.stack(embeddings),
+                metadatas=metadatas
+            )
+            self.vectors_added += added
+            INGEST_VECTORS.inc(added)
+            succeeded = True
+        except Exception as e:
+            logger.error(f"Failed to store batch of {len(states)} records: {e}")
+            succeeded = False
+
+        if succeeded and self.near_duplicates is not None:
+            await self._store_signatures(states)
+
+        checkpoints_before = self.vectorized_count // self.checkpoint_every
+        INGEST_RECORDS.inc(len(states), outcome="stored" if succeeded else "failed")
+        lines = []
+        for state in states:
+            self._untrack(state)
+            await self._resolve_duplicates(state.record.note_id, state.duplicates, stored=succeeded)
+            if succeeded:
+                self.vectorized_count += 1
+            else:
+                self.failed_count += 1
+            lines.append(self._progress(None if succeeded else "Processing error"))
+
+        # Checkpoint periodically (appends only the new vectors to the log)
+        if self.vectorized_count // self.checkpoint_every > checkpoints_before:
+            await self.vector_store.run_in_executor(self.vector_store.save_index)
+            logger.info(f"Checkpointed index at {self.vectorized_count} records")
+        return lines
+
+    async def _store_signatures(self, states: List[_RecordState]):
+        """Keep signatures of stored notes so later ingests can match against them"""
+        rows = [
+            (state.record.note_id, state.record.subject_id, state.signature.tobytes(), state.buckets)
+            for state in states if state.signature is not None
+        ]
+        if not rows:
+            return
+        try:
+            await self.vector_store.run_in_executor(self.vector_store.store_signatures, rows)
+        except Exception as e:
+            # Only costs missed duplicates later on
+            logger.error(f"Failed to store near-duplicate signatures: {e}")
+
+    async def _record_failed(self, state: _RecordState) -> Dict[str, Any]:
+        """Count a record whose chunk could not be embedded and describe the error"""
+        self._untrack(state)
+        await self._resolve_duplicates(state.record.note_id, state.duplicates, stored=False)
+        self.failed_count += 1
+        INGEST_RECORDS.inc(outcome="failed")
+        error_msg = str(state.error)
+
+        # Check for Metal backend errors
+        if any(marker in error_msg for marker in METAL_ERROR_MARKERS):
+            self.metal_error_detected = True
+            logger.error(f"Metal backend error detected for record {state.record.note_id}: {state.error}")
+        else:
+            logger.error(f"Error processing record {state.record.note_id}: {state.error}")
+
+        return self._progress("Metal backend issues detected" if self.metal_error_detected else "Processing error")
+
+    async def run(self, records: Union[Iterable[MimicRecord], AsyncIterable[MimicRecord]]) -> AsyncIterator[Dict[str, Any]]:
+        """Vectorize records, yielding a progress dict as each record is stored or fails"""
+        start_time = time.perf_counter()
+        
+        # Chunk embeddings run concurrently under the adaptive limiter; notes are
+        # stored in batches while later chunks are still in flight
+        embeddings = self.embedding_service.embed_many(self._expand(records), lambda item: item[1].text)
+        try:
+            async for (state, chunk), embedding, error in embeddings:
+                if error is not None:
+                    state.error = state.error or error
+                else:
+                    state.embeddings[chunk.chunk_index] = embedding
+
+                state.remaining -= 1
+                if state.remaining:
+                    continue
+
+                # Every chunk of this record has finished
+                self.processed_count += 1
+                if state.error is not None:
+                    yield await self._record_failed(state)
+                    continue
+
+                self._pending.append(state)
+                self._pending_chunks += len(state.chunks)
+                if self._pending_chunks >= self.write_batch_size:
+                    for line in await self._flush():
+                        yield line
+        finally:
+            # Cancel in-flight embeddings right away if the caller stops early
+            await embeddings.aclose()
+
+        for line in await self._flush():
+            yield line
+        
+        elapsed = time.perf_counter() - start_time
+        if self.vectors_added and elapsed > 0:
+            INGEST_VECTORS_PER_SECOND.set(self.vectors_added / elapsed)
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from models import MimicRecord
+from services.chunker import NoteChunker
+from services.ingest_service import IngestPipeline
+from services.near_duplicates import NearDuplicateDetector
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobManager:
+    """Background vectorize jobs persisted in SQLite.
+
+    Submitted records are spooled to the jobs database and a single worker task
+    runs one job at a time through IngestPipeline. Jobs still queued or running
+    when the process stops are picked up again on start(); the pipeline skips
+    notes that were stored before the last checkpoint, so they are not embedded
+    twice. A job's spooled records are deleted once it reaches a final status.
+    Database calls run on worker threads so a large job's spooling does not
+    block the event loop.
+    """
+
+    def __init__(self,
+                 embedding_service,
+                 vector_store,
+                 chunker: NoteChunker,
+                 near_duplicates: Optional[NearDuplicateDetector] = None,
+                 db_path: str = "jobs.db",
+                 write_batch_size: int = 64,
+                 progress_interval: float = 1.0,
+                 read_batch_size: int = 500):
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+        self.chunker = chunker
+        self.near_duplicates = near_duplicates
+        self.db_path = db_path
+        self.write_batch_size = write_batch_size
+        self.progress_interval = progress_interval
+        self.read_batch_size = read_batch_size
+
+        # Shared by the worker threads running database calls
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._cancel_requested = set()
+        self._running_job_id: Optional[str] = None
+
+    def _create_schema(self):
+        """Create tables if they do not exist"""
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, "
+            "status TEXT NOT NULL, "
+            "total INTEGER NOT NULL, "
+            "processed INTEGER NOT NULL DEFAULT 0, "
+            "vectorized INTEGER NOT NULL DEFAULT 0, "
+            "failed INTEGER NOT NULL DEFAULT 0, "
+            "skipped INTEGER NOT NULL DEFAULT 0, "
+            "duplicates INTEGER NOT NULL DEFAULT 0, "
+            "chunks INTEGER NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "message TEXT, "
+            "error TEXT, "
+            "created_at REAL NOT NULL, "
+            "started_at REAL, "
+            "updated_at REAL NOT NULL, "
+            "finished_at REAL)"
+        )
+        # Databases created before near-duplicate detection lack the duplicates column
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)").fetchall()}
+        if "duplicates" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_records ("
+            "job_id TEXT NOT NULL, "
+            "position INTEGER NOT NULL, "
+            "record TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, position))"
+        )
+        self._conn.commit()
+
+    async def start(self):
+        """Start the worker and requeue jobs interrupted by a restart"""
+        self._queue = asyncio.Queue()
+        rows = await asyncio.to_thread(
+            self._query, "SELECT job_id, status FROM jobs WHERE status IN (?, ?) ORDER BY created_at", ACTIVE_STATUSES
+        )
+        for row in rows:
+            if row["status"] == "running":
+                await asyncio.to_thread(self._update, row["job_id"], status="queued")
+            self._queue.put_nowait(row["job_id"])
+        if rows:
+            logger.info(f"Resuming {len(rows)} unfinished vectorize jobs")
+
+        self._worker = asyncio.create_task(self._run_worker())
+
+    async def close(self):
+        """Stop the worker; an interrupted job stays active and resumes on the next start"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        try:
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Failed to close jobs database: {e}")
+
+    async def submit(self, records: List[MimicRecord]) -> Dict[str, Any]:
+        """Spool records for a new job and queue it"""
+        job_id = uuid.uuid4().hex
+        try:
+            await asyncio.to_thread(self._insert_job, job_id, records)
+        except Exception as e:
+            logger.error(f"Failed to create vectorize job: {e}")
+            raise
+
+        self._queue.put_nowait(job_id)
+        logger.info(f"Queued vectorize job {job_id} with {len(records)} records")
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status and counters of a job, or None if it does not exist"""
+        rows = await asyncio.to_thread(self._query, "SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return self._to_dict(rows[0]) if rows else None
+
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first, optionally filtered by status"""
+        if status:
+            rows = await asyncio.to_thread(
+                self._query, "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            )
+        else:
+            rows = await asyncio.to_thread(self._query, "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [self._to_dict(row) for row in rows]
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued or running job; finished jobs are returned unchanged"""
+        job = await self.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        if job_id == self._running_job_id:
+            # The worker stops at the next progress update and saves what was stored
+            self._cancel_requested.add(job_id)
+            logger.info(f"Cancellation requested for running job {job_id}")
+        else:
+            await asyncio.to_thread(self._finish, job_id, "cancelled", message="Cancelled before it started")
+            logger.info(f"Cancelled queued job {job_id}")
+        return await self.get(job_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Job counts by status"""
+        counts = dict(await asyncio.to_thread(self._query, "SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return {
+            "running_job_id": self._running_job_id,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "by_status": {status: counts.get(status, 0) for status in JOB_STATUSES}
+        }
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["progress"] = int(job["processed"] / job["total"] * 100) if job["total"] else 100
+        return job
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """Rows of a read query; blocking, run on a worker thread"""
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _insert_job(self, job_id: str, records: List[MimicRecord]):
+        """Insert a queued job with its spooled records in one transaction"""
+        now = time.time()
+        rows = [(job_id, position, record.json()) for position, record in enumerate(records)]
+        with self._db_lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                    (job_id, len(records), now, now)
+                )
+                self._conn.executemany("INSERT INTO job_records (job_id, position, record) VALUES (?, ?, ?)", rows)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def _update(self, job_id: str, **fields):
+        """Write job columns and commit"""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    async def _update_counters(self, job_id: str, pipeline: IngestPipeline, **fields):
+        await asyncio.to_thread(
+            self._update,
+            job_id,
+            processed=pipeline.processed_count,
+            vectorized=pipeline.vectorized_count,
+            failed=pipeline.failed_count,
+            skipped=pipeline.skipped_count,
+            duplicates=pipeline.duplicate_count,
+            chunks=pipeline.chunk_count,
+            **fields
+        )
+
+    def _finish(self, job_id: str, status: str, **fields):
+        """Move a job to a final status and drop its spooled records"""
+        with self._db_lock:
+            self._conn.execute("DELETE FROM job_records WHERE job_id = ?", (job_id,))
+        self._update(job_id, status=status, finished_at=time.time(), **fields)
+
+    def _read_records(self, job_id: str, after_position: int) -> List[tuple]:
+        """Next batch of (position, record) spooled after a position"""
+        rows = self._query(
+            "SELECT position, record FROM job_records WHERE job_id = ? AND position > ? "
+            "ORDER BY position LIMIT ?", (job_id, after_position, self.read_batch_size)
+        )
+        return [(row["position"], MimicRecord(**json.loads(row["record"]))) for row in rows]
+
+    async def _iter_records(self, job_id: str) -> AsyncIterator[MimicRecord]:
+        """Spooled records of a job in submission order, read in batches"""
+        position = -1
+        while True:
+            rows = await asyncio.to_thread(self._read_records, job_id, position)
+            if not rows:
+                return
+            for _, record in rows:
+                yield record
+            position = rows[-1][0]
+
+    async def _run_worker(self):
+        """Run queued jobs one at a time"""
+        while True:
+            job_id = await self._queue.get()
+            job = await self.get(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                continue
+            self._running_job_id = job_id
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                # Shutdown: leave the job active so it resumes after restart
+                logger.info(f"Interrupted vectorize job {job_id}, it will resume on restart")
+                raise
+            except Exception as e:
+                logger.error(f"Vectorize job {job_id} failed: {e}")
+                await asyncio.to_thread(self._finish, job_id, "failed", error=str(e))
+            finally:
+                self._running_job_id = None
+                self._cancel_requested.discard(job_id)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        """Vectorize a job's records, recording progress as it goes"""
+        job_id = job["job_id"]
+        attempts = job["attempts"] + 1
+        logger.info(f"Starting vectorize job {job_id} ({job['total']} records, attempt {attempts})")
+        await asyncio.to_thread(self._update, job_id, status="running", attempts=attempts,
+                                started_at=job["started_at"] or time.time())
+
+        pipeline = IngestPipeline(
+            self.embedding_service,
+            self.vector_store,
+            self.chunker,
+            total_records=job["total"],
+            write_batch_size=self.write_batch_size,
+            near_duplicates=self.near_duplicates
+        )
+
+        cancelled = False
+        last_update = time.monotonic()
+        progress = pipeline.run(self._iter_records(job_id))
+        try:
+            async for _ in progress:
+                if job_id in self._cancel_requested:
+                    cancelled = True
+                    break
+                if time.monotonic() - last_update >= self.progress_interval:
+                    await self._update_counters(job_id, pipeline)
+                    last_update = time.monotonic()
+        finally:
+            # Stops the embedding producer and cancels requests still in flight
+            await progress.aclose()
+            # Keep everything stored so far, including on shutdown
+            await self.vector_store.run_in_executor(self.vector_store.save_index)
+
+        if cancelled:
+            await self._update_counters(job_id, pipeline)
+            await asyncio.to_thread(self._finish, job_id, "cancelled",
+                                    message=f"Cancelled after {pipeline.processed_count} of {job['total']} records")
+            logger.info(f"Cancelled vectorize job {job_id}")
+            return
+
+        await self._update_counters(job_id, pipeline)
+        await asyncio.to_thread(self._finish, job_id, "completed", message=pipeline.summary())
+        logger.info(f"Completed vectorize job {job_id}: {pipeline.vectorized_count} stored, "
+                    f"{pipeline.skipped_count} skipped, {pipeline.duplicate_count} near-duplicates, "
+                    f"{pipeline.failed_count} failed")
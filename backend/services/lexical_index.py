@@ -0,0 +1,249 @@
+import bisect
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Lowercased alphanumeric tokens, keeping codes such as "i10.9", "k+" or "b12" together
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*\+?")
+MAX_TOKEN_LENGTH = 64
+
+STOPWORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he", "her", "his",
+    "in", "is", "it", "of", "on", "or", "she", "that", "the", "to", "was", "were", "with"
+))
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercased index terms, dropping stopwords"""
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS and len(token) <= MAX_TOKEN_LENGTH
+    ]
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over note text, keyed by vector position.
+
+    Postings are kept in compact arrays per term and extended as vectors are
+    added. A snapshot is written alongside the FAISS index snapshot; positions
+    added after it are re-indexed from the metadata store on load.
+    """
+
+    def __init__(self, index_path: str, k1: float = 1.2, b: float = 0.75):
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_lengths = array("I")
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @property
+    def num_docs(self) -> int:
+        """Number of positions covered by the index"""
+        return len(self._doc_lengths)
+
+    def add_many(self, positions: Iterable[int], texts: Iterable[str]):
+        """Index texts stored at consecutive vector positions"""
+        with self._lock:
+            for position, text in zip(positions, texts):
+                position = int(position)
+                if position < len(self._doc_lengths):
+                    continue  # Already indexed
+                while len(self._doc_lengths) < position:
+                    self._doc_lengths.append(0)
+
+                term_counts: Dict[str, int] = {}
+                for token in tokenize(text or ""):
+                    term_counts[token] = term_counts.get(token, 0) + 1
+                for term, count in term_counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("q"), array("I"))
+                    postings[0].append(position)
+                    postings[1].append(count)
+
+                length = sum(term_counts.values())
+                self._doc_lengths.append(length)
+                self._total_length += length
+
+    def search(self, query: str, k: int, candidate_ids: Optional[List[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 top-k over positions matching any query term, returning (scores, indices)"""
+        empty = (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+        with self._lock:
+            terms = [term for term in set(tokenize(query)) if term in self._postings]
+            num_docs = len(self._doc_lengths)
+            if not terms or num_docs == 0 or k <= 0:
+                return empty
+
+            doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+            avg_length = max(self._total_length / num_docs, 1.0)
+            allowed = np.asarray(candidate_ids, dtype=np.int64) if candidate_ids is not None else None
+
+            id_parts = []
+            score_parts = []
+            for term in terms:
+                ids = np.frombuffer(self._postings[term][0], dtype=np.int64)
+                tfs = np.frombuffer(self._postings[term][1], dtype=np.uint32).astype(np.float32)
+                idf = math.log(1.0 + (num_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+                if allowed is not None:
+                    mask = np.isin(ids, allowed)
+                    ids, tfs = ids[mask], tfs[mask]
+                norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[ids] / avg_length)
+                id_parts.append(ids.copy())
+                score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+            # Release the buffer views before appends can resize the arrays again
+            del ids, doc_lengths
+
+        all_ids = np.concatenate(id_parts)
+        if len(all_ids) == 0:
+            return empty
+
+        # Sum per-term contributions for each position
+        unique_ids, inverse = np.unique(all_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+
+        k = min(k, len(unique_ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], unique_ids[top]
+
+    def remove(self, positions: Iterable[int], texts: Optional[Iterable[str]] = None):
+        """Drop deleted positions from the postings.
+
+        With the texts that were indexed only those terms' postings are touched;
+        without them (deletes replayed on load) every posting list is filtered.
+        """
+        positions = [int(position) for position in positions]
+        with self._lock:
+            if texts is not None:
+                for position, text in zip(positions, texts):
+                    for term in set(tokenize(text or "")):
+                        postings = self._postings.get(term)
+                        if postings is None:
+                            continue
+                        # Postings are in position order
+                        i = bisect.bisect_left(postings[0], position)
+                        if i < len(postings[0]) and postings[0][i] == position:
+                            del postings[0][i]
+                            del postings[1][i]
+                            if not postings[0]:
+                                del self._postings[term]
+            else:
+                removed = np.asarray(positions, dtype=np.int64)
+                for term in list(self._postings):
+                    ids, tfs = self._postings[term]
+                    keep = np.flatnonzero(~np.isin(np.frombuffer(ids, dtype=np.int64), removed))
+                    if len(keep) == len(ids):
+                        continue
+                    if len(keep) == 0:
+                        del self._postings[term]
+                        continue
+                    kept_ids = np.frombuffer(ids, dtype=np.int64)[keep].tobytes()
+                    kept_tfs = np.frombuffer(tfs, dtype=np.uint32)[keep].tobytes()
+                    self._postings[term] = (array("q", kept_ids), array("I", kept_tfs))
+
+            for position in positions:
+                if position < len(self._doc_lengths):
+                    self._total_length -= self._doc_lengths[position]
+                    self._doc_lengths[position] = 0
+
+    def truncate(self, num_docs: int):
+        """Drop positions at or beyond num_docs (indexed ahead of the stored vectors)"""
+        with self._lock:
+            if len(self._doc_lengths) <= num_docs:
+                return
+            dropped = len(self._doc_lengths) - num_docs
+            self._total_length -= int(np.frombuffer(self._doc_lengths, dtype=np.uint32)[num_docs:].sum())
+            del self._doc_lengths[num_docs:]
+            for term in list(self._postings):
+                ids, tfs = self._postings[term]
+                keep = np.flatnonzero(np.frombuffer(ids, dtype=np.int64) < num_docs)
+                if len(keep) == len(ids):
+                    continue
+                if len(keep) == 0:
+                    del self._postings[term]
+                    continue
+                # Positions are appended in order, so the kept postings are a prefix
+                del ids[len(keep):]
+                del tfs[len(keep):]
+        logger.warning(f"Dropped {dropped} positions from the lexical index")
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Copy the index into flat arrays for writing to disk"""
+        with self._lock:
+            terms = list(self._postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            for i, term in enumerate(terms):
+                offsets[i + 1] = offsets[i] + len(self._postings[term][0])
+            ids = np.empty(offsets[-1], dtype=np.int64)
+            tfs = np.empty(offsets[-1], dtype=np.uint32)
+            for i, term in enumerate(terms):
+                ids[offsets[i]:offsets[i + 1]] = np.frombuffer(self._postings[term][0], dtype=np.int64)
+                tfs[offsets[i]:offsets[i + 1]] = np.frombuffer(self._postings[term][1], dtype=np.uint32)
+            return {
+                "terms": np.array(terms, dtype=str),
+                "offsets": offsets,
+                "ids": ids,
+                "tfs": tfs,
+                "doc_lengths": np.array(self._doc_lengths, dtype=np.uint32)
+            }
+
+    def write_snapshot(self, snapshot: Dict[str, np.ndarray]):
+        """Atomically replace the on-disk index with the given snapshot"""
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def load(self) -> bool:
+        """Load the on-disk snapshot, if there is one"""
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                terms = data["terms"]
+                offsets = data["offsets"]
+                ids = data["ids"]
+                tfs = data["tfs"]
+                doc_lengths = data["doc_lengths"]
+        except Exception as e:
+            logger.error(f"Failed to load lexical index from {self.index_path}, rebuilding: {e}")
+            return False
+
+        with self._lock:
+            self._postings = {}
+            for i, term in enumerate(terms.tolist()):
+                start, end = offsets[i], offsets[i + 1]
+                self._postings[term] = (array("q", ids[start:end].tobytes()), array("I", tfs[start:end].tobytes()))
+            self._doc_lengths = array("I", doc_lengths.astype(np.uint32).tobytes())
+            self._total_length = int(doc_lengths.sum())
+        logger.info(f"Loaded lexical index with {len(self._postings)} terms over {len(doc_lengths)} positions")
+        return True
+
+    def reset(self):
+        """Empty the index and delete its snapshot"""
+        with self._lock:
+            self._postings = {}
+            self._doc_lengths = array("I")
+            self._total_length = 0
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get vocabulary and posting counts"""
+        with self._lock:
+            return {
+                "terms": len(self._postings),
+                "positions": len(self._doc_lengths),
+                "postings": sum(len(ids) for ids, _ in self._postings.values()),
+                "avg_doc_length": round(self._total_length / len(self._doc_lengths), 1) if self._doc_lengths else 0.0
+            }
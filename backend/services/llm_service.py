@@ -2,55 +2,128 @@ import asyncio
 import logging
 import httpx
 import json
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional
+
+from services.http_client import create_async_client, get_pool_stats
+from services.context_builder import ContextBuilder
 
 logger = logging.getLogger(__name__)
 
+# Kept identical across requests so Ollama can reuse the cached prompt prefix
+SYSTEM_PROMPT = """You are an expert clinical data analyst specializing in medical record analysis from the MIMIC-IV database. Your task is to analyze clinical records and provide comprehensive, well-structured responses.
+
+CRITICAL RESPONSE REQUIREMENTS:
+1. **Always provide a complete, structured analysis**
+2. **Use clear headings and sections for organization**
+3. **Focus on medical insights and clinical relevance**
+4. **Reference specific records with evidence**
+5. **Provide comprehensive analysis (aim for 1000-1500 tokens)**
+6. **Use professional medical terminology while remaining accessible**
+
+REQUIRED RESPONSE STRUCTURE:
+- **Clinical Query Analysis**: Brief overview of the question
+- **Key Medical Findings**: Important clinical observations from the records
+- **Evidence-Based Analysis**: Detailed examination of each relevant record
+- **Clinical Patterns & Insights**: Trends and correlations across cases
+- **Professional Summary**: Comprehensive clinical interpretation
+- **Additional Considerations**: Relevant medical context or recommendations
+
+Ensure your response is thorough, well-organized, and provides maximum clinical value."""
+
 class LLMService:
     def __init__(self, 
                  ollama_url: str = "http://localhost:11434",
-                 default_model: str = "llama3.2:latest"):
+                 default_model: str = "llama3.2:latest",
+                 max_connections: int = 4,
+                 max_keepalive_connections: int = 2,
+                 keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 5.0,
+                 request_timeout: float = 120.0,
+                 context_builder: Optional[ContextBuilder] = None,
+                 keep_alive: str = "30m",
+                 num_ctx: Optional[int] = None):
         self.ollama_url = ollama_url
         self.default_model = default_model
         self.max_retries = 3
         self.retry_delay = 2
+        
+        # Retrieved records are fitted into a token budget before prompting. The
+        # model is kept loaded between requests so the KV cache for the unchanged
+        # system prompt prefix can be reused.
+        self.context_builder = context_builder or ContextBuilder()
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        
+        # Shared connection pool, created in start() and reused by every request
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Create the pooled HTTP client used for all Ollama requests"""
+        if self._client is None or self._client.is_closed:
+            self._client = create_async_client(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+                connect_timeout=self.connect_timeout,
+                request_timeout=self.request_timeout
+            )
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it if start() has not run yet"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        return self._client
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Get connection pool usage for the LLM client"""
+        return get_pool_stats(self._client)
+
+    async def close(self):
+        """Close the pooled HTTP client"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Closed LLM service HTTP client")
+        self._client = None
 
     async def check_ollama_connection(self) -> bool:
         """Check if Ollama is running and accessible"""
         try:
             logger.info(f"Checking Ollama LLM connection at {self.ollama_url}")
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    models = [model.get('name', '') for model in data.get('models', [])]
-                    logger.info(f"Available LLM models: {models}")
-                    
-                    # Check if default model is available
-                    model_found = any(self.default_model in model for model in models)
-                    if not model_found:
-                        logger.warning(f"Default model {self.default_model} not found. Available: {models}")
-                        # Try to use any available model
-                        if models:
-                            self.default_model = models[0]
-                            logger.info(f"Using available model: {self.default_model}")
-                    
-                    return True
-                else:
-                    logger.error(f"Ollama LLM responded with status {response.status_code}")
-                    return False
+            client = await self._get_client()
+            response = await client.get(f"{self.ollama_url}/api/tags", timeout=10.0)
+            if response.status_code == 200:
+                data = response.json()
+                models = [model.get('name', '') for model in data.get('models', [])]
+                logger.info(f"Available LLM models: {models}")
+                
+                # Check if default model is available
+                model_found = any(self.default_model in model for model in models)
+                if not model_found:
+                    logger.warning(f"Default model {self.default_model} not found. Available: {models}")
+                    # Try to use any available model
+                    if models:
+                        self.default_model = models[0]
+                        logger.info(f"Using available model: {self.default_model}")
+                
+                return True
+            else:
+                logger.error(f"Ollama LLM responded with status {response.status_code}")
+                return False
         except Exception as e:
             logger.error(f"Failed to connect to Ollama LLM: {e}")
             return False
 
-    async def generate_response(self, 
-                              query: str, 
-                              context_records: List[Dict[str, Any]], 
-                              model: str = None) -> str:
-        """Generate a response using Ollama LLM"""
-        if model is None:
-            model = self.default_model
-            
+    def build_messages(self, query: str, context_records: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Build the system and user chat messages for a query and its retrieved records.
+        
+        Records are used as given; pass them through context_builder.build() first
+        to fit them into the token budget.
+        """
         # Prepare context from similar records
         context_sections = []
         for i, record in enumerate(context_records):
@@ -64,26 +137,6 @@ class LLMService:
         
         context_text = "\n\n".join(context_sections)
         
-        system_prompt = """You are an expert clinical data analyst specializing in medical record analysis from the MIMIC-IV database. Your task is to analyze clinical records and provide comprehensive, well-structured responses.
-
-CRITICAL RESPONSE REQUIREMENTS:
-1. **Always provide a complete, structured analysis**
-2. **Use clear headings and sections for organization**
-3. **Focus on medical insights and clinical relevance**
-4. **Reference specific records with evidence**
-5. **Provide comprehensive analysis (aim for 1000-1500 tokens)**
-6. **Use professional medical terminology while remaining accessible**
-
-REQUIRED RESPONSE STRUCTURE:
-- **Clinical Query Analysis**: Brief overview of the question
-- **Key Medical Findings**: Important clinical observations from the records
-- **Evidence-Based Analysis**: Detailed examination of each relevant record
-- **Clinical Patterns & Insights**: Trends and correlations across cases
-- **Professional Summary**: Comprehensive clinical interpretation
-- **Additional Considerations**: Relevant medical context or recommendations
-
-Ensure your response is thorough, well-organized, and provides maximum clinical value."""
-
         user_prompt = f"""
 **Clinical Query**: {query}
 
@@ -94,47 +147,68 @@ Ensure your response is thorough, well-organized, and provides maximum clinical
 
 Please provide a comprehensive, structured clinical analysis of these records in relation to the query. Focus on extracting relevant medical information, identifying patterns, and providing professional clinical insights. Ensure your response is complete and well-organized with clear sections."""
 
+        return [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": user_prompt
+            }
+        ]
+
+    def _chat_payload(self, model: str, messages: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+        """Request body for Ollama's /api/chat"""
+        options = {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "num_predict": 1500,
+            "stop": ['<|end|>', '</response>', '<|endoftext|>']
+        }
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        return {
+            "model": model,
+            "messages": messages,
+            "options": options,
+            "stream": stream,
+            "keep_alive": self.keep_alive
+        }
+
+    async def generate_response(self, 
+                              query: str, 
+                              context_records: List[Dict[str, Any]], 
+                              model: str = None) -> str:
+        """Generate a response using Ollama LLM"""
+        if model is None:
+            model = self.default_model
+        
+        context = self.context_builder.build(query, context_records)
+        messages = self.build_messages(query, context.records)
+
         for attempt in range(self.max_retries):
             try:
                 logger.info(f"Generating LLM response (attempt {attempt + 1}) using model: {model}")
                 
-                async with httpx.AsyncClient(timeout=120.0) as client:
-                    response = await client.post(
-                        f"{self.ollama_url}/api/chat",
-                        json={
-                            "model": model,
-                            "messages": [
-                                {
-                                    "role": "system",
-                                    "content": system_prompt
-                                },
-                                {
-                                    "role": "user",
-                                    "content": user_prompt
-                                }
-                            ],
-                            "options": {
-                                "temperature": 0.7,
-                                "top_p": 0.9,
-                                "num_predict": 1500,
-                                "stop": ['<|end|>', '</response>', '<|endoftext|>']
-                            },
-                            "stream": False
-                        }
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data.get('message') and data['message'].get('content'):
-                            logger.info("Successfully generated LLM response")
-                            return data['message']['content']
-                        else:
-                            raise Exception("Invalid response format from Ollama")
+                client = await self._get_client()
+                response = await client.post(
+                    f"{self.ollama_url}/api/chat",
+                    json=self._chat_payload(model, messages, stream=False)
+                )
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    if data.get('message') and data['message'].get('content'):
+                        logger.info("Successfully generated LLM response")
+                        return data['message']['content']
                     else:
-                        error_text = response.text
-                        logger.error(f"Ollama API error: {response.status_code} - {error_text}")
-                        raise Exception(f"Ollama API error: {response.status_code}")
-                        
+                        raise Exception("Invalid response format from Ollama")
+                else:
+                    error_text = response.text
+                    logger.error(f"Ollama API error: {response.status_code} - {error_text}")
+                    raise Exception(f"Ollama API error: {response.status_code}")
+                    
             except Exception as e:
                 if attempt < self.max_retries - 1:
                     logger.warning(f"LLM generation attempt {attempt + 1} failed: {e}. Retrying in {self.retry_delay} seconds...")
@@ -143,15 +217,65 @@ Please provide a comprehensive, structured clinical analysis of these records in
                     logger.error(f"Failed to generate LLM response after {self.max_retries} attempts: {e}")
                     raise
 
+    async def stream_chat(self,
+                          messages: List[Dict[str, str]],
+                          model: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a chat completion from Ollama, yielding each response line as it arrives.
+        
+        Lines carry a partial `message.content`; the last one has `done: true` and
+        Ollama's generation counters. Failures are retried only until the first
+        line has been yielded, since a partial answer cannot be taken back.
+        """
+        if model is None:
+            model = self.default_model
+
+        for attempt in range(self.max_retries):
+            started = False
+            try:
+                logger.info(f"Streaming LLM response (attempt {attempt + 1}) using model: {model}")
+                
+                client = await self._get_client()
+                async with client.stream(
+                    "POST",
+                    f"{self.ollama_url}/api/chat",
+                    json=self._chat_payload(model, messages, stream=True)
+                ) as response:
+                    if response.status_code != 200:
+                        error_text = (await response.aread()).decode(errors="replace")
+                        logger.error(f"Ollama API error: {response.status_code} - {error_text}")
+                        raise Exception(f"Ollama API error: {response.status_code}")
+                    
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        data = json.loads(line)
+                        if data.get('error'):
+                            raise Exception(f"Ollama error: {data['error']}")
+                        started = True
+                        yield data
+                        if data.get('done'):
+                            logger.info("Finished streaming LLM response")
+                            return
+                    
+                    raise Exception("Ollama closed the stream before the response was done")
+                    
+            except Exception as e:
+                if not started and attempt < self.max_retries - 1:
+                    logger.warning(f"LLM streaming attempt {attempt + 1} failed: {e}. Retrying in {self.retry_delay} seconds...")
+                    await asyncio.sleep(self.retry_delay)
+                else:
+                    logger.error(f"Failed to stream LLM response: {e}")
+                    raise
+
     async def list_available_models(self) -> List[str]:
         """List available models in Ollama"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    return [model.get('name', '') for model in data.get('models', [])]
-                return []
+            client = await self._get_client()
+            response = await client.get(f"{self.ollama_url}/api/tags", timeout=10.0)
+            if response.status_code == 200:
+                data = response.json()
+                return [model.get('name', '') for model in data.get('models', [])]
+            return []
         except Exception as e:
             logger.error(f"Failed to list models: {e}")
             return []
\ No newline at end of file
@@ -0,0 +1,453 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Columns stored natively; any other metadata keys go into the JSON `extra` column.
+# For chunked notes note_id is the chunk's vector id and parent_id the source note.
+# parent_text holds the source note's full text on its first chunk's row when the
+# chunks alone do not reproduce it (several chunks, or trimmed whitespace).
+NOTE_COLUMNS = ("note_id", "subject_id", "hadm_id", "charttime", "cleaned_text",
+                "parent_id", "chunk_index", "chunk_start", "parent_text")
+
+class MetadataStore:
+    """SQLite-backed note metadata keyed by FAISS vector position.
+
+    Rows are looked up by position only for the hits a search returns, so note
+    text is never held in memory for the whole corpus. Writes are grouped into a
+    transaction that is committed by commit() (called from save_index).
+    """
+
+    def __init__(self, db_path: str = "metadata.db", mmap_size_mb: int = 1024, read_only: bool = False):
+        self.db_path = db_path
+        if read_only:
+            # Opened by read-only workers next to a writer process, which owns the schema
+            self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(f"PRAGMA mmap_size={mmap_size_mb * 1024 * 1024}")
+        if not read_only:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema()
+
+    def _create_schema(self):
+        """Create tables and indexes if they do not exist"""
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notes ("
+            "idx INTEGER PRIMARY KEY, "
+            "note_id TEXT NOT NULL UNIQUE, "
+            "subject_id INTEGER, "
+            "hadm_id INTEGER, "
+            "charttime TEXT, "
+            "cleaned_text TEXT, "
+            "extra TEXT, "
+            "parent_id TEXT, "
+            "chunk_index INTEGER, "
+            "chunk_start INTEGER, "
+            "parent_text TEXT)"
+        )
+        
+        # Stores created before chunking lack the chunk columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(notes)").fetchall()}
+        for column, column_type in (("parent_id", "TEXT"), ("chunk_index", "INTEGER"), ("chunk_start", "INTEGER"),
+                                    ("parent_text", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE notes ADD COLUMN {column} {column_type}")
+        
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_subject ON notes(subject_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_parent ON notes(parent_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        
+        # MinHash signatures of stored notes and their LSH band buckets, for near-duplicate checks
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS note_signatures ("
+            "note_id TEXT PRIMARY KEY, subject_id INTEGER, signature BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS note_signature_buckets ("
+            "subject_id INTEGER, bucket INTEGER NOT NULL, note_id TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_signature_buckets ON note_signature_buckets(subject_id, bucket)"
+        )
+        # Notes that were not embedded because they nearly duplicate a stored note
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS note_duplicates ("
+            "note_id TEXT PRIMARY KEY, canonical_id TEXT NOT NULL, subject_id INTEGER, similarity REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_canonical ON note_duplicates(canonical_id)")
+        # Positions of deleted vectors that may still be in the last index snapshot
+        self._conn.execute("CREATE TABLE IF NOT EXISTS deleted_vectors (idx INTEGER PRIMARY KEY)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_row(idx: int, note_id: str, metadata: Dict[str, Any]) -> Tuple:
+        """Flatten a metadata dict into a notes row"""
+        extra = {k: v for k, v in metadata.items() if k not in NOTE_COLUMNS}
+        return (
+            idx,
+            note_id,
+            metadata.get("subject_id"),
+            metadata.get("hadm_id"),
+            metadata.get("charttime"),
+            metadata.get("cleaned_text"),
+            json.dumps(extra) if extra else None,
+            metadata.get("parent_id"),
+            metadata.get("chunk_index"),
+            metadata.get("chunk_start"),
+            metadata.get("parent_text")
+        )
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        """Rebuild the metadata dict from a notes row"""
+        metadata = {column: row[column] for column in NOTE_COLUMNS if column in row.keys()}
+        # Rows written before chunking are whole notes
+        if metadata.get("parent_id") is None and "note_id" in metadata:
+            metadata["parent_id"] = metadata["note_id"]
+        if "extra" in row.keys() and row["extra"]:
+            metadata.update(json.loads(row["extra"]))
+        return metadata
+
+    def add(self, idx: int, note_id: str, metadata: Dict[str, Any]):
+        """Insert metadata for the vector at position idx"""
+        self._conn.execute(
+            "INSERT INTO notes (idx, note_id, subject_id, hadm_id, charttime, cleaned_text, extra, "
+            "parent_id, chunk_index, chunk_start, parent_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self._to_row(idx, note_id, metadata)
+        )
+
+    def add_many(self, rows: Iterable[Tuple[int, str, Dict[str, Any]]]):
+        """Insert metadata for several vectors in one statement"""
+        self._conn.executemany(
+            "INSERT INTO notes (idx, note_id, subject_id, hadm_id, charttime, cleaned_text, extra, "
+            "parent_id, chunk_index, chunk_start, parent_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [self._to_row(idx, note_id, metadata) for idx, note_id, metadata in rows]
+        )
+
+    def get_index(self, note_id: str) -> Optional[int]:
+        """Vector position for a note_id, or None if not stored"""
+        row = self._conn.execute("SELECT idx FROM notes WHERE note_id = ?", (note_id,)).fetchone()
+        return row[0] if row else None
+
+    def contains(self, note_id: str) -> bool:
+        """Check whether a note_id is stored"""
+        return self.get_index(note_id) is not None
+
+    def existing_note_ids(self, note_ids: List[str]) -> set:
+        """Subset of note_ids that are already stored"""
+        existing = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(note_ids), 500):
+            chunk = note_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT note_id FROM notes WHERE note_id IN ({placeholders})", chunk
+            ).fetchall()
+            existing.update(row[0] for row in rows)
+        return existing
+
+    def existing_parent_ids(self, parent_ids: List[str]) -> set:
+        """Subset of source note ids that already have at least one stored vector or are linked duplicates"""
+        existing = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(parent_ids), 250):
+            chunk = parent_ids[start:start + 250]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT parent_id FROM notes WHERE parent_id IN ({placeholders}) "
+                f"UNION SELECT note_id FROM notes WHERE parent_id IS NULL AND note_id IN ({placeholders}) "
+                f"UNION SELECT note_id FROM note_duplicates WHERE note_id IN ({placeholders})",
+                chunk + chunk + chunk
+            ).fetchall()
+            existing.update(row[0] for row in rows)
+        return existing
+
+    def get_note_texts(self, parent_ids: List[str]) -> Dict[str, str]:
+        """Full text of each source note, from its first chunk or stitched back together from its chunks"""
+        texts = {}
+        ends = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(parent_ids), 250):
+            chunk = parent_ids[start:start + 250]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT COALESCE(parent_id, note_id), chunk_start, cleaned_text, parent_text FROM notes "
+                f"WHERE parent_id IN ({placeholders}) OR (parent_id IS NULL AND note_id IN ({placeholders})) "
+                f"ORDER BY COALESCE(parent_id, note_id), chunk_index",
+                chunk + chunk
+            ).fetchall()
+            for parent_id, chunk_start, text, parent_text in rows:
+                if parent_text is not None:
+                    texts[parent_id] = parent_text
+                    ends[parent_id] = None
+                    continue
+                text = text or ""
+                if parent_id not in texts or chunk_start is None:
+                    texts[parent_id] = text
+                    ends[parent_id] = None if chunk_start is None else chunk_start + len(text)
+                    continue
+                end = ends[parent_id]
+                if end is None:
+                    continue  # Already complete
+                # Rows stored without parent_text: each chunk is the note's text at
+                # [chunk_start, chunk_start + len), so only its part past the
+                # stitched end is new. Whitespace trimmed between chunks is lost.
+                if chunk_start >= end:
+                    texts[parent_id] += "\n" + text
+                else:
+                    texts[parent_id] += text[end - chunk_start:]
+                ends[parent_id] = max(end, chunk_start + len(text))
+        return texts
+
+    def get_by_indices(self, indices: List[int], include_text: bool = True) -> Dict[int, Dict[str, Any]]:
+        """Load metadata for the given vector positions"""
+        if not indices:
+            return {}
+        columns = ("idx, note_id, subject_id, hadm_id, charttime, extra, parent_id, chunk_index, chunk_start"
+                   + (", cleaned_text" if include_text else ""))
+        results = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(indices), 500):
+            chunk = [int(i) for i in indices[start:start + 500]]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT {columns} FROM notes WHERE idx IN ({placeholders})", chunk
+            ).fetchall()
+            for row in rows:
+                results[row["idx"]] = self._from_row(row)
+        return results
+
+    def iter_texts(self, start: int, batch_size: int = 1000) -> Iterator[List[Tuple[int, str]]]:
+        """Yield batches of (position, text) for positions at or after start, in order"""
+        while True:
+            rows = self._conn.execute(
+                "SELECT idx, cleaned_text FROM notes WHERE idx >= ? ORDER BY idx LIMIT ?", (start, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield [(row[0], row[1] or "") for row in rows]
+            start = rows[-1][0] + 1
+
+    def add_signatures(self, rows: Iterable[Tuple[str, Optional[int], bytes, List[int]]]):
+        """Store (note_id, subject_id, signature, band buckets) for notes just added"""
+        signatures = []
+        buckets = []
+        for note_id, subject_id, signature, note_buckets in rows:
+            signatures.append((note_id, subject_id, signature))
+            buckets.extend((subject_id, bucket, note_id) for bucket in note_buckets)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO note_signatures (note_id, subject_id, signature) VALUES (?, ?, ?)", signatures
+        )
+        self._conn.executemany(
+            "INSERT INTO note_signature_buckets (subject_id, bucket, note_id) VALUES (?, ?, ?)", buckets
+        )
+
+    def signature_candidates(self, subject_id: Optional[int], buckets: List[int]) -> Dict[str, bytes]:
+        """Signatures of the subject's stored notes that share at least one band bucket"""
+        if not buckets:
+            return {}
+        placeholders = ",".join("?" * len(buckets))
+        rows = self._conn.execute(
+            f"SELECT s.note_id, s.signature FROM note_signatures s WHERE s.note_id IN ("
+            f"SELECT note_id FROM note_signature_buckets WHERE subject_id = ? AND bucket IN ({placeholders}))",
+            [subject_id, *buckets]
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def add_duplicates(self, rows: Iterable[Tuple[str, str, Optional[int], float]]):
+        """Link (note_id, canonical_id, subject_id, similarity) for notes skipped as near-duplicates"""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO note_duplicates (note_id, canonical_id, subject_id, similarity) VALUES (?, ?, ?, ?)",
+            list(rows)
+        )
+
+    def get_duplicates(self, canonical_ids: List[str]) -> Dict[str, List[str]]:
+        """Linked near-duplicate note ids for each canonical note"""
+        duplicates: Dict[str, List[str]] = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(canonical_ids), 500):
+            chunk = canonical_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT canonical_id, note_id FROM note_duplicates WHERE canonical_id IN ({placeholders}) "
+                f"ORDER BY canonical_id, note_id", chunk
+            ).fetchall()
+            for canonical_id, note_id in rows:
+                duplicates.setdefault(canonical_id, []).append(note_id)
+        return duplicates
+
+    def count_duplicates(self) -> int:
+        """Number of linked near-duplicate notes"""
+        return self._conn.execute("SELECT COUNT(*) FROM note_duplicates").fetchone()[0]
+
+    def indices_for_subject(self, subject_id: int) -> List[int]:
+        """Vector positions of every note for a subject"""
+        rows = self._conn.execute(
+            "SELECT idx FROM notes WHERE subject_id = ? ORDER BY idx", (subject_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def parent_ids_for_subject(self, subject_id: int) -> List[str]:
+        """Source note ids of every stored or linked note for a subject"""
+        rows = self._conn.execute(
+            "SELECT COALESCE(parent_id, note_id) FROM notes WHERE subject_id = ? "
+            "UNION SELECT note_id FROM note_duplicates WHERE subject_id = ?", (subject_id, subject_id)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_notes(self, parent_ids: List[str], keep_duplicate_links: bool = False) -> List[Tuple[int, str]]:
+        """Delete source notes and record their positions as deleted.
+
+        Removes the notes' chunk rows, signatures and duplicate links (a linked
+        duplicate is deleted by its own note id). Links from other notes to a
+        deleted canonical note are dropped too, unless keep_duplicate_links is
+        set because the note is about to be stored again. Returns (position,
+        text) for each deleted vector.
+        """
+        deleted = []
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(parent_ids), 250):
+            chunk = parent_ids[start:start + 250]
+            placeholders = ",".join("?" * len(chunk))
+            where = f"parent_id IN ({placeholders}) OR (parent_id IS NULL AND note_id IN ({placeholders}))"
+            rows = self._conn.execute(
+                f"SELECT idx, cleaned_text FROM notes WHERE {where} ORDER BY idx", chunk + chunk
+            ).fetchall()
+            deleted.extend((row[0], row[1] or "") for row in rows)
+
+            self._conn.execute(f"DELETE FROM notes WHERE {where}", chunk + chunk)
+            self._conn.execute(f"DELETE FROM note_signatures WHERE note_id IN ({placeholders})", chunk)
+            self._conn.execute(f"DELETE FROM note_signature_buckets WHERE note_id IN ({placeholders})", chunk)
+            self._conn.execute(f"DELETE FROM note_duplicates WHERE note_id IN ({placeholders})", chunk)
+            if not keep_duplicate_links:
+                self._conn.execute(f"DELETE FROM note_duplicates WHERE canonical_id IN ({placeholders})", chunk)
+
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO deleted_vectors (idx) VALUES (?)", ((idx,) for idx, _ in deleted)
+        )
+        return deleted
+
+    def linked_duplicate_ids(self, note_ids: List[str]) -> set:
+        """Subset of note_ids stored only as links to a canonical note"""
+        linked = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(note_ids), 500):
+            chunk = note_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT note_id FROM note_duplicates WHERE note_id IN ({placeholders})", chunk
+            ).fetchall()
+            linked.update(row[0] for row in rows)
+        return linked
+
+    def deleted_indices(self) -> List[int]:
+        """Positions deleted since the last snapshot that dropped them"""
+        return [row[0] for row in self._conn.execute("SELECT idx FROM deleted_vectors ORDER BY idx").fetchall()]
+
+    def forget_deleted(self, indices: List[int]):
+        """Stop tracking deleted positions once a snapshot without them is on disk"""
+        self._conn.executemany("DELETE FROM deleted_vectors WHERE idx = ?", ((int(idx),) for idx in indices))
+        self._conn.commit()
+
+    def count(self) -> int:
+        """Number of stored notes"""
+        return self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def max_index(self) -> int:
+        """Highest stored vector position, or -1 when empty"""
+        row = self._conn.execute("SELECT MAX(idx) FROM notes").fetchone()
+        return row[0] if row[0] is not None else -1
+
+    def unique_subjects(self) -> int:
+        """Number of distinct subject_ids (served from the subject index)"""
+        return self._conn.execute("SELECT COUNT(DISTINCT subject_id) FROM notes").fetchone()[0]
+
+    def truncate(self, ntotal: int):
+        """Drop rows for positions at or beyond ntotal (metadata saved ahead of the index)"""
+        deleted = self._conn.execute("DELETE FROM notes WHERE idx >= ?", (ntotal,)).rowcount
+        # Those positions will be handed out again, so they must not stay marked deleted
+        forgotten = self._conn.execute("DELETE FROM deleted_vectors WHERE idx >= ?", (ntotal,)).rowcount
+        if deleted:
+            logger.warning(f"Dropped metadata for {deleted} vectors missing from the FAISS index")
+            self._drop_orphaned_signatures()
+        if deleted or forgotten:
+            self._conn.commit()
+
+    def _drop_orphaned_signatures(self):
+        """Remove signatures and duplicate links of notes no longer stored"""
+        stored = "SELECT COALESCE(parent_id, note_id) FROM notes"
+        self._conn.execute(f"DELETE FROM note_signatures WHERE note_id NOT IN ({stored})")
+        self._conn.execute(f"DELETE FROM note_signature_buckets WHERE note_id NOT IN ({stored})")
+        self._conn.execute(f"DELETE FROM note_duplicates WHERE canonical_id NOT IN ({stored})")
+
+    def get_meta(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Read a store-level setting"""
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, name: str, value: Any):
+        """Write a store-level setting"""
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def data_version(self) -> int:
+        """Changes whenever another connection commits to the database"""
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def commit(self):
+        """Commit pending writes"""
+        self._conn.commit()
+
+    def clear(self):
+        """Delete all notes and settings"""
+        self._conn.execute("DELETE FROM notes")
+        self._conn.execute("DELETE FROM meta")
+        self._conn.execute("DELETE FROM note_signatures")
+        self._conn.execute("DELETE FROM note_signature_buckets")
+        self._conn.execute("DELETE FROM note_duplicates")
+        self._conn.execute("DELETE FROM deleted_vectors")
+        self._conn.commit()
+
+    def size_bytes(self) -> int:
+        """On-disk size including the WAL file"""
+        size = 0
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def migrate_from_pickle(self, pickle_path: str):
+        """One-time import of a legacy metadata.pkl"""
+        logger.info(f"Migrating legacy metadata from {pickle_path}")
+        with open(pickle_path, 'rb') as f:
+            data = pickle.load(f)
+
+        metadata = data.get('metadata', {})
+        id_to_index = data.get('id_to_index', {})
+        self.add_many(
+            (int(idx), note_id, metadata[note_id])
+            for note_id, idx in id_to_index.items()
+            if note_id in metadata
+        )
+        for name in ('next_index', 'dimension', 'index_type'):
+            if name in data:
+                self.set_meta(name, data[name])
+        self.commit()
+
+        # Keep the original file around but out of the way
+        os.replace(pickle_path, f"{pickle_path}.migrated")
+        logger.info(f"Migrated metadata for {len(id_to_index)} records to {self.db_path}")
+
+    def close(self):
+        """Commit and close the connection"""
+        try:
+            self._conn.commit()
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"Failed to close metadata store: {e}")
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_POLICIES = ("skip", "link")
+
+# Multiply-shift hashing: h(x) = ((a * x + b) mod 2^64) >> 32, with odd a
+_HASH_SHIFT = np.uint64(32)
+
+class NearDuplicateDetector:
+    """MinHash signatures and LSH banding for near-duplicate notes.
+
+    Notes are compared on word shingles of their cleaned text. A signature of
+    num_perm minimum hashes estimates Jaccard similarity, and the signature is
+    cut into bands so that only notes sharing at least one band bucket are
+    compared at all. The band layout is chosen so that pairs near the threshold
+    are very likely to collide; candidates are then checked against the full
+    signature. Matching is limited to the same subject, since copy-forward
+    happens within a patient's record and a templated note of another patient
+    is still that patient's note.
+    """
+
+    def __init__(self,
+                 threshold: float = 0.9,
+                 policy: str = "link",
+                 num_perm: int = 128,
+                 shingle_size: int = 5,
+                 seed: int = 1):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"Near-duplicate threshold must be in (0, 1], got {threshold}")
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown near-duplicate policy '{policy}', expected one of {DUPLICATE_POLICIES}")
+
+        self.threshold = threshold
+        self.policy = policy
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self._choose_bands(num_perm, threshold)
+
+        # Fixed seed: signatures are persisted and must stay comparable across restarts
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+
+        logger.info(f"Near-duplicate detection: threshold {threshold}, policy {policy}, "
+                    f"{self.bands} bands of {self.rows} hashes")
+
+    @staticmethod
+    def _choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+        """Band count and rows per band whose collision curve rises just below the threshold"""
+        best = (num_perm, 1)
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            # Similarity at which a pair collides in some band with probability ~1/2
+            if (1.0 / bands) ** (1.0 / rows) <= threshold:
+                best = (bands, rows)
+        return best
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """Stable 32-bit hashes of the word shingles of a text"""
+        tokens = tokenize(text)
+        if not tokens:
+            return np.empty(0, dtype=np.uint64)
+        if len(tokens) <= self.shingle_size:
+            shingles = {" ".join(tokens)}
+        else:
+            shingles = {" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+        return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                           dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature of a text, or None if it has no words"""
+        shingles = self._shingles(text)
+        if not len(shingles):
+            return None
+        # Overflow wraps modulo 2^64, which is what multiply-shift hashing relies on
+        with np.errstate(over="ignore"):
+            hashed = (np.outer(self._a, shingles) + self._b[:, None]) >> _HASH_SHIFT
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def band_buckets(self, signature: np.ndarray) -> List[int]:
+        """One bucket key per band; notes sharing a key are candidate duplicates"""
+        buckets = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                                     digest_size=8, person=band.to_bytes(4, "little")).digest()
+            buckets.append(int.from_bytes(digest, "little", signed=True))
+        return buckets
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(a == b))
+
+    def best_match(self, signature: np.ndarray, candidates: Dict[str, np.ndarray]) -> Optional[Tuple[str, float]]:
+        """Most similar candidate at or above the threshold, as (note_id, similarity)"""
+        best = None
+        for note_id, candidate in candidates.items():
+            score = self.similarity(signature, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (note_id, score)
+        return best
+
+    def get_config(self) -> Dict[str, object]:
+        return {
+            "threshold": self.threshold,
+            "policy": self.policy,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "rows_per_band": self.rows,
+            "shingle_size": self.shingle_size
+        }
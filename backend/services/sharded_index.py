@@ -0,0 +1,223 @@
+import logging
+import re
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ways of splitting vectors into shards
+SHARD_KEYS = ("subject", "time")
+
+LAYOUT_TAG = re.compile(r"^(subject|time)(\d+)$")
+
+def stored_ids(index: faiss.Index) -> np.ndarray:
+    """Positions of every vector in one index (tombstones included), ascending"""
+    if isinstance(index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(index.id_map)
+    else:
+        invlists = index.invlists
+        ids = [faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+               for i in range(invlists.nlist) if invlists.list_size(i)]
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    return np.sort(ids)
+
+@dataclass(frozen=True)
+class ShardLayout:
+    """How vectors are split into shards; the default is a single unsharded index.
+
+    "subject" hashes subject_id over num_shards shards, so all notes of a
+    subject share one shard. "time" starts a new shard every shard_vectors
+    positions, so only the newest shard changes as notes are ingested.
+    """
+    shard_by: Optional[str] = None
+    num_shards: int = 1
+    shard_vectors: int = 1_000_000
+
+    def __post_init__(self):
+        if self.shard_by is not None and self.shard_by not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key '{self.shard_by}', expected one of {SHARD_KEYS}")
+        if self.num_shards < 1 or self.shard_vectors < 1:
+            raise ValueError("num_shards and shard_vectors must be positive")
+
+    @property
+    def tag(self) -> Optional[str]:
+        """Short name of the layout used in snapshot file names, None when unsharded"""
+        if self.shard_by == "subject":
+            return f"subject{self.num_shards}"
+        if self.shard_by == "time":
+            return f"time{self.shard_vectors}"
+        return None
+
+    @classmethod
+    def from_tag(cls, tag: Optional[str]) -> "ShardLayout":
+        """Layout named by tag (None or "" for unsharded)"""
+        if not tag:
+            return cls()
+        match = LAYOUT_TAG.match(tag)
+        if match is None:
+            raise ValueError(f"Unknown shard layout '{tag}'")
+        if match.group(1) == "subject":
+            return cls("subject", num_shards=int(match.group(2)))
+        return cls("time", shard_vectors=int(match.group(2)))
+
+    def assign(self, positions: np.ndarray, subject_ids: Optional[Sequence[Optional[int]]] = None) -> np.ndarray:
+        """Shard of each vector; notes without a subject go to shard 0"""
+        if self.shard_by == "subject":
+            return np.array([int(subject_id) % self.num_shards if subject_id is not None else 0
+                             for subject_id in subject_ids], dtype=np.int64)
+        if self.shard_by == "time":
+            return np.asarray(positions, dtype=np.int64) // self.shard_vectors
+        return np.zeros(len(positions), dtype=np.int64)
+
+    def shard_count(self, next_index: int) -> int:
+        """Number of shards for positions below next_index"""
+        if self.shard_by == "subject":
+            return self.num_shards
+        if self.shard_by == "time":
+            return max(1, -(-next_index // self.shard_vectors))
+        return 1
+
+class ShardedIndex:
+    """FAISS indexes over disjoint sets of vector positions, searched as one.
+
+    Every shard carries the global vector positions as its ids, so hits from
+    different shards merge directly and metadata lookups are unchanged. A search
+    runs on each shard in a thread pool (FAISS releases the GIL while it
+    searches) and the per-shard top-k lists are combined with a k-way heap
+    merge; a search restricted to some positions only visits the shards holding
+    them. An unsharded store is a single shard searched in the calling thread.
+    """
+
+    def __init__(self, shards: List[faiss.Index], layout: ShardLayout, executor: Optional[Executor] = None):
+        self.shards = list(shards)
+        self.layout = layout
+        self.executor = executor
+        # Shard holding each position (-1 for none), kept when there can be several shards
+        self._locations = np.zeros(0, dtype=np.int32)
+        if layout.shard_by is not None:
+            for shard, index in enumerate(self.shards):
+                self._locate(stored_ids(index), shard)
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors across all shards"""
+        return sum(index.ntotal for index in self.shards)
+
+    def sizes(self) -> List[int]:
+        """Vectors in each shard"""
+        return [index.ntotal for index in self.shards]
+
+    def _locate(self, ids: np.ndarray, shard: int):
+        if len(ids) == 0:
+            return
+        needed = int(ids.max()) + 1
+        if needed > len(self._locations):
+            grown = np.full(max(needed, 2 * len(self._locations)), -1, dtype=np.int32)
+            grown[:len(self._locations)] = self._locations
+            self._locations = grown
+        self._locations[ids] = shard
+
+    def locate(self, ids: np.ndarray) -> np.ndarray:
+        """Shard holding each position, -1 where none does"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.layout.shard_by is None:
+            return np.zeros(len(ids), dtype=np.int64)
+        shards = np.full(len(ids), -1, dtype=np.int64)
+        inside = ids < len(self._locations)
+        shards[inside] = self._locations[ids[inside]]
+        return shards
+
+    def shards_holding(self, ids: np.ndarray) -> List[int]:
+        """Shards holding any of the positions"""
+        shards = np.unique(self.locate(ids))
+        return [int(shard) for shard in shards if shard >= 0]
+
+    def stored_ids(self, shard: Optional[int] = None) -> np.ndarray:
+        """Positions of every vector in one shard or all of them, ascending"""
+        if shard is not None:
+            return stored_ids(self.shards[shard])
+        if len(self.shards) == 1:
+            return stored_ids(self.shards[0])
+        return np.sort(np.concatenate([stored_ids(index) for index in self.shards]))
+
+    def add_shard(self, index: faiss.Index):
+        """Append an empty shard"""
+        self.shards.append(index)
+
+    def replace_shard(self, shard: int, index: faiss.Index):
+        """Swap in a rebuilt shard"""
+        self.shards[shard] = index
+        if self.layout.shard_by is not None:
+            self._locations[self._locations == shard] = -1
+            self._locate(stored_ids(index), shard)
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray, shard_ids: np.ndarray) -> Set[int]:
+        """Add vectors to the given shards, returning the shards changed"""
+        if len(self.shards) == 1:
+            self.shards[0].add_with_ids(vectors, ids)
+            if self.layout.shard_by is not None:
+                self._locate(ids, 0)
+            return {0}
+        changed = set()
+        for shard in np.unique(shard_ids):
+            rows = np.flatnonzero(shard_ids == shard)
+            self.shards[shard].add_with_ids(vectors[rows], ids[rows])
+            self._locate(ids[rows], int(shard))
+            changed.add(int(shard))
+        return changed
+
+    def remove_ids(self, ids: np.ndarray) -> Set[int]:
+        """Remove vectors from the shards holding them, returning the shards changed"""
+        ids = np.asarray(ids, dtype=np.int64)
+        locations = self.locate(ids)
+        changed = set()
+        for shard in np.unique(locations[locations >= 0]):
+            shard_ids = np.ascontiguousarray(ids[locations == shard])
+            # IVF's id hashtable only supports removing an explicit id array
+            self.shards[shard].remove_ids(faiss.IDSelectorArray(len(shard_ids), faiss.swig_ptr(shard_ids)))
+            if self.layout.shard_by is not None:
+                self._locations[shard_ids] = -1
+            changed.add(int(shard))
+        return changed
+
+    def reconstruct_batch(self, ids: np.ndarray) -> np.ndarray:
+        """Stored vectors of the given positions, in order"""
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if len(self.shards) == 1:
+            return self.shards[0].reconstruct_batch(ids)
+        locations = self.locate(ids)
+        if (locations < 0).any():
+            raise KeyError(f"{int((locations < 0).sum())} positions are not in the index")
+        vectors = np.empty((len(ids), self.shards[0].d), dtype=np.float32)
+        for shard in np.unique(locations):
+            rows = np.flatnonzero(locations == shard)
+            vectors[rows] = self.shards[shard].reconstruct_batch(ids[rows])
+        return vectors
+
+    def search(self,
+               query_vectors: np.ndarray,
+               k: int,
+               params: Optional[faiss.SearchParameters] = None,
+               shards: Optional[Iterable[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (similarities, positions) per query over all shards or the given ones"""
+        indexes = [self.shards[shard] for shard in (range(len(self.shards)) if shards is None else shards)]
+        indexes = [index for index in indexes if index.ntotal > 0] or indexes[:1]
+
+        def search_shard(index: faiss.Index):
+            if params is not None:
+                return index.search(query_vectors, k, params=params)
+            return index.search(query_vectors, k)
+
+        if len(indexes) == 1:
+            return search_shard(indexes[0])
+
+        results = self.executor.map(search_shard, indexes) if self.executor is not None else map(search_shard, indexes)
+        # Each shard's list is already sorted; keep the k best across them
+        heap = faiss.ResultHeap(len(query_vectors), k, keep_max=True)
+        for similarities, indices in results:
+            heap.add_result(similarities, indices)
+        heap.finalize()
+        return heap.D, heap.I
@@ -0,0 +1,339 @@
+import asyncio
+import codecs
+import csv
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from models import MimicRecord
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FORMATS = ("csv", "jsonl", "parquet")
+
+# Extensions and content types used to guess the format when it is not given
+FORMAT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+FORMAT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/x-jsonlines": "jsonl",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet"
+}
+
+# MIMIC-IV note exports name the note body `text`
+FIELD_ALIASES = {"text": "cleaned_text"}
+RECORD_FIELDS = tuple(MimicRecord.model_fields)
+
+class UploadError(ValueError):
+    """Raised when an upload cannot be read as a note export"""
+    pass
+
+def detect_format(requested: Optional[str], filename: Optional[str], content_type: Optional[str]) -> str:
+    """Upload format from the explicit parameter, else the file extension, else the content type"""
+    if requested:
+        if requested not in UPLOAD_FORMATS:
+            raise UploadError(f"Unknown upload format '{requested}', expected one of {UPLOAD_FORMATS}")
+        return requested
+    if filename:
+        extension = os.path.splitext(filename.lower())[1]
+        if extension in FORMAT_EXTENSIONS:
+            return FORMAT_EXTENSIONS[extension]
+    if content_type:
+        media_type = content_type.split(";")[0].strip().lower()
+        if media_type in FORMAT_CONTENT_TYPES:
+            return FORMAT_CONTENT_TYPES[media_type]
+    raise UploadError(f"Cannot determine the upload format; pass format as one of {UPLOAD_FORMATS}")
+
+class MultipartFileReader:
+    """Pull the bytes of one file field out of a multipart/form-data request stream.
+
+    Starlette's UploadFile spools the whole file before the endpoint runs; this
+    feeds the raw request stream through python-multipart and hands out the
+    file's bytes as they arrive.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], content_type: str, field_name: str = "file"):
+        _, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise UploadError("Missing multipart boundary")
+
+        self.field_name = field_name.encode("utf-8")
+        self.filename: Optional[str] = None
+        self._stream = stream
+        self._data: List[bytes] = []
+        self._in_file = False
+        self._file_done = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") == self.field_name and not self._file_done:
+            self._in_file = True
+            self.filename = options.get(b"filename", b"").decode("utf-8", errors="replace") or None
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._data.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _pump(self) -> bool:
+        """Feed the next piece of the request body to the parser; False once it is exhausted"""
+        async for chunk in self._stream:
+            if chunk:
+                self._parser.write(chunk)
+                return True
+        return False
+
+    async def open(self):
+        """Read up to the start of the file field so its filename is known"""
+        while not (self._in_file or self._file_done):
+            if not await self._pump():
+                raise UploadError(f"No '{self.field_name.decode()}' file field in the upload")
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Bytes of the file field as they arrive"""
+        while True:
+            if self._data:
+                data = self._data
+                self._data = []
+                for piece in data:
+                    yield piece
+            if self._file_done:
+                return
+            if not await self._pump():
+                raise UploadError("Upload ended before the file was complete")
+
+class _CSVRows:
+    """Incremental CSV reader that keeps quoted fields spanning several lines together"""
+
+    def __init__(self):
+        self.columns: Optional[List[str]] = None
+        self._record: List[str] = []
+        self._record_size = 0
+        self._quotes = 0
+
+    def feed(self, line: str) -> Optional[Dict[str, str]]:
+        """Add one line; returns a row once a complete record has been read"""
+        self._record.append(line)
+        self._record_size += len(line)
+        self._quotes += line.count('"')
+        # An odd number of quotes means a quoted field continues on the next line
+        if self._quotes % 2:
+            return None
+
+        text = "".join(self._record)
+        self._record = []
+        self._record_size = 0
+        self._quotes = 0
+        values = next(csv.reader([text]), [])
+        if not values:
+            return None
+        if self.columns is None:
+            self.columns = [column.strip().lower() for column in values]
+            return None
+        return dict(zip(self.columns, values))
+
+    @property
+    def pending_size(self) -> int:
+        return self._record_size
+
+class UploadParser:
+    """Turn an uploaded note export into validated MimicRecords as it streams in.
+
+    CSV and JSONL are parsed line by line from the incoming bytes, so memory is
+    bounded by the largest record. Parquet keeps its schema in the footer, so it
+    is spooled to a temporary file and then read one row group at a time; it
+    needs pyarrow. Invalid rows are counted and skipped, and the first few
+    errors are kept for the response.
+    """
+
+    def __init__(self,
+                 upload_format: str,
+                 max_record_bytes: int = 16 * 1024 * 1024,
+                 max_errors_kept: int = 20,
+                 parquet_batch_size: int = 1000):
+        if upload_format not in UPLOAD_FORMATS:
+            raise UploadError(f"Unknown upload format '{upload_format}', expected one of {UPLOAD_FORMATS}")
+        if upload_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise UploadError("Parquet uploads need pyarrow (pip install pyarrow)")
+        self.upload_format = upload_format
+        self.max_record_bytes = max_record_bytes
+        self.max_errors_kept = max_errors_kept
+        self.parquet_batch_size = parquet_batch_size
+
+        self.rows_read = 0
+        self.rows_invalid = 0
+        self.bytes_read = 0
+        self.errors: List[str] = []
+
+    async def records(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[MimicRecord]:
+        """Validated records parsed from the upload's bytes"""
+        if self.upload_format == "parquet":
+            rows = self._parquet_rows(chunks)
+        else:
+            rows = self._text_rows(chunks)
+
+        async for row in rows:
+            self.rows_read += 1
+            record = self._validate(row)
+            if record is not None:
+                yield record
+
+        logger.info(f"Parsed {self.rows_read} rows from {self.upload_format} upload "
+                    f"({self.bytes_read} bytes), {self.rows_invalid} invalid")
+
+    async def _lines(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+        """Decoded lines (with line endings) from the byte stream"""
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        buffered = ""
+        async for chunk in chunks:
+            self.bytes_read += len(chunk)
+            buffered += decoder.decode(chunk)
+            # Split on newlines only; note text may contain other line separators
+            lines = buffered.split("\n")
+            # The last piece is a partial line
+            buffered = lines.pop()
+            if len(buffered) > self.max_record_bytes:
+                raise UploadError(f"Line longer than {self.max_record_bytes} bytes")
+            for line in lines:
+                yield line + "\n"
+        buffered += decoder.decode(b"", final=True)
+        if buffered:
+            yield buffered
+
+    async def _text_rows(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+        """Rows of a CSV or JSONL upload"""
+        if self.upload_format == "csv":
+            reader = _CSVRows()
+            async for line in self._lines(chunks):
+                row = reader.feed(line)
+                if row is not None:
+                    yield row
+                elif reader.pending_size > self.max_record_bytes:
+                    raise UploadError(f"CSV record longer than {self.max_record_bytes} bytes (unbalanced quotes?)")
+            if reader.pending_size:
+                raise UploadError("CSV upload ended inside a quoted field")
+            return
+
+        line_number = 0
+        async for line in self._lines(chunks):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.rows_read += 1
+                self._invalid(f"line {line_number}: invalid JSON ({e.msg})")
+                continue
+            if not isinstance(row, dict):
+                self.rows_read += 1
+                self._invalid(f"line {line_number}: expected a JSON object")
+                continue
+            yield row
+
+    async def _parquet_rows(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+        """Rows of a Parquet upload, read one batch at a time from a spooled copy"""
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryFile() as spool:
+            async for chunk in chunks:
+                self.bytes_read += len(chunk)
+                spool.write(chunk)
+            spool.seek(0)
+
+            try:
+                batches = pq.ParquetFile(spool).iter_batches(batch_size=self.parquet_batch_size)
+            except Exception as e:
+                raise UploadError(f"Invalid Parquet file: {e}")
+            while True:
+                # Decoding a batch is CPU work; keep it off the event loop
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                for row in batch.to_pylist():
+                    yield row
+
+    def _validate(self, row: Dict[str, Any]) -> Optional[MimicRecord]:
+        """Map export columns onto MimicRecord; None (and an error entry) for a bad row"""
+        columns = {str(key).strip().lower(): value for key, value in row.items()}
+        for alias, name in FIELD_ALIASES.items():
+            if name not in columns and alias in columns:
+                columns[name] = columns[alias]
+
+        fields = {}
+        for name in RECORD_FIELDS:
+            value = columns.get(name)
+            if value is not None and value != "":
+                fields[name] = str(value) if name in ("note_id", "charttime", "cleaned_text") else value
+
+        missing = [name for name in RECORD_FIELDS if name not in fields]
+        if missing:
+            self._invalid(f"row {self.rows_read}: missing {', '.join(missing)}")
+            return None
+        if not fields["cleaned_text"].strip():
+            self._invalid(f"row {self.rows_read} ({fields['note_id']}): empty text")
+            return None
+        try:
+            return MimicRecord(**fields)
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            self._invalid(f"row {self.rows_read} ({fields['note_id']}): {problems}")
+            return None
+
+    def _invalid(self, error: str):
+        self.rows_invalid += 1
+        if len(self.errors) < self.max_errors_kept:
+            self.errors.append(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Row and byte counters for the upload so far"""
+        return {
+            "format": self.upload_format,
+            "rows_read": self.rows_read,
+            "rows_invalid": self.rows_invalid,
+            "bytes_read": self.bytes_read
+        }
@@ -0,0 +1,76 @@
+import os
+from typing import Optional
+import numpy as np
+
+class VectorFile:
+    """Full-precision vectors by position in a memory-mapped file, for exact re-ranking.
+
+    Row i holds the normalized float32 vector stored at position i; rows of
+    deleted positions stay in place. The rows live in the page cache rather
+    than the heap, so a compressed index keeps its memory savings while a
+    re-rank only pages in the rows of its candidates. Read-only workers map the
+    writer's file when they load a generation; the writer only appends rows and
+    replaces the file on clear, so a mapping stays valid for the positions it
+    was made for.
+    """
+
+    def __init__(self, path: str, dimension: int, read_only: bool = False, grow_rows: int = 65_536):
+        self.path = path
+        self.dimension = dimension
+        self.read_only = read_only
+        self.grow_rows = grow_rows
+        self.row_bytes = dimension * np.dtype(np.float32).itemsize
+        self._vectors: Optional[np.memmap] = None
+        if not read_only and not os.path.exists(path):
+            open(path, "wb").close()
+        self._map()
+
+    def _map(self):
+        """Map the rows currently in the file"""
+        rows = os.path.getsize(self.path) // self.row_bytes if os.path.exists(self.path) else 0
+        self._vectors = None
+        if rows:
+            self._vectors = np.memmap(self.path, dtype=np.float32, mode="r" if self.read_only else "r+",
+                                      shape=(rows, self.dimension))
+
+    @property
+    def capacity(self) -> int:
+        """Rows mapped, including ones not written yet"""
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def write(self, positions: np.ndarray, vectors: np.ndarray):
+        """Store the vectors of the given positions, growing the file as needed"""
+        if len(positions) == 0:
+            return
+        needed = int(np.max(positions)) + 1
+        if needed > self.capacity:
+            rows = max(needed, 2 * self.capacity, self.grow_rows)
+            with open(self.path, "r+b") as f:
+                f.truncate(rows * self.row_bytes)
+            self._map()
+        self._vectors[positions] = vectors
+
+    def read(self, positions: np.ndarray) -> np.ndarray:
+        """Vectors of the given positions, in order"""
+        if len(positions) and int(np.max(positions)) >= self.capacity:
+            raise KeyError(f"Position {int(np.max(positions))} is beyond the vectors in {self.path}")
+        return np.asarray(self._vectors[positions])
+
+    def flush(self):
+        """Write dirty pages back to the file"""
+        if self._vectors is not None:
+            self._vectors.flush()
+
+    def reset(self):
+        """Start an empty file, replacing the old one so existing mappings stay valid"""
+        tmp_path = f"{self.path}.tmp"
+        open(tmp_path, "wb").close()
+        os.replace(tmp_path, self.path)
+        self._map()
+
+    def size_bytes(self) -> int:
+        """Disk space used by the file; rows reserved for growth stay sparse until written"""
+        if not os.path.exists(self.path):
+            return 0
+        stat = os.stat(self.path)
+        return min(stat.st_size, getattr(stat, "st_blocks", stat.st_size // 512) * 512)
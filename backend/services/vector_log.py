@@ -0,0 +1,152 @@
+import logging
+import os
+from typing import Iterator, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class VectorLog:
+    """Append-only log of (position, vector) records written between index snapshots.
+
+    Records are fixed size (int64 position + float32 vector) so a torn write at
+    the end of the file is detected and ignored on replay. Appends are buffered
+    and only made durable by sync(), which callers invoke once per batch.
+    """
+
+    def __init__(self, log_path: str, dimension: int):
+        self.log_path = log_path
+        self.rotated_path = f"{log_path}.1"
+        self.dimension = dimension
+        self.record_dtype = np.dtype([("position", "<i8"), ("vector", "<f4", (dimension,))])
+        self.pending_records = 0
+        self._truncate_torn_record(self.rotated_path)
+        self._truncate_torn_record(log_path)
+        self.records_since_snapshot = self._count_records(self.rotated_path) + self._count_records(log_path)
+        self._file = open(log_path, "ab")
+
+    def _truncate_torn_record(self, path: str):
+        """Cut a partial record left by a crash so later appends stay aligned"""
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        if size % self.record_dtype.itemsize:
+            logger.warning(f"Discarding torn record at the end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(size - size % self.record_dtype.itemsize)
+
+    def _count_records(self, path: str) -> int:
+        """Number of complete records in a log file"""
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // self.record_dtype.itemsize
+
+    def append(self, positions: np.ndarray, vectors: np.ndarray):
+        """Buffer records for vectors stored at the given index positions"""
+        records = np.empty(len(positions), dtype=self.record_dtype)
+        records["position"] = positions
+        records["vector"] = vectors
+        self._file.write(records.tobytes())
+        self.pending_records += len(positions)
+        self.records_since_snapshot += len(positions)
+
+    def sync(self) -> int:
+        """Flush and fsync buffered records; returns how many were made durable"""
+        synced = self.pending_records
+        if synced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.pending_records = 0
+        return synced
+
+    def rotate(self):
+        """Move the live log aside before a snapshot so new appends go to a fresh file.
+
+        Records in the rotated file are covered by the snapshot being written and
+        the file is deleted by discard_rotated() once that snapshot is durable.
+        """
+        self.sync()
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            # A previous snapshot failed; keep its records ahead of the current ones
+            with open(self.rotated_path, "ab") as rotated, open(self.log_path, "rb") as current:
+                rotated.write(current.read())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.rotated_path)
+        self._file = open(self.log_path, "ab")
+
+    def discard_rotated(self):
+        """Delete the rotated log after the snapshot covering it has been written"""
+        if os.path.exists(self.rotated_path):
+            self.records_since_snapshot -= self._count_records(self.rotated_path)
+            os.remove(self.rotated_path)
+
+    def replay(self, start_position: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (positions, vectors) batches for records at or after start_position, in order.
+
+        The first record may lie beyond start_position: vectors deleted before
+        the snapshot leave no trace in it, so its highest position can trail the
+        log. From there on positions must be contiguous.
+        """
+        expected = None
+        for path in (self.rotated_path, self.log_path):
+            if not os.path.exists(path):
+                continue
+            records = np.fromfile(path, dtype=self.record_dtype, count=self._count_records(path))
+            records = records[records["position"] >= (start_position if expected is None else expected)]
+            if len(records) == 0:
+                continue
+            if expected is None:
+                expected = int(records["position"][0])
+
+            # Only a contiguous run from the expected position can be applied
+            positions = records["position"]
+            contiguous = np.flatnonzero(positions != np.arange(expected, expected + len(positions)))
+            if len(contiguous):
+                logger.warning(f"Vector log {path} has a gap at position {expected + contiguous[0]}, ignoring the rest")
+                records = records[:contiguous[0]]
+            if len(records) == 0:
+                break
+
+            expected += len(records)
+            yield records["position"].copy(), records["vector"].copy()
+
+    def truncate_from(self, position: int):
+        """Drop records at or beyond position (vectors whose metadata never committed)"""
+        self.sync()
+        for path in (self.rotated_path, self.log_path):
+            if not os.path.exists(path):
+                continue
+            records = np.fromfile(path, dtype=self.record_dtype, count=self._count_records(path))
+            keep = records[records["position"] < position]
+            if len(keep) == len(records):
+                continue
+            logger.warning(f"Discarding {len(records) - len(keep)} uncommitted vectors from {path}")
+            if path == self.log_path:
+                self._file.close()
+            keep.tofile(path)
+            if path == self.log_path:
+                self._file = open(self.log_path, "ab")
+            self.records_since_snapshot -= len(records) - len(keep)
+
+    def reset(self):
+        """Delete all log files and start an empty log"""
+        self._file.close()
+        for path in (self.log_path, self.rotated_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._file = open(self.log_path, "ab")
+        self.pending_records = 0
+        self.records_since_snapshot = 0
+
+    def size_bytes(self) -> int:
+        """On-disk size of the live and rotated logs"""
+        return sum(os.path.getsize(path) for path in (self.log_path, self.rotated_path) if os.path.exists(path))
+
+    def close(self):
+        """Sync and close the log file"""
+        try:
+            self.sync()
+            self._file.close()
+        except Exception as e:
+            logger.error(f"Failed to close vector log: {e}")
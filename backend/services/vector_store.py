@@ -1,203 +1,1584 @@
+import asyncio
 import faiss
+import functools
+import json
 import numpy as np
-import pickle
 import os
 import logging
+import math
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from models import VectorSearchResult
+from services.metadata_store import MetadataStore
+from services.vector_log import VectorLog
+from services.vector_file import VectorFile
+from services.lexical_index import LexicalIndex
+from services.rw_lock import ReadWriteLock
+from services.sharded_index import ShardLayout, ShardedIndex
+from services.metrics import (
+    BYTES_WRITTEN,
+    INDEX_SEARCH_SECONDS,
+    SAVE_INDEX_SECONDS,
+    SEARCH_HITS_MERGED,
+    SUBJECT_FILTER_EXCLUDED
+)
 
 logger = logging.getLogger(__name__)
 
+# Supported FAISS index layouts, all using inner product over normalized vectors
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_pq")
+
+# How flat, HNSW and IVF-flat indexes store vectors: as float32, or scalar
+# quantized to half precision (half the memory) or 8 bits per dimension (a quarter)
+VECTOR_ENCODINGS = ("float32", "fp16", "int8")
+SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+# Read-only workers map published snapshots instead of copying them into their
+# heap. IO_FLAG_MMAP_IFC (faiss >= 1.11) maps the vectors of every index type;
+# older releases can only map IVF inverted lists.
+SNAPSHOT_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+SNAPSHOT_MMAP_ALL = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+MANIFEST_NAME = "manifest.json"
+
 class VectorStore:
     def __init__(self, 
                  index_path: str = "faiss_index.bin",
-                 metadata_path: str = "metadata.pkl",
-                 dimension: int = 768):  # Common dimension for nomic-embed-text
+                 metadata_path: str = "metadata.db",
+                 legacy_metadata_path: str = "metadata.pkl",
+                 dimension: int = 768,  # Common dimension for nomic-embed-text
+                 index_type: str = "flat",
+                 nlist: Optional[int] = None,
+                 pq_m: int = 64,
+                 pq_nbits: int = 8,
+                 hnsw_m: int = 32,
+                 ef_construction: int = 200,
+                 nprobe: int = 16,
+                 ef_search: int = 64,
+                 ann_min_vectors: int = 50_000,
+                 exact_filter_max_ids: int = 20_000,
+                 log_path: Optional[str] = None,
+                 compact_after_vectors: int = 50_000,
+                 chunk_overfetch: int = 3,
+                 lexical_index_path: Optional[str] = None,
+                 hybrid_candidates: int = 50,
+                 rrf_k: int = 60,
+                 rebuild_deleted_fraction: float = 0.2,
+                 executor_threads: int = 4,
+                 publish_dir: Optional[str] = None,
+                 publish_interval_seconds: float = 30.0,
+                 read_only: bool = False,
+                 shard_by: Optional[str] = None,
+                 num_shards: int = 4,
+                 shard_vectors: int = 1_000_000,
+                 vector_encoding: str = "float32",
+                 exact_rerank: bool = False,
+                 rerank_factor: int = 4,
+                 vectors_path: Optional[str] = None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        if vector_encoding not in VECTOR_ENCODINGS:
+            raise ValueError(f"Unknown vector encoding '{vector_encoding}', expected one of {VECTOR_ENCODINGS}")
+        
         self.index_path = index_path
         self.metadata_path = metadata_path
+        self.legacy_metadata_path = legacy_metadata_path
         self.dimension = dimension
-        self.index = None
-        self.metadata = {}
-        self.id_to_index = {}
-        self.index_to_id = {}
+        
+        # ANN configuration. IVF variants start as a flat index and are trained
+        # and converted once ann_min_vectors vectors have been added.
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.ann_min_vectors = ann_min_vectors
+        
+        # Compressed storage: fp16 indexes start that way, int8 ones need training
+        # data so they start as float32 and are converted at ann_min_vectors.
+        # With exact_rerank a lossy index (scalar-quantized or IVF-PQ) fetches
+        # rerank_factor times the requested hits, which are rescored with the
+        # float32 vectors kept in a memory-mapped file at vectors_path.
+        self.vector_encoding = vector_encoding
+        self.exact_rerank = exact_rerank
+        self.rerank_factor = rerank_factor
+        self.vectors_path = vectors_path or f"{os.path.splitext(index_path)[0]}.vectors"
+        self.vector_file: Optional[VectorFile] = None
+        
+        # Subject-filtered searches score up to this many candidate vectors exactly
+        # with NumPy; larger subsets go through a FAISS IDSelector instead
+        self.exact_filter_max_ids = exact_filter_max_ids
+        
+        # Hits fetched per requested result, since chunks of one note are merged
+        self.chunk_overfetch = chunk_overfetch
+        
+        # BM25 keyword index over note text, snapshotted next to the FAISS index.
+        # Hybrid search fuses the top hybrid_candidates notes of each ranker.
+        self.lexical_index = LexicalIndex(
+            lexical_index_path or os.path.join(os.path.dirname(index_path), "lexical_index.npz")
+        )
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        
+        # New vectors go to an append-only log between full index snapshots; a
+        # snapshot is written in the background once the log holds this many vectors
+        self.log_path = log_path or f"{os.path.splitext(index_path)[0]}.wal"
+        self.compact_after_vectors = compact_after_vectors
+        self.vector_log: Optional[VectorLog] = None
+        self._compaction_thread: Optional[threading.Thread] = None
+        
+        # Searches share the read lock; adds, deletes, checkpoints and index swaps
+        # take the write lock. Starting a snapshot or rebuild is serialized by the
+        # maintenance lock, which is never taken while holding the read/write lock.
+        # Copying the index for a snapshot or rebuild only needs the read lock,
+        # so searches keep running while it is made.
+        self._lock = ReadWriteLock()
+        self._maintenance_lock = threading.Lock()
+        
+        # Index work is run here by async callers so it never blocks the event loop
+        self.executor = ThreadPoolExecutor(max_workers=executor_threads, thread_name_prefix="vector-store")
+        
+        # The index can be split into shards by subject (num_shards shards, so a
+        # subject-filtered search visits one of them) or by ingest time (a new
+        # shard every shard_vectors vectors, so older shards are never rewritten).
+        # Shards are searched in parallel on their own pool, since searches already
+        # run on the store's pool, and only shards changed since the last snapshot
+        # are written again. Readers take the layout from the published manifest.
+        self.shard_layout = ShardLayout(
+            shard_by,
+            num_shards=num_shards if shard_by == "subject" else 1,
+            shard_vectors=shard_vectors if shard_by == "time" else ShardLayout.shard_vectors
+        )
+        self._shard_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="vector-shard")
+        self._dirty_shards = set()
+        self._snapshot_layout = ShardLayout()
+        self._trained_template: Optional[faiss.Index] = None
+        
+        # Vector positions are stable 64-bit ids carried by the index, so deleting
+        # a note never renumbers the others. Flat and IVF indexes drop deleted
+        # vectors right away; HNSW graphs cannot, so deleted positions are kept as
+        # tombstones (filtered out because their metadata is gone) until the index
+        # is rebuilt in the background once they reach this fraction of it
+        self.rebuild_deleted_fraction = rebuild_deleted_fraction
+        self.tombstones = set()
+        self._rebuild_thread: Optional[threading.Thread] = None
+        
+        # Snapshots are published to publish_dir as numbered generations for
+        # read-only workers, which memory-map the latest one so every worker
+        # shares the same page cache. The writer also snapshots at a checkpoint
+        # once publish_interval_seconds have passed with new vectors, so readers
+        # lag the writer by about that much; deletes reach them at once through
+        # the shared metadata store.
+        if read_only and not publish_dir:
+            raise ValueError("A read-only vector store needs the publish_dir of a writer")
+        self.publish_dir = publish_dir
+        self.publish_interval_seconds = publish_interval_seconds
+        self.read_only = read_only
+        self.published_generation = 0
+        self._served_files: List[str] = []
+        self._last_snapshot_time = time.monotonic()
+        self._data_version = None
+        
+        self.index: Optional[ShardedIndex] = None
+        self.metadata_store: Optional[MetadataStore] = None
         self.next_index = 0
         
+        # Bumped on every mutation so callers can invalidate cached search results
+        self.generation = 0
+        
+        if read_only:
+            self.refresh()
+            return
+        
         # Try to load existing index
         self._load_index()
+        if publish_dir:
+            os.makedirs(publish_dir, exist_ok=True)
+            manifest = self._read_manifest()
+            self.published_generation = manifest["generation"] if manifest else 0
+            self._publish_on_start()
+    
+    async def run_in_executor(self, fn, *args, **kwargs):
+        """Run a blocking vector store call on the store's thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+    
+    def close(self):
+        """Wait for queued index work and stop the thread pool"""
+        self.executor.shutdown(wait=True)
+        self._shard_executor.shutdown(wait=True)
+    
+    def _check_writable(self):
+        """Refuse index writes on a store serving a published snapshot"""
+        if self.read_only:
+            raise RuntimeError("This vector store serves a read-only published snapshot")
     
     def _load_index(self):
-        """Load existing FAISS index and metadata"""
+        """Load the latest FAISS snapshot, replay the vector log and open metadata"""
         try:
-            if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
-                # Load FAISS index
-                self.index = faiss.read_index(self.index_path)
-                logger.info(f"Loaded FAISS index with {self.index.ntotal} vectors")
-                
-                # Load metadata
-                with open(self.metadata_path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.metadata = data.get('metadata', {})
-                    self.id_to_index = data.get('id_to_index', {})
-                    self.index_to_id = data.get('index_to_id', {})
-                    self.next_index = data.get('next_index', 0)
-                    self.dimension = data.get('dimension', self.dimension)
-                
-                logger.info(f"Loaded metadata for {len(self.metadata)} records")
-                return True
+            self.metadata_store = MetadataStore(self.metadata_path)
+            
+            # One-time migration from the pickled metadata blob
+            if os.path.exists(self.legacy_metadata_path) and self.metadata_store.count() == 0:
+                self.metadata_store.migrate_from_pickle(self.legacy_metadata_path)
+            
+            self.dimension = int(self.metadata_store.get_meta('dimension', self.dimension))
+            self.vector_log = VectorLog(self.log_path, self.dimension)
+            if self.exact_rerank:
+                self.vector_file = VectorFile(self.vectors_path, self.dimension)
+            
+            # Snapshot files follow the layout recorded with the last snapshot,
+            # which may differ from the configured one
+            layout = ShardLayout.from_tag(self.metadata_store.get_meta('shard_layout'))
+            files = self._snapshot_files(layout)
+            if files:
+                # Load FAISS index shards
+                loaded = {shard: self._with_ids(faiss.read_index(path)) for shard, path in files.items()}
+                count = max(layout.shard_count(0), max(loaded) + 1)
+                # A shard opened after the last snapshot is refilled from the log
+                missing = [shard for shard in range(count) if shard not in loaded]
+                shards = [loaded[shard] if shard in loaded else self._new_shard(list(loaded.values()))
+                          for shard in range(count)]
+                self.index = ShardedIndex(shards, layout, self._shard_executor)
+                self._dirty_shards = set(missing)
+                logger.info(f"Loaded {self.current_index_type()} FAISS index with {self.index.ntotal} vectors"
+                            + (f" in {len(shards)} shards" if layout.shard_by else ""))
+            elif self.vector_log.records_since_snapshot > 0:
+                # Crashed before the first snapshot; rebuild entirely from the log
+                self._initialize_shards(layout)
             else:
                 logger.info("No existing index found, will create new one")
+                self.metadata_store.clear()
                 return False
+            self._snapshot_layout = layout
+            
+            # Re-apply vectors added after the snapshot was taken, up to the last
+            # position whose metadata was committed, skipping ones deleted since.
+            # Shard files are replaced one by one, so after a crash some shards can
+            # trail the others: every logged vector missing from the index is added.
+            committed = self.metadata_store.max_index() + 1
+            deleted = np.asarray(self.metadata_store.deleted_indices(), dtype=np.int64)
+            stored_ids = self.index.stored_ids()
+            self.next_index = int(stored_ids[-1]) + 1 if len(stored_ids) else 0
+            replayed = 0
+            for positions, vectors in self.vector_log.replay(0):
+                keep = positions < committed
+                positions, vectors = positions[keep], vectors[keep]
+                if len(positions) == 0:
+                    break
+                self.next_index = max(self.next_index, int(positions[-1]) + 1)
+                missing = ~np.isin(positions, deleted) & ~np.isin(positions, stored_ids)
+                if missing.any():
+                    self._add_to_index(vectors[missing], positions[missing])
+                    replayed += int(missing.sum())
+            self.vector_log.truncate_from(max(committed, self.next_index))
+            if replayed:
+                logger.info(f"Replayed {replayed} vectors from {self.log_path}")
+            if self.vector_file is not None:
+                self._fill_vector_file(stored_ids[~np.isin(stored_ids, deleted)])
+            
+            # Metadata rows are loaded lazily; drop any committed ahead of the vectors
+            self.metadata_store.truncate(self.next_index)
+            
+            # Deletes made after the snapshot was written
+            pending = deleted[np.isin(deleted, stored_ids)]
+            if len(pending):
+                self._remove_vectors(pending)
+                logger.info(f"Applied {len(pending)} vector deletes made after the last snapshot")
+            self._load_lexical_index(deleted)
+            
+            if layout != self.shard_layout:
+                # Written out in the new layout at the next checkpoint
+                self._reshard(self.shard_layout)
+            
+            logger.info(f"Opened metadata for {self.metadata_store.count()} records")
+            return True
         except Exception as e:
             logger.error(f"Failed to load existing index: {e}")
             self._initialize_new_index()
             return False
     
+    def refresh(self) -> bool:
+        """Swap to the newest published snapshot; True if a new generation was loaded.
+        
+        Called periodically by read-only workers. The snapshot is mapped outside
+        the lock and only the swap takes the write lock. Commits by the writer
+        (new metadata, deletes) also bump the generation so cached search
+        results are dropped.
+        """
+        try:
+            manifest = self._read_manifest()
+            if manifest is None:
+                return False  # Nothing published yet
+            if self.metadata_store is None:
+                self.metadata_store = MetadataStore(self.metadata_path, read_only=True)
+            
+            data_version = self.metadata_store.data_version()
+            if manifest["generation"] == self.published_generation:
+                if data_version != self._data_version:
+                    self._data_version = data_version
+                    self.generation += 1
+                return False
+            
+            index_files = [os.path.join(self.publish_dir, name) for name in manifest["index_files"]]
+            shards = [faiss.read_index(path, SNAPSHOT_MMAP_FLAGS) for path in index_files]
+            index = ShardedIndex(shards, ShardLayout.from_tag(manifest.get("shard_layout")), self._shard_executor)
+            lexical_index = LexicalIndex(os.path.join(self.publish_dir, manifest["lexical_file"]))
+            lexical_index.load()
+            vector_file = None
+            if self.exact_rerank and os.path.exists(self.vectors_path):
+                # The writer's live file, mapped now so it covers this generation's positions
+                vector_file = VectorFile(self.vectors_path, int(manifest["dimension"]), read_only=True)
+            
+            with self._lock.write():
+                self.index = index
+                self.lexical_index = lexical_index
+                self.vector_file = vector_file
+                self._served_files = index_files
+                self.next_index = int(manifest["next_index"])
+                self.dimension = int(manifest["dimension"])
+                self.published_generation = manifest["generation"]
+                self._data_version = data_version
+                self.generation += 1
+            
+            logger.info(f"Serving published index generation {manifest['generation']} with {index.ntotal} vectors")
+            if not SNAPSHOT_MMAP_ALL and self.current_index_type() not in IVF_INDEX_TYPES:
+                logger.warning(f"faiss {faiss.__version__} cannot memory-map {self.current_index_type()} indexes, "
+                               f"so every reader holds its own copy; upgrade to faiss-cpu 1.11 or later")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load published index snapshot: {e}")
+            return False
+    
+    def _read_manifest(self) -> Optional[Dict[str, Any]]:
+        """The latest published generation, or None if nothing has been published"""
+        path = os.path.join(self.publish_dir, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+    
+    def _load_lexical_index(self, deleted: np.ndarray):
+        """Load the lexical snapshot, index any positions added after it and drop deleted ones"""
+        self.lexical_index.load()
+        self.lexical_index.truncate(self.next_index)
+        
+        start = self.lexical_index.num_docs
+        stale = deleted[deleted < start]
+        if len(stale):
+            self.lexical_index.remove(stale)
+        for rows in self.metadata_store.iter_texts(start):
+            self.lexical_index.add_many([idx for idx, _ in rows], [text for _, text in rows])
+        if self.lexical_index.num_docs > start:
+            logger.info(f"Indexed {self.lexical_index.num_docs - start} positions missing from the lexical snapshot")
+    
     def _initialize_new_index(self):
         """Initialize a new FAISS index"""
         try:
-            # Create a new FAISS index (Inner Product for cosine similarity)
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.metadata = {}
-            self.id_to_index = {}
-            self.index_to_id = {}
+            # Create a new FAISS index (Inner Product for cosine similarity).
+            # IVF indexes need training data, so they start flat.
+            self._initialize_shards(self.shard_layout)
+            if self.metadata_store is None:
+                self.metadata_store = MetadataStore(self.metadata_path)
+            self.metadata_store.clear()
+            if self.vector_log is None:
+                self.vector_log = VectorLog(self.log_path, self.dimension)
+            self.vector_log.reset()
+            if self.exact_rerank:
+                if self.vector_file is None:
+                    self.vector_file = VectorFile(self.vectors_path, self.dimension)
+                self.vector_file.reset()
+            self.lexical_index.reset()
+            self.tombstones = set()
             self.next_index = 0
-            logger.info(f"Initialized new FAISS index with dimension {self.dimension}")
+            logger.info(f"Initialized new {self.current_encoding()} {self.current_index_type()} FAISS index with dimension {self.dimension}")
         except Exception as e:
             logger.error(f"Failed to initialize new index: {e}")
             raise
     
+    def _initialize_shards(self, layout: ShardLayout):
+        """Start empty shards of the initial index type and encoding"""
+        index_type = "hnsw" if self.index_type == "hnsw" else "flat"
+        encoding = "fp16" if self.vector_encoding == "fp16" else "float32"
+        shards = [self._train_index(index_type, encoding=encoding) for _ in range(layout.shard_count(0))]
+        self.index = ShardedIndex(shards, layout, self._shard_executor)
+        self._dirty_shards = set(range(len(shards)))
+        self._trained_template = None
+    
+    def _build_index(self,
+                     index_type: str,
+                     vectors: Optional[np.ndarray] = None,
+                     ids: Optional[np.ndarray] = None) -> faiss.Index:
+        """Build an index of the given type, training it on vectors when required.
+        
+        vectors are added under ids (default 0..n-1). Flat and HNSW indexes are
+        wrapped in an IndexIDMap2; IVF indexes store ids in their lists natively.
+        """
+        index = self._train_index(index_type, vectors)
+        if vectors is not None and vectors.shape[0] > 0:
+            if ids is None:
+                ids = np.arange(vectors.shape[0], dtype=np.int64)
+            index.add_with_ids(vectors, ids)
+        return index
+    
+    def _train_index(self, index_type: str, vectors: Optional[np.ndarray] = None, encoding: str = "float32") -> faiss.Index:
+        """Create an empty index of the given type and encoding, trained on vectors for IVF and int8.
+        
+        IVF-PQ stores its own compressed codes and ignores the encoding.
+        """
+        if encoding not in VECTOR_ENCODINGS:
+            raise ValueError(f"Unknown vector encoding '{encoding}', expected one of {VECTOR_ENCODINGS}")
+        
+        if index_type == "flat":
+            if encoding == "float32":
+                index = faiss.IndexFlatIP(self.dimension)
+            else:
+                index = faiss.IndexScalarQuantizer(self.dimension, SQ_TYPES[encoding], faiss.METRIC_INNER_PRODUCT)
+        
+        elif index_type == "hnsw":
+            if encoding == "float32":
+                index = faiss.IndexHNSWFlat(self.dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWSQ(self.dimension, SQ_TYPES[encoding], self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+            index.hnsw.efSearch = self.ef_search
+        
+        elif index_type in IVF_INDEX_TYPES:
+            num_vectors = 0 if vectors is None else vectors.shape[0]
+            nlist = self.nlist or max(1, min(int(4 * math.sqrt(max(num_vectors, 1))), num_vectors // 39))
+            min_train = max(nlist, 2 ** self.pq_nbits if index_type == "ivf_pq" else 1)
+            if num_vectors < min_train:
+                raise ValueError(f"{index_type} index with nlist={nlist} needs at least {min_train} training vectors, got {num_vectors}")
+            
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            if index_type == "ivf_flat" and encoding == "float32":
+                index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            elif index_type == "ivf_flat":
+                index = faiss.IndexIVFScalarQuantizer(quantizer, self.dimension, nlist, SQ_TYPES[encoding],
+                                                      faiss.METRIC_INNER_PRODUCT)
+            else:
+                if self.dimension % self.pq_m != 0:
+                    raise ValueError(f"pq_m={self.pq_m} must divide the vector dimension {self.dimension}")
+                index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, self.pq_m, self.pq_nbits, faiss.METRIC_INNER_PRODUCT)
+            
+            logger.info(f"Training {index_type} index with nlist={nlist} on {num_vectors} vectors")
+            index.train(vectors)
+            index.nprobe = min(self.nprobe, nlist)
+        
+        else:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        
+        if not index.is_trained:
+            # 8-bit scalar quantizers learn each dimension's range
+            if vectors is None or vectors.shape[0] == 0:
+                raise ValueError(f"{encoding} {index_type} index needs training vectors")
+            logger.info(f"Training {encoding} scalar quantizer on {vectors.shape[0]} vectors")
+            index.train(vectors)
+        
+        if isinstance(index, faiss.IndexIVF):
+            # Needed to reconstruct vectors by id for filtered search and conversion
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        else:
+            index = faiss.IndexIDMap2(index)
+        return index
+    
+    def _build_shards(self,
+                      index_type: str,
+                      encoding: str,
+                      ids: np.ndarray,
+                      vectors: np.ndarray,
+                      shard_ids: np.ndarray,
+                      layout: ShardLayout,
+                      num_shards: int) -> ShardedIndex:
+        """Build every shard of a sharded index, training IVF and int8 once on all the vectors.
+        
+        Trained shards are copies of one trained index, so they share their
+        coarse quantizer, codebooks and quantizer ranges and their scores stay
+        comparable. Shards are filled in parallel.
+        """
+        template = self._train_index(index_type, vectors, encoding)
+        
+        def build_shard(shard: int) -> faiss.Index:
+            index = faiss.clone_index(template)
+            rows = np.flatnonzero(shard_ids == shard)
+            if len(rows):
+                index.add_with_ids(vectors[rows], ids[rows])
+            return index
+        
+        shards = list(self._shard_executor.map(build_shard, range(num_shards)))
+        self._trained_template = template if self._needs_training(index_type, encoding) else None
+        return ShardedIndex(shards, layout, self._shard_executor)
+    
+    def _new_shard(self, shards: Optional[List[faiss.Index]] = None) -> faiss.Index:
+        """An empty shard like the given ones (by default the current shards).
+        
+        A new IVF or int8 shard reuses the existing shards' training, taken
+        from an emptied copy of the smallest one the first time it is needed.
+        """
+        shards = shards if shards is not None else self.index.shards
+        index_type = self._index_type_of(shards[0])
+        encoding = self._encoding_of(shards[0])
+        if not self._needs_training(index_type, encoding):
+            return self._train_index(index_type, encoding=encoding)
+        if self._trained_template is None:
+            self._trained_template = faiss.clone_index(min(shards, key=lambda index: index.ntotal))
+            self._trained_template.reset()
+        return faiss.clone_index(self._trained_template)
+    
+    @staticmethod
+    def _needs_training(index_type: str, encoding: str) -> bool:
+        """Whether an index of this type and encoding has to be trained before use"""
+        return index_type in IVF_INDEX_TYPES or encoding == "int8"
+    
+    def _with_ids(self, index: faiss.Index) -> faiss.Index:
+        """Add stable ids to an index read from a snapshot that predates them"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return index
+        if isinstance(index, faiss.IndexIVF):
+            # IVF lists already hold the positions as ids
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return index
+        
+        # Positions were offsets into the index, so they become the ids as they are
+        index_type = "hnsw" if isinstance(index, faiss.IndexHNSW) else "flat"
+        logger.info(f"Adding vector ids to {index_type} snapshot with {index.ntotal} vectors")
+        return self._build_index(index_type, index.reconstruct_n(0, index.ntotal) if index.ntotal else None)
+    
+    @staticmethod
+    def _base_index(index: faiss.Index) -> faiss.Index:
+        """The index doing the search, inside any id mapping"""
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        return index
+    
+    def _index_type_of(self, index: faiss.Index) -> str:
+        """Name of an index's layout"""
+        index = self._base_index(index)
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "ivf_pq"
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf_flat"
+        return "flat"
+    
+    def current_index_type(self) -> str:
+        """Name of the index layout currently in memory (shared by all shards)"""
+        if self.index is None:
+            return self.index_type
+        return self._index_type_of(self.index.shards[0])
+    
+    def _encoding_of(self, index: faiss.Index) -> str:
+        """How an index stores its vectors: one of VECTOR_ENCODINGS, or "pq" for IVF-PQ codes"""
+        index = self._base_index(index)
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "pq"
+        if isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        sq = getattr(index, "sq", None)
+        if sq is None:
+            return "float32"
+        return next(encoding for encoding, qtype in SQ_TYPES.items() if qtype == sq.qtype)
+    
+    def current_encoding(self) -> str:
+        """Vector encoding of the index currently in memory (shared by all shards)"""
+        if self.index is None:
+            return self.vector_encoding
+        return self._encoding_of(self.index.shards[0])
+    
+    def _reranks(self) -> bool:
+        """Whether dense hits are rescored with full-precision vectors (the index is lossy)"""
+        return self.vector_file is not None and self.current_encoding() != "float32"
+    
+    def _live_ids(self, shard: Optional[int] = None) -> np.ndarray:
+        """Positions of the live vectors in one shard or all of them, ascending"""
+        ids = self.index.stored_ids(shard)
+        if self.tombstones:
+            ids = ids[~np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))]
+        return ids
+    
+    def _stored_vectors(self, ids: np.ndarray, shard: Optional[int] = None) -> np.ndarray:
+        """Vectors of the given positions, read exactly from the vector file where one is kept"""
+        if len(ids) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if self.vector_file is not None:
+            return self.vector_file.read(ids)
+        index = self.index if shard is None else self.index.shards[shard]
+        return index.reconstruct_batch(ids)
+    
+    def _reconstruct_all(self):
+        """Read every live vector back, as (positions, vectors) in position order"""
+        ids = self._live_ids()
+        return ids, self._stored_vectors(ids)
+    
+    def _fill_vector_file(self, snapshot_ids: np.ndarray):
+        """Copy vectors stored before the vector file was kept into it, from the index"""
+        covered = int(self.metadata_store.get_meta('exact_vectors', 0))
+        ids = snapshot_ids[snapshot_ids >= covered]
+        if len(ids) == 0:
+            return
+        encoding = self.current_encoding()
+        if encoding != "float32":
+            logger.warning(f"Re-ranking {len(ids)} vectors stored before exact_rerank was enabled "
+                           f"with their {encoding} approximations")
+        self.vector_file.write(ids, self.index.reconstruct_batch(ids))
+        logger.info(f"Copied {len(ids)} vectors into {self.vectors_path}")
+    
+    def _subject_ids(self, positions: np.ndarray) -> List[Optional[int]]:
+        """Subject of the note stored at each position, None where there is none"""
+        rows = self.metadata_store.get_by_indices([int(position) for position in positions], include_text=False)
+        return [rows.get(int(position), {}).get('subject_id') for position in positions]
+    
+    def _add_to_index(self, vectors: np.ndarray, positions: np.ndarray, subject_ids: Optional[List[Optional[int]]] = None):
+        """Add vectors to the shards the layout assigns them to, opening new time shards as needed"""
+        layout = self.index.layout
+        if layout.shard_by == "subject" and subject_ids is None:
+            subject_ids = self._subject_ids(positions)
+        shard_ids = layout.assign(positions, subject_ids)
+        while len(self.index.shards) <= shard_ids.max():
+            self._dirty_shards.add(len(self.index.shards))
+            self.index.add_shard(self._new_shard())
+        self._dirty_shards |= self.index.add_with_ids(vectors, positions, shard_ids)
+        if self.vector_file is not None:
+            self.vector_file.write(positions, vectors)
+    
+    def _remove_vectors(self, positions: np.ndarray):
+        """Take deleted vectors out of the index, or tombstone them where it cannot delete"""
+        if self.current_index_type() == "hnsw":
+            self.tombstones.update(int(position) for position in positions)
+            return
+        self._dirty_shards |= self.index.remove_ids(positions)
+    
+    def convert_index(self, index_type: Optional[str] = None, encoding: Optional[str] = None):
+        """Rebuild the index as another type or encoding from the stored vectors, without re-embedding.
+        
+        Vectors keep their positions and shards, so the metadata rows stay valid,
+        and tombstoned vectors are left out. Converting from IVF-PQ or a scalar
+        quantized index is lossy, because they only store approximate vectors,
+        unless exact_rerank keeps the full-precision ones.
+        """
+        self._check_writable()
+        index_type = index_type or self.index_type
+        encoding = encoding or self.vector_encoding
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        if encoding not in VECTOR_ENCODINGS:
+            raise ValueError(f"Unknown vector encoding '{encoding}', expected one of {VECTOR_ENCODINGS}")
+        if not self.is_initialized():
+            self._initialize_new_index()
+        
+        with self._lock.write():
+            previous = f"{self.current_encoding()} {self.current_index_type()}"
+            ids, vectors = self._reconstruct_all()
+            self.index = self._build_shards(index_type, encoding, ids, vectors, self.index.locate(ids),
+                                            self.index.layout, len(self.index.shards))
+            self._dirty_shards = set(range(len(self.index.shards)))
+            self.tombstones = set()
+            self.index_type = index_type
+            self.vector_encoding = encoding
+            self.generation += 1
+        logger.info(f"Converted {previous} index with {vectors.shape[0]} vectors to {self.current_encoding()} {index_type}")
+    
+    def _reshard(self, layout: ShardLayout):
+        """Redistribute the stored vectors into another shard layout, without re-embedding"""
+        with self._lock.write():
+            index_type = self.current_index_type()
+            encoding = self.current_encoding()
+            ids, vectors = self._reconstruct_all()
+            subject_ids = self._subject_ids(ids) if layout.shard_by == "subject" else None
+            self.index = self._build_shards(index_type, encoding, ids, vectors, layout.assign(ids, subject_ids),
+                                            layout, layout.shard_count(self.next_index))
+            self._dirty_shards = set(range(len(self.index.shards)))
+            self.tombstones = set()
+            self.generation += 1
+        logger.info(f"Resharded {vectors.shape[0]} vectors into {len(self.index.shards)} shards by {layout.shard_by or 'nothing'}")
+    
+    def _maybe_upgrade_index(self):
+        """Train and switch to the configured IVF index or int8 encoding once enough vectors exist"""
+        if self.index.ntotal < self.ann_min_vectors:
+            return
+        index_type = self.current_index_type()
+        if ((self.index_type in IVF_INDEX_TYPES and index_type == "flat")
+                or (self.vector_encoding == "int8" and self.current_encoding() == "float32")):
+            self.convert_index(self.index_type, self.vector_encoding)
+    
     def is_initialized(self) -> bool:
         """Check if the vector store is initialized"""
         return self.index is not None
     
     def add_vector(self, vector_id: str, embedding: List[float], metadata: Dict[str, Any]):
         """Add a vector to the store"""
+        self.add_vectors([vector_id], np.asarray(embedding, dtype=np.float32).reshape(1, -1), [metadata])
+    
+    def add_vectors(self, vector_ids: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]]) -> int:
+        """Add a batch of vectors with one normalize, one index add and one metadata write.
+        
+        Ids already in the store, or repeated within the batch, are skipped.
+        Returns the number of vectors added.
+        """
+        self._check_writable()
         try:
-            if not self.is_initialized():
-                self._initialize_new_index()
+            if len(vector_ids) != len(metadatas) or len(vector_ids) != len(embeddings):
+                raise ValueError(f"Got {len(vector_ids)} ids, {len(embeddings)} embeddings and {len(metadatas)} metadata entries")
+            if not vector_ids:
+                return 0
+            
+            with self._lock.write():
+                if not self.is_initialized():
+                    self._initialize_new_index()
+                
+                # Convert embeddings to a contiguous float32 matrix
+                vectors = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(vector_ids), -1)
+                
+                # Drop ids already stored, repeats within the batch, and chunks of
+                # source notes that were stored by an earlier call
+                parent_ids = [metadata.get('parent_id') or vector_id for vector_id, metadata in zip(vector_ids, metadatas)]
+                existing = self.metadata_store.existing_note_ids(list(vector_ids))
+                existing_parents = self.metadata_store.existing_parent_ids(list(set(parent_ids)))
+                keep = []
+                seen = set()
+                for row, vector_id in enumerate(vector_ids):
+                    if vector_id in existing or vector_id in seen or parent_ids[row] in existing_parents:
+                        continue
+                    seen.add(vector_id)
+                    keep.append(row)
+                
+                skipped = len(vector_ids) - len(keep)
+                if skipped:
+                    logger.warning(f"Skipping {skipped} vectors that already exist")
+                if not keep:
+                    return 0
+                
+                if len(keep) < len(vector_ids):
+                    vectors = vectors[keep]
+                else:
+                    vectors = vectors.copy()
+                
+                # Normalize vectors for cosine similarity with inner product
+                faiss.normalize_L2(vectors)
+                
+                # Add to FAISS index and the append-only log
+                positions = np.arange(self.next_index, self.next_index + len(keep), dtype=np.int64)
+                self._add_to_index(vectors, positions, [metadatas[row].get('subject_id') for row in keep])
+                self.vector_log.append(positions, vectors)
+                
+                # Store metadata keyed by each vector's position in the index
+                self.metadata_store.add_many(
+                    (int(position), vector_ids[row], {**metadatas[row], 'parent_id': parent_ids[row]})
+                    for position, row in zip(positions, keep)
+                )
+                self.lexical_index.add_many(positions, (metadatas[row].get('cleaned_text') for row in keep))
+                self.next_index += len(keep)
+                self.generation += 1
+                
+                self._maybe_upgrade_index()
+            
+            logger.debug(f"Added {len(keep)} vectors at positions {positions[0]}-{positions[-1]}")
+            return len(keep)
+            
+        except Exception as e:
+            logger.error(f"Failed to add {len(vector_ids)} vectors: {e}")
+            raise
+    
+    def upsert_vectors(self, vector_ids: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]]) -> int:
+        """Replace the stored vectors of each source note in the batch with the given ones.
+        
+        The old chunks are deleted and the new ones added in the same metadata
+        transaction, so a crash before the next checkpoint leaves the old version.
+        Near-duplicates linked to these notes stay linked. Returns the number of
+        vectors added.
+        """
+        self._check_writable()
+        with self._lock.write():
+            parent_ids = list(dict.fromkeys(
+                metadata.get('parent_id') or vector_id for vector_id, metadata in zip(vector_ids, metadatas)
+            ))
+            self.delete_notes(parent_ids, keep_duplicate_links=True)
+            return self.add_vectors(vector_ids, embeddings, metadatas)
+    
+    def delete_notes(self, parent_ids: List[str], keep_duplicate_links: bool = False) -> Dict[str, int]:
+        """Delete source notes with all their chunks, and near-duplicates linked to them.
+        
+        Costs time proportional to the deleted vectors (plus a copy of the flat
+        index's storage); nothing is re-embedded. An HNSW index whose tombstones
+        have piled up is rebuilt at the next checkpoint. Returns how many notes
+        and vectors were removed.
+        """
+        self._check_writable()
+        try:
+            if not parent_ids or not self.is_initialized():
+                return {"notes": 0, "vectors": 0}
             
-            # Convert embedding to numpy array and normalize for cosine similarity
-            vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+            with self._lock.write():
+                found = self.metadata_store.existing_parent_ids(list(parent_ids))
+                rows = self.metadata_store.delete_notes(list(parent_ids), keep_duplicate_links)
+                if rows:
+                    positions = np.array([idx for idx, _ in rows], dtype=np.int64)
+                    self._remove_vectors(positions)
+                    self.lexical_index.remove(positions, [text for _, text in rows])
+                if found:
+                    self.generation += 1
             
-            # Normalize vector for cosine similarity with IndexFlatIP
-            faiss.normalize_L2(vector)
+            if rows:
+                logger.info(f"Deleted {len(found)} notes ({len(rows)} vectors)")
+            return {"notes": len(found), "vectors": len(rows)}
             
-            # Check if this vector_id already exists
-            if vector_id in self.id_to_index:
-                logger.warning(f"Vector {vector_id} already exists, skipping")
+        except Exception as e:
+            logger.error(f"Failed to delete {len(parent_ids)} notes: {e}")
+            raise
+    
+    def delete_subject(self, subject_id: int) -> Dict[str, int]:
+        """Delete every note of a subject"""
+        return self.delete_notes(self.metadata_store.parent_ids_for_subject(subject_id))
+    
+    def link_duplicates(self, rows: List[tuple]):
+        """Link (note_id, canonical_id, subject_id, similarity) for notes skipped as near-duplicates"""
+        self._check_writable()
+        with self._lock.write():
+            self.metadata_store.add_duplicates(rows)
+            # Results list the duplicates of each note
+            self.generation += 1
+    
+    def store_signatures(self, rows: List[tuple]):
+        """Keep (note_id, subject_id, signature, band buckets) of stored notes for near-duplicate matching"""
+        self._check_writable()
+        with self._lock.write():
+            self.metadata_store.add_signatures(rows)
+    
+    def rebuild_index(self, background: bool = True, shard: Optional[int] = None):
+        """Rebuild shards from their live vectors to drop tombstones, without re-embedding.
+        
+        Only the shards holding tombstones are rebuilt, or the given shard. Each
+        is built outside the lock from a copy of its live vectors; vectors added
+        to it meanwhile are copied over before it is swapped in, and a snapshot
+        of the rebuilt shards is written afterwards.
+        """
+        self._check_writable()
+        thread = self._rebuild_thread
+        if thread is not None and thread.is_alive():
+            if background:
+                return
+            # Outside the locks, which the running rebuild needs to finish
+            thread.join()
+        
+        with self._maintenance_lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
                 return
+            with self._lock.read():
+                if not self.is_initialized():
+                    return
+                tombstones = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+                if shard is None:
+                    shards = self.index.shards_holding(tombstones)
+                elif 0 <= shard < len(self.index.shards):
+                    shards = [shard]
+                else:
+                    raise ValueError(f"Shard {shard} does not exist, the index has {len(self.index.shards)} shards")
+                if not shards:
+                    return
+                
+                work = []
+                for rebuilt in shards:
+                    ids = self._live_ids(rebuilt)
+                    vectors = self._stored_vectors(ids, rebuilt)
+                    work.append((rebuilt, ids, vectors, self._new_shard()))
+                dropped = set(tombstones[np.isin(self.index.locate(tombstones), shards)].tolist())
+                index = self.index
+                next_index = self.next_index
             
-            # Add to FAISS index
-            self.index.add(vector)
+            args = (index, work, dropped, next_index)
+            if background:
+                self._rebuild_thread = threading.Thread(target=self._rebuild, args=args, name="index-rebuild", daemon=True)
+                self._rebuild_thread.start()
+                return
+        self._rebuild(*args)
+    
+    def _rebuild(self, index: ShardedIndex, work: List[tuple], dropped: set, next_index: int):
+        """Fill the replacement shards and swap them in"""
+        try:
+            start_time = time.perf_counter()
             
-            # Store mappings
-            current_index = self.next_index
-            self.id_to_index[vector_id] = current_index
-            self.index_to_id[current_index] = vector_id
-            self.metadata[vector_id] = metadata
-            self.next_index += 1
+            def fill_shard(item):
+                _, ids, vectors, new_index = item
+                if len(ids):
+                    new_index.add_with_ids(vectors, ids)
             
-            logger.debug(f"Added vector {vector_id} at index {current_index}")
+            list(self._shard_executor.map(fill_shard, work))
             
+            with self._lock.write():
+                if self.index is not index:
+                    logger.warning("Index was converted or cleared during the rebuild, discarding it")
+                    return
+                
+                for shard, ids, _, new_index in work:
+                    # Catch up with vectors added to the shard while it was rebuilt,
+                    # and with deletes that flat and IVF shards applied in place
+                    stored = self.index.stored_ids(shard)
+                    added = stored[stored >= next_index]
+                    if len(added):
+                        new_index.add_with_ids(self._stored_vectors(added, shard), added)
+                    removed = ids[~np.isin(ids, stored)]
+                    if len(removed):
+                        new_index.remove_ids(faiss.IDSelectorArray(len(removed), faiss.swig_ptr(removed)))
+                    self.index.replace_shard(shard, new_index)
+                    self._dirty_shards.add(shard)
+                self.tombstones -= dropped
+                self.generation += 1
+            
+            index_type = self.current_index_type()
+            logger.info(f"Rebuilt {len(work)} of {len(self.index.shards)} {index_type} shards without "
+                        f"{len(dropped)} deleted vectors in {time.perf_counter() - start_time:.2f}s")
+            self.compact(background=False)
         except Exception as e:
-            logger.error(f"Failed to add vector {vector_id}: {e}")
-            raise
+            logger.error(f"Failed to rebuild index: {e}")
     
     def search(self, 
               query_embedding: List[float], 
               top_k: int = 5,
-              subject_id_filter: Optional[int] = None) -> List[VectorSearchResult]:
+              subject_id_filter: Optional[int] = None,
+              nprobe: Optional[int] = None,
+              ef_search: Optional[int] = None) -> List[VectorSearchResult]:
         """Search for similar vectors"""
         try:
-            if not self.is_initialized() or self.index.ntotal == 0:
-                logger.warning("No vectors in store")
-                return []
-            
-            # Convert query to numpy array and normalize
-            query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-            faiss.normalize_L2(query_vector)
-            
-            # Perform search
-            search_k = min(top_k * 3, self.index.ntotal)  # Search more to allow for filtering
-            similarities, indices = self.index.search(query_vector, search_k)
+            with self._lock.read():
+                if not self.is_initialized() or self.index.ntotal == 0:
+                    logger.warning("No vectors in store")
+                    return []
+                
+                candidate_ids, candidate_count = self._candidates(subject_id_filter)
+                if candidate_count == 0:
+                    return []
+                
+                results = self._build_results(
+                    self._dense_hits(query_embedding, top_k, candidate_ids, candidate_count, nprobe, ef_search)[:top_k]
+                )
+                
+                logger.info(f"Found {len(results)} similar vectors")
+                return results
             
-            results = []
-            for similarity, idx in zip(similarities[0], indices[0]):
-                if idx == -1:  # Invalid index
-                    continue
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            raise
+    
+    def lexical_search(self,
+                       query: str,
+                       top_k: int = 5,
+                       subject_id_filter: Optional[int] = None) -> List[VectorSearchResult]:
+        """BM25 keyword search over note text, without embedding the query"""
+        try:
+            with self._lock.read():
+                if not self.is_initialized() or self.index.ntotal == 0:
+                    logger.warning("No vectors in store")
+                    return []
                 
-                vector_id = self.index_to_id.get(idx)
-                if not vector_id or vector_id not in self.metadata:
-                    continue
+                candidate_ids, candidate_count = self._candidates(subject_id_filter)
+                if candidate_count == 0:
+                    return []
                 
-                metadata = self.metadata[vector_id]
+                results = self._build_results(self._lexical_hits(query, top_k, candidate_ids, candidate_count)[:top_k])
                 
-                # Apply subject_id filter if specified
-                if subject_id_filter is not None:
-                    if metadata.get('subject_id') != subject_id_filter:
-                        continue
+                logger.info(f"Found {len(results)} lexical matches")
+                return results
+            
+        except Exception as e:
+            logger.error(f"Lexical search failed: {e}")
+            raise
+    
+    def hybrid_search(self,
+                      query: str,
+                      query_embedding: List[float],
+                      top_k: int = 5,
+                      subject_id_filter: Optional[int] = None,
+                      nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None) -> List[VectorSearchResult]:
+        """Dense and BM25 search fused with reciprocal-rank fusion.
+        
+        Each ranker contributes 1 / (rrf_k + rank) per note, so a note ranked well
+        by both wins over one ranked first by only one of them. The fused score is
+        returned as similarity_score.
+        """
+        try:
+            with self._lock.read():
+                if not self.is_initialized() or self.index.ntotal == 0:
+                    logger.warning("No vectors in store")
+                    return []
                 
-                # Create result object
-                result = VectorSearchResult(
-                    note_id=metadata['note_id'],
-                    subject_id=metadata['subject_id'],
-                    hadm_id=metadata['hadm_id'],
-                    charttime=metadata['charttime'],
-                    cleaned_text=metadata['cleaned_text'],
-                    similarity_score=float(similarity)
+                candidate_ids, candidate_count = self._candidates(subject_id_filter)
+                if candidate_count == 0:
+                    return []
+                
+                depth = max(top_k, self.hybrid_candidates)
+                ranked_lists = (
+                    self._dense_hits(query_embedding, depth, candidate_ids, candidate_count, nprobe, ef_search)[:depth],
+                    self._lexical_hits(query, depth, candidate_ids, candidate_count)[:depth]
                 )
                 
-                results.append(result)
+                best_hits = self._fuse_hits(ranked_lists)
+                results = self._build_results(best_hits[:top_k])
                 
-                if len(results) >= top_k:
-                    break
+                logger.info(f"Found {len(results)} hybrid matches")
+                return results
             
-            logger.info(f"Found {len(results)} similar vectors")
-            return results
+        except Exception as e:
+            logger.error(f"Hybrid search failed: {e}")
+            raise
+    
+    def search_batch(self,
+                     query_embeddings: np.ndarray,
+                     top_ks: List[int],
+                     subject_id_filters: Optional[List[Optional[int]]] = None,
+                     nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None,
+                     lexical_queries: Optional[List[Optional[str]]] = None) -> List[List[VectorSearchResult]]:
+        """Search many queries at once, returning one result list per query in order.
+        
+        Unfiltered queries share a single FAISS search over the whole query matrix
+        (one matrix-matrix product instead of a matrix-vector product per query).
+        Subject-filtered queries, and queries whose shared search did not yield
+        enough distinct notes, are searched individually. Where lexical_queries[i]
+        is set, query i is fused with BM25 results as in hybrid_search.
+        """
+        try:
+            with self._lock.read():
+                num_queries = len(top_ks)
+                if not self.is_initialized() or self.index.ntotal == 0:
+                    logger.warning("No vectors in store")
+                    return [[] for _ in range(num_queries)]
+                
+                subject_id_filters = subject_id_filters or [None] * num_queries
+                lexical_queries = lexical_queries or [None] * num_queries
+                depths = [max(top_k, self.hybrid_candidates) if lexical_queries[i] else top_k
+                          for i, top_k in enumerate(top_ks)]
+                
+                # Convert queries to a numpy matrix and normalize
+                query_vectors = np.ascontiguousarray(query_embeddings, dtype=np.float32).reshape(num_queries, -1).copy()
+                faiss.normalize_L2(query_vectors)
+                
+                dense_hits: List[Optional[List[Dict[str, Any]]]] = [None] * num_queries
+                shared = [i for i in range(num_queries) if subject_id_filters[i] is None and depths[i] > 0]
+                if shared:
+                    k = min(max(depths[i] for i in shared) * self.chunk_overfetch, self.index.ntotal)
+                    rerank = self._reranks()
+                    fetch_k = min(k * self.rerank_factor, self.index.ntotal) if rerank else k
+                    params = self._search_params(fetch_k, nprobe, ef_search)
+                    with INDEX_SEARCH_SECONDS.time(kind="batch"):
+                        similarities, indices = self.index.search(query_vectors[shared], fetch_k, params=params)
+                    if rerank:
+                        similarities, indices = self._rerank(query_vectors[shared], similarities, indices, k)
+                
+                    # One metadata lookup for the hits of every query
+                    hit_metadata = self.metadata_store.get_by_indices(
+                        [int(idx) for idx in np.unique(indices) if idx != -1], include_text=False
+                    )
+                    for row, i in enumerate(shared):
+                        best_hits = self._best_hit_per_note(similarities[row], indices[row], hit_metadata)
+                        if len(best_hits) >= depths[i] or k >= self.index.ntotal:
+                            dense_hits[i] = best_hits
+                
+                results = []
+                for i in range(num_queries):
+                    candidate_ids, candidate_count = self._candidates(subject_id_filters[i])
+                    if candidate_count == 0 or top_ks[i] <= 0:
+                        results.append([])
+                        continue
+                
+                    hits = dense_hits[i]
+                    if hits is None:
+                        hits = self._collect_note_hits(
+                            lambda k: self._search_vectors(query_vectors[i:i + 1], k, candidate_ids, nprobe, ef_search),
+                            depths[i], candidate_count
+                        )
+                    if lexical_queries[i]:
+                        hits = self._fuse_hits((
+                            hits[:depths[i]],
+                            self._lexical_hits(lexical_queries[i], depths[i], candidate_ids, candidate_count)[:depths[i]]
+                        ))
+                    results.append(self._build_results(hits[:top_ks[i]]))
+                
+                logger.info(f"Searched {num_queries} queries in one batch")
+                return results
             
         except Exception as e:
-            logger.error(f"Search failed: {e}")
+            logger.error(f"Batch search failed: {e}")
             raise
     
-    def save_index(self):
-        """Save the FAISS index and metadata to disk"""
+    def _fuse_hits(self, ranked_lists) -> List[Dict[str, Any]]:
+        """Reciprocal-rank fusion of note-level hit lists, best first"""
+        fused: Dict[str, Dict[str, Any]] = {}
+        for hits in ranked_lists:
+            for rank, hit in enumerate(hits, start=1):
+                parent_id = hit['metadata']['parent_id']
+                if parent_id not in fused:
+                    # Keep the first ranker's best chunk (dense) as the matched chunk
+                    fused[parent_id] = {**hit, "similarity": 0.0}
+                fused[parent_id]["similarity"] += 1.0 / (self.rrf_k + rank)
+        return sorted(fused.values(), key=lambda hit: hit["similarity"], reverse=True)
+    
+    def _candidates(self, subject_id_filter: Optional[int]):
+        """Vector positions to search (None for all) and how many there are"""
+        if subject_id_filter is None:
+            return None, self.index.ntotal
+        candidate_ids = self.metadata_store.indices_for_subject(subject_id_filter)
+        if self.read_only:
+            # Notes the writer stored after the served snapshot have no vectors in it yet
+            candidate_ids = [idx for idx in candidate_ids if idx < self.next_index]
+        SUBJECT_FILTER_EXCLUDED.inc(self.index.ntotal - len(candidate_ids))
+        return candidate_ids, len(candidate_ids)
+    
+    def _collect_note_hits(self, search_fn, top_k: int, candidate_count: int) -> List[Dict[str, Any]]:
+        """Best hit per note for at least top_k notes where available.
+        
+        Chunks of one note can take several of the top hits, so extra hits are
+        fetched and the search is widened until top_k distinct notes are found.
+        """
+        fetch_k = min(top_k * self.chunk_overfetch, candidate_count)
+        while True:
+            similarities, indices = search_fn(fetch_k)
+            best_hits = self._best_hit_per_note(similarities, indices)
+            if len(best_hits) >= top_k or fetch_k >= candidate_count or len(indices) < fetch_k:
+                return best_hits
+            fetch_k = min(fetch_k * 2, candidate_count)
+    
+    def _dense_hits(self,
+                    query_embedding: List[float],
+                    top_k: int,
+                    candidate_ids: Optional[List[int]],
+                    candidate_count: int,
+                    nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Note-level hits from the FAISS index"""
+        # Convert query to numpy array and normalize
+        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query_vector)
+        
+        return self._collect_note_hits(
+            lambda k: self._search_vectors(query_vector, k, candidate_ids, nprobe, ef_search),
+            top_k, candidate_count
+        )
+    
+    def _lexical_hits(self,
+                      query: str,
+                      top_k: int,
+                      candidate_ids: Optional[List[int]],
+                      candidate_count: int) -> List[Dict[str, Any]]:
+        """Note-level hits from the BM25 index"""
+        def search_fn(k: int):
+            with INDEX_SEARCH_SECONDS.time(kind="lexical"):
+                return self.lexical_index.search(query, k, candidate_ids)
+        
+        return self._collect_note_hits(search_fn, top_k, candidate_count)
+    
+    def _search_vectors(self,
+                        query_vector: np.ndarray,
+                        k: int,
+                        candidate_ids: Optional[List[int]] = None,
+                        nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None):
+        """Raw top-k vector search, returning (similarities, indices) for one query"""
+        if candidate_ids is not None:
+            with INDEX_SEARCH_SECONDS.time(kind="subset"):
+                return self._search_subset(query_vector, candidate_ids, k, nprobe, ef_search)
+        
+        rerank = self._reranks()
+        fetch_k = min(k * self.rerank_factor, self.index.ntotal) if rerank else k
+        params = self._search_params(fetch_k, nprobe, ef_search)
+        with INDEX_SEARCH_SECONDS.time(kind="dense"):
+            similarities, indices = self.index.search(query_vector, fetch_k, params=params)
+        if rerank:
+            similarities, indices = self._rerank(query_vector, similarities, indices, k)
+        return similarities[0], indices[0]
+    
+    def _rerank(self, query_vectors: np.ndarray, similarities: np.ndarray, indices: np.ndarray, k: int):
+        """Rescore approximate hits with their full-precision vectors, keeping the best k per query"""
+        with INDEX_SEARCH_SECONDS.time(kind="rerank"):
+            valid = indices >= 0
+            candidates = np.unique(indices[valid])
+            if len(candidates) == 0:
+                return similarities[:, :k], indices[:, :k]
+            
+            # One read and one matrix product for the candidates of every query
+            scores = self.vector_file.read(candidates) @ query_vectors.T
+            rows = np.searchsorted(candidates, np.where(valid, indices, candidates[0]))
+            similarities = np.where(valid, scores[rows, np.arange(len(query_vectors))[:, None]], -np.inf)
+            order = np.argsort(-similarities, axis=1, kind="stable")[:, :k]
+            return (np.take_along_axis(similarities, order, axis=1).astype(np.float32),
+                    np.take_along_axis(indices, order, axis=1))
+    
+    def _best_hit_per_note(self,
+                           similarities: np.ndarray,
+                           indices: np.ndarray,
+                           hit_metadata: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Collapse chunk hits to the best-scoring hit per source note, best first"""
+        if hit_metadata is None:
+            hit_metadata = self.metadata_store.get_by_indices(
+                [int(idx) for idx in indices if idx != -1], include_text=False
+            )
+        
+        best_hits = []
+        seen = set()
+        merged = 0
+        for similarity, idx in zip(similarities, indices):
+            if idx == -1:  # Invalid index
+                continue
+            
+            metadata = hit_metadata.get(int(idx))
+            if not metadata:
+                continue
+            if metadata['parent_id'] in seen:
+                merged += 1
+                continue
+            
+            seen.add(metadata['parent_id'])
+            best_hits.append({"index": int(idx), "similarity": float(similarity), "metadata": metadata})
+        if merged:
+            SEARCH_HITS_MERGED.inc(merged)
+        return best_hits
+    
+    def _build_results(self, hits: List[Dict[str, Any]]) -> List[VectorSearchResult]:
+        """Create note-level results, loading note text only for these hits"""
+        if not hits:
+            return []
+        
+        parent_ids = [hit['metadata']['parent_id'] for hit in hits]
+        note_texts = self.metadata_store.get_note_texts(parent_ids)
+        chunk_rows = self.metadata_store.get_by_indices([hit['index'] for hit in hits])
+        duplicates = self.metadata_store.get_duplicates(parent_ids)
+        
+        results = []
+        for hit in hits:
+            metadata = hit['metadata']
+            full_text = note_texts.get(metadata['parent_id'], "")
+            chunk_text = chunk_rows.get(hit['index'], {}).get('cleaned_text')
+            
+            # Create result object
+            results.append(VectorSearchResult(
+                note_id=metadata['parent_id'],
+                subject_id=metadata['subject_id'],
+                hadm_id=metadata['hadm_id'],
+                charttime=metadata['charttime'],
+                cleaned_text=full_text,
+                similarity_score=hit['similarity'],
+                matched_text=chunk_text if chunk_text and chunk_text != full_text else None,
+                duplicate_note_ids=duplicates.get(metadata['parent_id'], [])
+            ))
+        return results
+    
+    def _search_subset(self,
+                       query_vector: np.ndarray,
+                       candidate_ids: List[int],
+                       top_k: int,
+                       nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None):
+        """Search only the given vector positions, returning (similarities, indices)"""
+        if not candidate_ids:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        
+        ids = np.asarray(candidate_ids, dtype=np.int64)
+        k = min(top_k, len(ids))
+        
+        rerank = self._reranks()
+        if len(ids) <= self.exact_filter_max_ids:
+            # Exact scoring over the small block of candidate vectors
+            vectors = self.vector_file.read(ids) if rerank else self.index.reconstruct_batch(ids)
+            scores = vectors @ query_vector[0]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return scores[top], ids[top]
+        
+        # Only the shards holding candidates are searched; with subject shards that is one
+        fetch_k = min(k * self.rerank_factor, len(ids)) if rerank else k
+        params = self._search_params(fetch_k, nprobe, ef_search, selector=faiss.IDSelectorBatch(ids))
+        similarities, indices = self.index.search(query_vector, fetch_k, params=params, shards=self.index.shards_holding(ids))
+        if rerank:
+            similarities, indices = self._rerank(query_vector, similarities, indices, k)
+        return similarities[0], indices[0]
+    
+    def _search_params(self, k: int, nprobe: Optional[int], ef_search: Optional[int], selector=None):
+        """Per-query FAISS search parameters for the current index type, valid for every shard"""
+        index_type = self.current_index_type()
+        base_index = self._base_index(self.index.shards[0])
+        if index_type in IVF_INDEX_TYPES and (nprobe or selector is not None):
+            params = faiss.SearchParametersIVF(nprobe=nprobe or base_index.nprobe)
+        elif index_type == "hnsw" and (ef_search or selector is not None):
+            # efSearch below k would truncate the result list
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search or base_index.hnsw.efSearch, k))
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        
+        if selector is not None:
+            params.sel = selector
+        return params
+    
+    def save_index(self, snapshot: bool = False):
+        """Persist vectors and metadata added since the last checkpoint.
+        
+        A checkpoint commits the metadata and fsyncs the vector log, so it costs
+        time proportional to the new data only. A full index snapshot is written
+        when requested, and otherwise in the background once the log grows past
+        compact_after_vectors or, when publishing, once new vectors are older
+        than publish_interval_seconds.
+        """
+        if self.read_only:
+            return  # Snapshots are published by the writer
+        
         try:
             if not self.is_initialized():
                 logger.warning("No index to save")
                 return
             
-            # Save FAISS index
-            faiss.write_index(self.index, self.index_path)
-            
-            # Save metadata
-            data = {
-                'metadata': self.metadata,
-                'id_to_index': self.id_to_index,
-                'index_to_id': self.index_to_id,
-                'next_index': self.next_index,
-                'dimension': self.dimension
-            }
+            start_time = time.perf_counter()
+            with self._lock.write():
+                # Commit metadata first; rows beyond the durable vectors are dropped on load
+                self.metadata_store.set_meta('next_index', self.next_index)
+                self.metadata_store.set_meta('dimension', self.dimension)
+                self.metadata_store.set_meta('index_type', self.current_index_type())
+                if self.vector_file is not None:
+                    # Full-precision rows are on disk before the checkpoint that covers them
+                    self.vector_file.flush()
+                    self.metadata_store.set_meta('exact_vectors', self.next_index)
+                self.metadata_store.commit()
+                
+                synced = self.vector_log.sync()
+                publish_due = (self.publish_dir is not None
+                               and self.vector_log.records_since_snapshot > 0
+                               and time.monotonic() - self._last_snapshot_time >= self.publish_interval_seconds)
+                needs_snapshot = (snapshot
+                                  or publish_due
+                                  or not self._snapshot_complete()
+                                  or self.vector_log.records_since_snapshot >= self.compact_after_vectors)
+                needs_rebuild = len(self.tombstones) > self.rebuild_deleted_fraction * max(self.index.ntotal, 1)
             
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(data, f)
+            SAVE_INDEX_SECONDS.observe(time.perf_counter() - start_time, kind="checkpoint")
+            BYTES_WRITTEN.inc(synced * self.vector_log.record_dtype.itemsize, kind="vector_log")
+            logger.info(f"Checkpointed {synced} new vectors ({self.index.ntotal} total)")
             
-            logger.info(f"Saved index with {self.index.ntotal} vectors")
+            if needs_rebuild:
+                # Writes a snapshot once the rebuilt index is swapped in
+                self.rebuild_index(background=not snapshot)
+            elif needs_snapshot:
+                self.compact(background=not snapshot)
             
         except Exception as e:
             logger.error(f"Failed to save index: {e}")
             raise
     
+    def compact(self, background: bool = True):
+        """Write a full index snapshot and drop the log records it covers"""
+        self._check_writable()
+        if not background:
+            # Outside the locks, which the running snapshot needs to finish
+            self._join_compaction()
+        
+        with self._maintenance_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            
+            # Freeze a copy of the shards changed since the last snapshot and move
+            # the log aside while writers are held off, so vectors added while the
+            # snapshot is written land in the fresh log
+            with self._lock.read():
+                self.vector_log.rotate()
+                shard_copies = {shard: faiss.clone_index(self.index.shards[shard]) for shard in self._dirty_shards}
+                self._dirty_shards = set()
+                lexical_copy = self.lexical_index.snapshot()
+                # Deleted vectors already out of the index need no tracking once this snapshot is on disk
+                forgettable = [idx for idx in self.metadata_store.deleted_indices() if idx not in self.tombstones]
+                layout = self.index.layout
+                num_shards = len(self.index.shards)
+                next_index = self.next_index
+            
+            args = (shard_copies, layout, num_shards, lexical_copy, forgettable, next_index)
+            if background:
+                self._compaction_thread = threading.Thread(
+                    target=self._write_snapshot, args=args, name="index-compaction", daemon=True
+                )
+                self._compaction_thread.start()
+                return
+        self._write_snapshot(*args)
+    
+    def _join_compaction(self):
+        thread = self._compaction_thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
+    
+    def _write_snapshot(self,
+                        shard_copies: Dict[int, faiss.Index],
+                        layout: ShardLayout,
+                        num_shards: int,
+                        lexical_snapshot: Dict[str, np.ndarray],
+                        forgettable: List[int],
+                        next_index: int):
+        """Atomically replace the on-disk files of the changed shards and publish the snapshot"""
+        try:
+            start_time = time.perf_counter()
+            # The lexical index catches up from metadata on load, so it is not
+            # tied to the vector log and can be written first
+            self.lexical_index.write_snapshot(lexical_snapshot)
+            
+            written = 0
+            for shard, index in shard_copies.items():
+                path = self._shard_path(layout, shard)
+                tmp_path = f"{path}.tmp"
+                faiss.write_index(index, tmp_path)
+                with open(tmp_path, 'rb') as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                written += os.path.getsize(path)
+            
+            with self._lock.write():
+                self.vector_log.discard_rotated()
+                # The layout is recorded once all of its files are on disk; until
+                # then a restart loads the previous layout's files
+                previous_layout = self._snapshot_layout
+                if layout != previous_layout:
+                    self.metadata_store.set_meta('shard_layout', layout.tag or "")
+                    self._snapshot_layout = layout
+                self.metadata_store.forget_deleted(forgettable)
+            if layout != previous_layout:
+                current = {self._shard_path(layout, shard) for shard in range(num_shards)}
+                for path in self._snapshot_files(previous_layout).values():
+                    if path not in current:
+                        os.remove(path)
+            self._last_snapshot_time = time.monotonic()
+            if self.publish_dir:
+                self._publish(layout, num_shards, next_index)
+            
+            SAVE_INDEX_SECONDS.observe(time.perf_counter() - start_time, kind="snapshot")
+            BYTES_WRITTEN.inc(written, kind="snapshot")
+            BYTES_WRITTEN.inc(os.path.getsize(self.lexical_index.index_path), kind="lexical_snapshot")
+            
+            logger.info(f"Saved index snapshot of {len(shard_copies)} of {num_shards} shards with "
+                        f"{sum(index.ntotal for index in shard_copies.values())} vectors "
+                        f"({written / (1024 * 1024):.1f} MB) in {time.perf_counter() - start_time:.2f}s")
+        except Exception as e:
+            with self._lock.write():
+                self._dirty_shards |= set(shard_copies)
+            logger.error(f"Failed to write index snapshot: {e}")
+    
+    def _shard_path(self, layout: ShardLayout, shard: int) -> str:
+        """Snapshot file of one shard; an unsharded index keeps index_path"""
+        if layout.tag is None:
+            return self.index_path
+        stem, ext = os.path.splitext(self.index_path)
+        return f"{stem}.{layout.tag}.{shard}{ext}"
+    
+    def _snapshot_files(self, layout: ShardLayout) -> Dict[int, str]:
+        """Snapshot files on disk for a layout, by shard"""
+        if layout.tag is None:
+            return {0: self.index_path} if os.path.exists(self.index_path) else {}
+        directory = os.path.dirname(self.index_path) or "."
+        stem, ext = os.path.splitext(os.path.basename(self.index_path))
+        pattern = re.compile(rf"^{re.escape(stem)}\.{layout.tag}\.(\d+){re.escape(ext)}$")
+        files = {}
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                files[int(match.group(1))] = os.path.join(directory, name)
+        return files
+    
+    def _snapshot_complete(self) -> bool:
+        """Whether the snapshot on disk has the current layout and a file for every shard"""
+        return (self.index.layout == self._snapshot_layout
+                and all(os.path.exists(self._shard_path(self.index.layout, shard)) for shard in range(len(self.index.shards))))
+    
+    def _publish(self, layout: ShardLayout, num_shards: int, next_index: int):
+        """Expose the snapshot files just written as the next generation for read-only workers.
+        
+        The files are hard-linked (copied where links are not possible) under
+        generation-numbered names, so a published generation never changes
+        while readers map it; unchanged shards are linked again at no cost.
+        The manifest naming them is replaced last.
+        """
+        generation = self.published_generation + 1
+        manifest = {"generation": generation, "next_index": next_index, "dimension": self.dimension,
+                    "shard_layout": layout.tag, "index_files": []}
+        paths = [self._shard_path(layout, shard) for shard in range(num_shards)]
+        for path in paths + [self.lexical_index.index_path]:
+            stem, ext = os.path.splitext(os.path.basename(path))
+            name = f"{stem}.{generation}{ext}"
+            target = os.path.join(self.publish_dir, name)
+            if os.path.exists(target):
+                os.remove(target)  # Left by a publish that failed before its manifest
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+            if path == self.lexical_index.index_path:
+                manifest["lexical_file"] = name
+            else:
+                manifest["index_files"].append(name)
+        
+        tmp_path = os.path.join(self.publish_dir, f"{MANIFEST_NAME}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.publish_dir, MANIFEST_NAME))
+        self.published_generation = generation
+        
+        # Readers keep their mapping of an unlinked generation; the previous one stays
+        # for readers that have read its manifest but not yet opened the files
+        stems = [os.path.splitext(os.path.basename(path))[0] for path in (self.index_path, self.lexical_index.index_path)]
+        stems_pattern = "|".join(re.escape(stem) for stem in stems)
+        pattern = re.compile(rf"^(?:{stems_pattern})\.(?:.+\.)?(\d+)\.[^.]+$")
+        for name in os.listdir(self.publish_dir):
+            match = pattern.match(name)
+            if match and int(match.group(1)) < generation - 1:
+                os.remove(os.path.join(self.publish_dir, name))
+        logger.info(f"Published index generation {generation} with positions below {next_index}")
+    
+    def _publish_on_start(self):
+        """Publish the loaded index for readers, snapshotting first if it changed since the last snapshot"""
+        if not self._snapshot_files(self._snapshot_layout):
+            return  # Published with the first snapshot
+        if (self.vector_log.records_since_snapshot or self._dirty_shards or not self._snapshot_complete()
+                or not os.path.exists(self.lexical_index.index_path)):
+            self.compact(background=True)
+        else:
+            self._publish(self.index.layout, len(self.index.shards), self.next_index)
+    
+    def wait_for_compaction(self):
+        """Block until a running background rebuild and snapshot have finished"""
+        thread = self._rebuild_thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
+        self._join_compaction()
+    
     def clear(self):
         """Clear the vector store"""
+        self._check_writable()
         try:
-            # Remove files
-            if os.path.exists(self.index_path):
-                os.remove(self.index_path)
-            if os.path.exists(self.metadata_path):
-                os.remove(self.metadata_path)
+            # Make sure a background snapshot cannot recreate the files afterwards
+            self.wait_for_compaction()
             
-            # Reset in-memory structures
-            self._initialize_new_index()
+            with self._lock.write():
+                # Remove files
+                layouts = {self._snapshot_layout, self.index.layout} if self.index is not None else {self._snapshot_layout}
+                for layout in layouts:
+                    for path in self._snapshot_files(layout).values():
+                        os.remove(path)
+                self._snapshot_layout = ShardLayout()
+                
+                # Reset in-memory structures (also empties the metadata store and log).
+                # Positions keep counting up, so a read-only worker still serving an
+                # older generation cannot match its vectors to notes stored after this.
+                next_index = self.next_index
+                self._initialize_new_index()
+                self.next_index = next_index
+                self.generation += 1
+            
+            if self.publish_dir:
+                # Readers swap to the empty index instead of serving the cleared one
+                self.save_index(snapshot=True)
             
             logger.info("Cleared vector store")
             
@@ -208,33 +1589,45 @@ class VectorStore:
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store"""
         try:
-            if not self.is_initialized():
+            with self._lock.read():
+                if not self.is_initialized():
+                    return {
+                        "total_vectors": 0,
+                        "vector_dimension": self.dimension,
+                        "unique_subjects": 0,
+                        "store_size_mb": 0.0,
+                        "index_type": self.index_type,
+                        "vector_encoding": self.vector_encoding
+                    }
+                
+                # Calculate unique subjects
+                unique_subjects = self.metadata_store.unique_subjects()
+                
+                # Calculate file sizes
+                store_size = self.metadata_store.size_bytes()
+                if self.vector_log is not None:
+                    store_size += self.vector_log.size_bytes()
+                if self.vector_file is not None:
+                    store_size += self.vector_file.size_bytes()
+                index_files = self._served_files if self.read_only else list(self._snapshot_files(self._snapshot_layout).values())
+                for path in index_files + [self.lexical_index.index_path]:
+                    if os.path.exists(path):
+                        store_size += os.path.getsize(path)
+                
                 return {
-                    "total_vectors": 0,
+                    "total_vectors": self.index.ntotal - len(self.tombstones),
                     "vector_dimension": self.dimension,
-                    "unique_subjects": 0,
-                    "store_size_mb": 0.0
+                    "unique_subjects": unique_subjects,
+                    "store_size_mb": round(store_size / (1024 * 1024), 2),
+                    "index_type": self.current_index_type(),
+                    "vector_encoding": self.current_encoding(),
+                    "exact_rerank": self._reranks(),
+                    "linked_duplicates": self.metadata_store.count_duplicates(),
+                    "tombstoned_vectors": len(self.tombstones),
+                    "snapshot_generation": self.published_generation if self.publish_dir else None,
+                    "shards": self.index.sizes() if self.index.layout.shard_by else None
                 }
             
-            # Calculate unique subjects
-            unique_subjects = set()
-            for metadata in self.metadata.values():
-                unique_subjects.add(metadata.get('subject_id'))
-            
-            # Calculate file sizes
-            store_size = 0
-            if os.path.exists(self.index_path):
-                store_size += os.path.getsize(self.index_path)
-            if os.path.exists(self.metadata_path):
-                store_size += os.path.getsize(self.metadata_path)
-            
-            return {
-                "total_vectors": self.index.ntotal,
-                "vector_dimension": self.dimension,
-                "unique_subjects": len(unique_subjects),
-                "store_size_mb": round(store_size / (1024 * 1024), 2)
-            }
-            
         except Exception as e:
             logger.error(f"Failed to get stats: {e}")
             raise
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
+
+import httpx
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.embedding_service import EmbeddingService  # noqa: E402
+from services.vector_store import VectorStore  # noqa: E402
+
+DIMENSION = 32
+
+def note_metadata(i: int, subject_id: int = None) -> dict:
+    """Metadata of synthetic note n<i>"""
+    return {
+        "note_id": f"n{i}",
+        "parent_id": f"n{i}",
+        "subject_id": i % 7 if subject_id is None else subject_id,
+        "hadm_id": 1,
+        "charttime": "2020-01-01",
+        "cleaned_text": f"note {i} word{i}"
+    }
+
+def add_notes(store: VectorStore, vectors: np.ndarray, start: int, stop: int) -> int:
+    """Add notes n<start>..n<stop - 1> with the matching rows of vectors"""
+    return store.add_vectors([f"n{i}" for i in range(start, stop)], vectors[start:stop],
+                             [note_metadata(i) for i in range(start, stop)])
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int, exclude=()) -> list:
+    """Note ids of the k nearest vectors by cosine similarity"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return [f"n{i}" for i in np.argsort(-scores) if f"n{i}" not in exclude][:k]
+
+def close_store(store: VectorStore, crash: bool = False):
+    """Shut a store down; with crash, drop everything not yet checkpointed"""
+    store.close()
+    if crash:
+        store.metadata_store._conn.rollback()
+    store.metadata_store.close()
+    store.vector_log.close()
+    # Nothing left for __del__ to save
+    store.index = None
+
+class FakeOllama:
+    """Embedding endpoints with a short delay, recording requests and peak concurrency"""
+
+    def __init__(self, embed_api: bool = True, dimension: int = 8, delay: float = 0.01):
+        self.embed_api = embed_api
+        self.dimension = dimension
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(self.dimension).tolist()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.requests.append((request.url.path, payload))
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if request.url.path == "/api/embed":
+            if not self.embed_api:
+                return httpx.Response(404, text="404 page not found")
+            return httpx.Response(200, json={"embeddings": [self.vector(text) for text in payload["input"]]})
+        return httpx.Response(200, json={"embedding": self.vector(payload["prompt"])})
+
+def make_embedding_service(ollama: FakeOllama, **kwargs) -> EmbeddingService:
+    """EmbeddingService talking to the fake Ollama, without an on-disk cache"""
+    options = {"cache_path": None, "embed_batch_size": 4}
+    options.update(kwargs)
+    service = EmbeddingService(**options)
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(ollama.handle))
+    return service
+
+@pytest.fixture
+def vectors() -> np.ndarray:
+    return np.random.default_rng(0).standard_normal((600, DIMENSION)).astype(np.float32)
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Open VectorStores in tmp_path; ones still open are closed after the test"""
+    opened = []
+
+    def make(**kwargs) -> VectorStore:
+        options = {
+            "index_path": str(tmp_path / "faiss_index.bin"),
+            "metadata_path": str(tmp_path / "metadata.db"),
+            "legacy_metadata_path": str(tmp_path / "metadata.pkl"),
+            "dimension": DIMENSION,
+            "executor_threads": 1
+        }
+        options.update(kwargs)
+        store = VectorStore(**options)
+        opened.append(store)
+        return store
+
+    yield make
+    for store in opened:
+        if store.index is not None:
+            close_store(store)
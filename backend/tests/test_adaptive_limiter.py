@@ -0,0 +1,45 @@
+import asyncio
+
+from services.adaptive_limiter import AdaptiveConcurrencyLimiter
+
+def test_limit_grows_by_about_one_slot_per_window():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=16)
+    for _ in range(4):
+        limiter._update(0.1, success=True)
+    assert 4.9 < limiter.limit < 5.0
+    for _ in range(500):
+        limiter._update(0.1, success=True)
+    assert limiter.limit == 16
+
+def test_errors_shrink_the_limit_multiplicatively():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=2, backoff_ratio=0.5)
+    limiter._update(0.1, success=False)
+    assert limiter.limit == 5
+    limiter._update(0.1, success=False)
+    limiter._update(0.1, success=False)
+    assert limiter.limit == 2
+    assert limiter.get_stats()["total_errors"] == 3
+
+def test_latency_above_baseline_shrinks_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, latency_tolerance=2.0, backoff_ratio=0.5, smoothing=1.0)
+    limiter._update(0.1, success=True)
+    grown = limiter.limit
+    limiter._update(0.5, success=True)
+    assert limiter.limit == grown * 0.5
+    # The smoothed latency is reset, so the next normal request grows the limit again
+    limiter._update(0.1, success=True)
+    assert limiter.limit > grown * 0.5
+
+def test_acquire_waits_for_a_free_slot():
+    async def run():
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await limiter.release(0.1, success=True)
+        await asyncio.wait_for(waiter, 1)
+        return limiter.in_flight
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import main
+from conftest import FakeOllama, add_notes, make_embedding_service, note_metadata
+from services.ttl_cache import TTLCache
+
+def note_ids(results):
+    return [result.note_id for result in results]
+
+@pytest.fixture
+def store(make_store, vectors):
+    store = make_store()
+    add_notes(store, vectors, 0, 300)
+    return store
+
+def test_batch_matches_individual_searches(store, vectors):
+    queries = vectors[[5, 77, 140, 299]]
+    top_ks = [3, 5, 1, 4]
+    filters = [None, 2, None, None]
+    lexical = [None, None, "word140", None]
+
+    batch = store.search_batch(queries, top_ks, subject_id_filters=filters, lexical_queries=lexical)
+
+    assert note_ids(batch[0]) == note_ids(store.search(queries[0], top_k=3))
+    assert note_ids(batch[1]) == note_ids(store.search(queries[1], top_k=5, subject_id_filter=2))
+    assert note_ids(batch[2]) == note_ids(store.hybrid_search("word140", queries[2], top_k=1))
+    assert note_ids(batch[3]) == note_ids(store.search(queries[3], top_k=4))
+
+def test_unfiltered_queries_share_one_index_search(store, vectors, monkeypatch):
+    calls = []
+    search = store.index.search
+
+    def counting_search(query_vectors, k, **kwargs):
+        calls.append(len(query_vectors))
+        return search(query_vectors, k, **kwargs)
+
+    monkeypatch.setattr(store.index, "search", counting_search)
+    results = store.search_batch(vectors[:20], [5] * 20)
+
+    assert calls == [20]
+    assert [note_ids(result)[0] for result in results] == [f"n{i}" for i in range(20)]
+
+def test_empty_store_returns_one_empty_list_per_query(make_store, vectors):
+    assert make_store().search_batch(vectors[:3], [5, 5, 5]) == [[], [], []]
+
+@pytest.fixture
+def api(make_store, monkeypatch):
+    """main's app over a small store whose vectors are the fake Ollama's embeddings"""
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+    metadatas = [note_metadata(i) for i in range(50)]
+    store.add_vectors([metadata["note_id"] for metadata in metadatas],
+                      np.array([ollama.vector(metadata["cleaned_text"]) for metadata in metadatas]), metadatas)
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "embedding_service", make_embedding_service(ollama, embed_batch_size=16))
+    monkeypatch.setattr(main, "search_result_cache", TTLCache(max_size=16))
+    return ollama
+
+def post_batch(payload):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/search/batch", json=payload)
+    return asyncio.run(run())
+
+def test_endpoint_answers_in_request_order_with_one_embedding_call(api):
+    queries = [
+        {"query": "note 4 word4", "top_k": 2},
+        {"query": "word9", "top_k": 1, "mode": "lexical"},
+        {"query": "note 31 word31", "top_k": 3, "subject_id": 3},
+        {"query": "note 12 word12", "top_k": 1, "mode": "hybrid"},
+    ]
+    response = post_batch({"queries": queries})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total_queries"] == 4
+    assert [result["results"][0]["note_id"] for result in body["results"]] == ["n4", "n9", "n31", "n12"]
+    assert [result["mode"] for result in body["results"]] == ["dense", "lexical", "dense", "hybrid"]
+    # The lexical query needs no embedding; the other three share one /api/embed call
+    assert [payload["input"] for _, payload in api.requests] == [["note 4 word4", "note 31 word31", "note 12 word12"]]
+
+def test_endpoint_rejects_unknown_modes(api):
+    response = post_batch({"queries": [{"query": "x", "mode": "fuzzy"}]})
+    assert response.status_code == 400
+    assert "Unknown search mode" in response.json()["detail"]
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import numpy as np
+import pytest
+
+from conftest import BACKEND_DIR
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+import fake_ollama  # noqa: E402
+import run_benchmark  # noqa: E402
+
+def request(app, method: str, path: str, **kwargs) -> httpx.Response:
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://fake") as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(run())
+
+@pytest.fixture
+def app():
+    return fake_ollama.create_app(latency_ms=0, jitter_ms=0, per_input_ms=0, dimension=16,
+                                  chat_tokens=5, token_latency_ms=0, first_token_ms=0)
+
+def test_fake_embeddings_are_deterministic_unit_vectors(app):
+    batch = request(app, "POST", "/api/embed", json={"input": ["sepsis", "stroke"]}).json()["embeddings"]
+    single = request(app, "POST", "/api/embeddings", json={"prompt": "sepsis"}).json()["embedding"]
+
+    assert single == batch[0] == fake_ollama.fake_embedding("sepsis", 16)
+    assert batch[0] != batch[1]
+    np.testing.assert_allclose(np.linalg.norm(batch, axis=1), 1.0, rtol=1e-6)
+
+def test_fake_chat_streams_the_configured_tokens(app):
+    response = request(app, "POST", "/api/chat", json={"messages": [{"role": "user", "content": "x" * 40}]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [line["done"] for line in lines] == [False] * 5 + [True]
+    assert "".join(line["message"]["content"] for line in lines) == "".join(f" token{i}" for i in range(5))
+    assert lines[-1]["prompt_eval_count"] == 10
+
+def test_corpus_and_queries_are_reproducible():
+    assert run_benchmark.make_corpus(20, 2, seed=3) == run_benchmark.make_corpus(20, 2, seed=3)
+    assert run_benchmark.make_corpus(20, 2, seed=3) != run_benchmark.make_corpus(20, 2, seed=4)
+    queries = run_benchmark.make_queries(50, seed=3)
+    assert queries == run_benchmark.make_queries(50, seed=3)
+    assert len(set(queries)) == 50
+
+def test_run_concurrently_caps_in_flight_requests_and_counts_errors():
+    in_flight = {"now": 0, "peak": 0}
+
+    async def make_request(i: int) -> int:
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.001)
+        in_flight["now"] -= 1
+        if i % 5 == 0:
+            raise RuntimeError("boom")
+        return 2
+
+    latencies, units, errors, duration = asyncio.run(run_benchmark.run_concurrently(20, 3, make_request))
+    assert in_flight["peak"] == 3
+    assert (len(latencies), units, errors) == (16, 32, 4)
+    summary = run_benchmark.summarize(latencies, units, errors, duration, "records")
+    assert summary["requests"] == 20 and summary["errors"] == 4
+
+def test_percentile_summary_is_in_milliseconds():
+    summary = run_benchmark.percentile_summary([i / 1000 for i in range(1, 101)])
+    assert summary["p50"] == pytest.approx(50.5)
+    assert summary["p99"] == pytest.approx(99.01)
+    assert summary["max"] == 100.0
+    assert run_benchmark.percentile_summary([])["p95"] == 0.0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from conftest import note_metadata
+
+def ids_and_metadata(numbers):
+    return [f"n{i}" for i in numbers], [note_metadata(i) for i in numbers]
+
+def test_bulk_add_matches_one_at_a_time(make_store, vectors, tmp_path):
+    bulk = make_store()
+    ids, metadatas = ids_and_metadata(range(100))
+    assert bulk.add_vectors(ids, vectors[:100], metadatas) == 100
+
+    single = make_store(index_path=str(tmp_path / "single.bin"), metadata_path=str(tmp_path / "single.db"))
+    for i in range(100):
+        single.add_vector(f"n{i}", vectors[i].tolist(), note_metadata(i))
+
+    assert bulk.next_index == single.next_index == 100
+    for query in (vectors[0], vectors[55], vectors[400]):
+        assert ([result.note_id for result in bulk.search(query, top_k=5)]
+                == [result.note_id for result in single.search(query, top_k=5)])
+
+def test_batch_is_written_with_one_index_and_log_call(make_store, vectors, monkeypatch):
+    store = make_store()
+    calls = []
+
+    def record(target, name):
+        original = getattr(target, name)
+
+        def wrapper(*args):
+            calls.append(name)
+            return original(*args)
+
+        monkeypatch.setattr(target, name, wrapper)
+
+    record(store.vector_log, "append")
+    record(store.metadata_store, "add_many")
+
+    ids, metadatas = ids_and_metadata(range(64))
+    store.add_vectors(ids, vectors[:64], metadatas)
+    assert calls == ["append", "add_many"]
+
+def test_existing_and_repeated_ids_are_skipped(make_store, vectors):
+    store = make_store()
+    ids, metadatas = ids_and_metadata(range(10))
+    store.add_vectors(ids, vectors[:10], metadatas)
+
+    ids, metadatas = ids_and_metadata([5, 10, 10, 11])
+    assert store.add_vectors(ids, vectors[[5, 10, 20, 11]], metadatas) == 2
+    assert store.metadata_store.count() == 12
+    # The first copy of a repeated id wins
+    assert store.search(vectors[10], top_k=1)[0].note_id == "n10"
+    assert store.search(vectors[20], top_k=1)[0].note_id != "n10"
+
+def test_chunks_of_a_stored_note_are_skipped(make_store, vectors):
+    store = make_store()
+    chunk = dict(note_metadata(1), note_id="n1#0", parent_id="n1")
+    store.add_vectors(["n1#0"], vectors[:1], [chunk])
+
+    later_chunk = dict(note_metadata(1), note_id="n1#1", parent_id="n1")
+    assert store.add_vectors(["n1#1"], vectors[1:2], [later_chunk]) == 0
+
+def test_caller_embeddings_are_not_normalized_in_place(make_store, vectors):
+    store = make_store()
+    batch = vectors[:5].copy()
+    ids, metadatas = ids_and_metadata(range(5))
+    store.add_vectors(ids, batch, metadatas)
+    np.testing.assert_array_equal(batch, vectors[:5])
+
+def test_mismatched_lengths_are_rejected(make_store, vectors):
+    store = make_store()
+    ids, metadatas = ids_and_metadata(range(3))
+    with pytest.raises(ValueError, match="Got 3 ids, 2 embeddings"):
+        store.add_vectors(ids, vectors[:2], metadatas)
+    assert store.add_vectors([], np.zeros((0, 32), dtype=np.float32), []) == 0
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from conftest import DIMENSION, note_metadata
+
+def chunk_rows(parent: int, chunks: int):
+    """Ids and metadata of the chunks of note n<parent>"""
+    base = note_metadata(parent)
+    ids = [f"n{parent}#{c}" for c in range(chunks)]
+    metadatas = [dict(base, note_id=chunk_id, parent_id=f"n{parent}", cleaned_text=f"chunk {c} of note {parent}")
+                 for c, chunk_id in enumerate(ids)]
+    return ids, metadatas
+
+@pytest.mark.parametrize("chunk_overfetch", [1, 3])
+def test_chunk_hits_collapse_to_one_result_per_note(make_store, chunk_overfetch):
+    store = make_store(chunk_overfetch=chunk_overfetch)
+    rng = np.random.default_rng(7)
+    query = rng.standard_normal(DIMENSION).astype(np.float32)
+
+    # Note 0's six chunks all sit right next to the query, ahead of notes 1-3
+    ids, metadatas = chunk_rows(0, 6)
+    close = query + 0.01 * rng.standard_normal((6, DIMENSION)).astype(np.float32)
+    store.add_vectors(ids, close, metadatas)
+    for parent, distance in ((1, 0.5), (2, 1.0), (3, 1.5)):
+        ids, metadatas = chunk_rows(parent, 2)
+        store.add_vectors(ids, query + distance * rng.standard_normal((2, DIMENSION)).astype(np.float32), metadatas)
+
+    results = store.search(query, top_k=3)
+    # Widening the search past the crowd of note 0 chunks still yields 3 distinct notes
+    assert [result.note_id for result in results] == ["n0", "n1", "n2"]
+    assert results[0].matched_text.startswith("chunk ")
+    assert results[0].similarity_score > results[1].similarity_score
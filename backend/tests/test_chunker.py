@@ -0,0 +1,43 @@
+import pytest
+
+from services.chunker import NoteChunker
+
+SECTIONS = ["Chief Complaint:\nchest pain\n",
+            "History of Present Illness:\n" + "The patient reports intermittent chest pain on exertion. " * 12 + "\n",
+            "Discharge Medications:\naspirin, atorvastatin, metoprolol\n"]
+
+def test_short_note_is_one_chunk():
+    chunks = NoteChunker().split("  Brief note.\n")
+    assert [(chunk.text, chunk.start, chunk.chunk_index) for chunk in chunks] == [("Brief note.", 2, 0)]
+
+def test_chunks_point_into_the_note():
+    note = "\n".join(SECTIONS) * 3
+    chunks = NoteChunker(chunk_size=300, chunk_overlap=60, min_chunk_size=50).split(note)
+    assert len(chunks) > 3
+    for index, chunk in enumerate(chunks):
+        assert chunk.chunk_index == index
+        assert note[chunk.start:chunk.start + len(chunk.text)] == chunk.text
+        assert len(chunk.text) <= 300
+        assert chunk.text == chunk.text.strip()
+
+def test_sections_start_new_chunks():
+    note = "".join(SECTIONS)
+    chunks = NoteChunker(chunk_size=300, chunk_overlap=60, min_chunk_size=50).split(note)
+    assert chunks[0].text.startswith("Chief Complaint:")
+    assert chunks[-1].text.startswith("Discharge Medications:")
+
+def test_oversized_section_windows_overlap_on_word_boundaries():
+    note = "Plan:\n" + " ".join(f"item{i} continue current management." for i in range(80))
+    chunks = NoteChunker(chunk_size=400, chunk_overlap=80, min_chunk_size=50).split(note)
+    assert len(chunks) > 2
+    for earlier, later in zip(chunks, chunks[1:]):
+        overlap = earlier.start + len(earlier.text) - later.start
+        assert 0 < overlap <= 80
+        assert note[later.start - 1].isspace()
+    # Every word of the note is in some chunk
+    covered = " ".join(chunk.text for chunk in chunks).split()
+    assert set(note.split()) <= set(covered)
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        NoteChunker(chunk_size=100, chunk_overlap=100)
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from services.context_builder import OMISSION_MARKER, ContextBuilder
+
+FILLER = ("Vital signs stable overnight. Tolerating diet. Ambulating in hallway with assistance. "
+          "Family updated at bedside. Continue current management and reassess in the morning. ")
+
+def record(note_id: str, text: str, **extra) -> dict:
+    return {"note_id": note_id, "subject_id": 1, "hadm_id": 1, "charttime": "2020-01-01", "cleaned_text": text, **extra}
+
+def long_note(key_sentence: str, position: int, paragraphs: int = 12) -> str:
+    parts = [FILLER * 3 for _ in range(paragraphs)]
+    parts[position] = key_sentence + " " + FILLER
+    return "\n\n".join(parts)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_context_never_exceeds_the_budget(seed):
+    rng = random.Random(seed)
+    builder = ContextBuilder(max_context_tokens=1500)
+    records = [record(f"n{i}", f"note {i} " + FILLER * rng.randint(1, 40)) for i in range(rng.randint(3, 12))]
+    context = builder.build("diet", records)
+
+    assert context.estimated_tokens <= 1500
+    assert context.estimated_tokens == sum(builder.estimate_tokens(r["cleaned_text"]) + 40 for r in context.records)
+    # Rank order is kept
+    assert [r["note_id"] for r in context.records] == [r["note_id"] for r in records[:len(context.records)]]
+
+def test_short_records_pass_through_unchanged():
+    records = [record("a", "Chest pain, troponin negative."), record("b", "Discharged home in good condition.")]
+    context = ContextBuilder().build("chest pain", records)
+    assert context.records == records
+    assert (context.records_trimmed, context.records_omitted, context.duplicates_dropped) == (0, 0, 0)
+
+def test_copy_forward_duplicates_are_dropped():
+    original = "Patient admitted with community acquired pneumonia, started on ceftriaxone and azithromycin. " + FILLER
+    copied = original + " Afebrile today."
+    context = ContextBuilder().build("pneumonia", [record("a", original), record("b", copied), record("c", "Unrelated cardiology consult.")])
+
+    assert [r["note_id"] for r in context.records] == ["a", "c"]
+    assert context.duplicates_dropped == 1
+    assert context.dropped_note_ids == ["b"]
+
+def test_long_note_is_trimmed_to_the_passages_matching_the_query():
+    text = long_note("Echocardiogram showed severe mitral regurgitation.", position=7)
+    builder = ContextBuilder(max_context_tokens=450)
+    context = builder.build("mitral regurgitation echocardiogram", [record("a", text)])
+
+    trimmed = context.records[0]["cleaned_text"]
+    assert context.records_trimmed == 1
+    assert "severe mitral regurgitation" in trimmed
+    assert OMISSION_MARKER in trimmed
+    assert builder.estimate_tokens(trimmed) <= 450 - 40
+    assert len(trimmed) < len(text) / 2
+
+def test_matched_chunk_is_kept_without_shared_terms():
+    matched = "Started heparin drip for new pulmonary embolism."
+    text = long_note(matched, position=9)
+    context = ContextBuilder(max_context_tokens=300).build("anticoagulation plan", [record("a", text, matched_text=matched)])
+    assert matched in context.records[0]["cleaned_text"]
+
+def test_records_beyond_the_budget_are_omitted():
+    records = [record(f"n{i}", f"note {i} " + FILLER * 5) for i in range(10)]
+    context = ContextBuilder(max_context_tokens=600, min_record_tokens=100).build("diet", records)
+
+    assert len(context.records) + context.records_omitted == 10
+    assert context.records_omitted > 0
+    assert context.dropped_note_ids == [f"n{i}" for i in range(len(context.records), 10)]
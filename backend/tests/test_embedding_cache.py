@@ -0,0 +1,79 @@
+import asyncio
+import itertools
+
+import numpy as np
+import pytest
+
+from conftest import FakeOllama, make_embedding_service
+from services import embedding_cache
+from services.embedding_cache import EmbeddingCache
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    # A strictly increasing clock so last_used never ties
+    clock = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(clock)))
+    return str(tmp_path / "embedding_cache.db")
+
+def vector(value: float) -> np.ndarray:
+    return np.full(4, value, dtype=np.float32)
+
+def test_least_recently_used_entries_are_evicted(cache_path):
+    cache = EmbeddingCache(cache_path, model_name="m", max_entries=10)
+    texts = [f"text {i}" for i in range(10)]
+    cache.put_many(texts, [vector(i) for i in range(10)])
+    # Touch the two oldest so they become the most recently used
+    cache.get_many(["text 0", "text 1"])
+    cache.put_many(["text 10"], [vector(10)])
+
+    # 11 entries over a limit of 10 trims back to 9, dropping text 2 and text 3
+    found = cache.get_many(texts + ["text 10"])
+    missing = [text for text, result in zip(texts + ["text 10"], found) if result is None]
+    assert missing == ["text 2", "text 3"]
+    assert cache.get_stats()["entries"] == 9
+    assert cache.get_stats()["evictions"] == 2
+    cache.close()
+
+def test_lookup_ignores_whitespace_and_counts_hits(cache_path):
+    cache = EmbeddingCache(cache_path, model_name="m")
+    cache.put_many(["chest  pain\nradiating"], [vector(1.5)])
+    hit, miss = cache.get_many(["chest pain radiating", "chest pain"])
+
+    np.testing.assert_array_equal(hit, vector(1.5))
+    assert miss is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+    cache.close()
+
+def test_entries_survive_reopen_but_not_a_model_change(cache_path):
+    cache = EmbeddingCache(cache_path, model_name="m1")
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.close()
+
+    reopened = EmbeddingCache(cache_path, model_name="m1")
+    assert reopened.get_stats()["entries"] == 2
+    reopened.close()
+
+    switched = EmbeddingCache(cache_path, model_name="m2")
+    assert switched.get_stats()["entries"] == 0
+    assert switched.get_many(["a"]) == [None]
+    switched.close()
+
+def test_cached_embeddings_skip_ollama(tmp_path):
+    ollama = FakeOllama()
+    cache_file = str(tmp_path / "service_cache.db")
+
+    async def embed(texts):
+        service = make_embedding_service(ollama, cache_path=cache_file)
+        embeddings = await service.get_embeddings_batch(texts)
+        await service.close()
+        return embeddings
+
+    first = asyncio.run(embed(["alpha", "beta"]))
+    sent = len(ollama.requests)
+    second = asyncio.run(embed(["beta", "alpha", "gamma"]))
+
+    # Only the new text goes over the wire after a restart
+    assert [payload["input"] for _, payload in ollama.requests[sent:]] == [["gamma"]]
+    np.testing.assert_allclose(second[0], first[1])
+    np.testing.assert_allclose(second[1], first[0])
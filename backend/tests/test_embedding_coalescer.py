@@ -0,0 +1,66 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.embedding_coalescer import EmbeddingCoalescer
+
+class RecordingBatch:
+    """Embeds each text as [len(text)] and records the batches it was given"""
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return [np.array([len(text)], dtype=np.float32) for text in texts]
+
+async def embed_all(coalescer: EmbeddingCoalescer, texts):
+    return await asyncio.gather(*(coalescer.embed(text) for text in texts))
+
+def test_concurrent_requests_share_one_batch():
+    batch = RecordingBatch()
+    coalescer = EmbeddingCoalescer(batch, max_batch_size=16, max_wait_ms=20)
+    results = asyncio.run(embed_all(coalescer, ["a", "bb", "a", "ccc"]))
+
+    # The duplicate "a" is embedded once and both callers get its vector
+    assert batch.batches == [["a", "bb", "ccc"]]
+    assert [float(result[0]) for result in results] == [1, 2, 1, 3]
+    assert coalescer.get_stats() == {"batches_sent": 1, "requests_coalesced": 4, "avg_batch_size": 4.0, "pending": 0}
+
+def test_full_batch_is_sent_without_waiting():
+    batch = RecordingBatch()
+    # A window long enough that the test would time out if it were waited for
+    coalescer = EmbeddingCoalescer(batch, max_batch_size=3, max_wait_ms=60_000)
+
+    async def run():
+        return await asyncio.wait_for(embed_all(coalescer, ["a", "b", "c", "d", "e", "f"]), 1)
+
+    asyncio.run(run())
+    assert batch.batches == [["a", "b", "c"], ["d", "e", "f"]]
+
+def test_requests_after_the_window_start_a_new_batch():
+    batch = RecordingBatch()
+    coalescer = EmbeddingCoalescer(batch, max_batch_size=16, max_wait_ms=1)
+
+    async def run():
+        await coalescer.embed("first")
+        await coalescer.embed("second")
+
+    asyncio.run(run())
+    assert batch.batches == [["first"], ["second"]]
+
+def test_batch_error_reaches_every_waiter():
+    coalescer = EmbeddingCoalescer(RecordingBatch(error=RuntimeError("ollama down")), max_wait_ms=1)
+
+    async def run():
+        return await asyncio.gather(coalescer.embed("a"), coalescer.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    with pytest.raises(RuntimeError):
+        asyncio.run(embed_all(coalescer, ["c"]))
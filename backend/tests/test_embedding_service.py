@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import numpy as np
+
+from conftest import FakeOllama, make_embedding_service as make_service
+from services.embedding_service import EmbeddingService
+
+async def collect(service: EmbeddingService, texts):
+    return {text: (embedding, error) async for text, embedding, error in service.embed_many(texts)}
+
+def test_embed_many_sends_micro_batches():
+    ollama = FakeOllama()
+    service = make_service(ollama)
+    texts = [f"text {i}" for i in range(10)]
+    results = asyncio.run(collect(service, texts))
+
+    assert sorted(results) == texts
+    assert all(error is None for _, error in results.values())
+    assert sorted(len(payload["input"]) for _, payload in ollama.requests) == [2, 4, 4]
+    expected = np.array(ollama.vector("text 3"), dtype=np.float32)
+    np.testing.assert_allclose(results["text 3"][0], expected / np.linalg.norm(expected), rtol=1e-6)
+
+def test_fallback_sends_one_text_at_a_time():
+    ollama = FakeOllama(embed_api=False)
+    service = make_service(ollama, initial_concurrency=1, min_concurrency=1, max_concurrency=1)
+    texts = [f"text {i}" for i in range(8)]
+    results = asyncio.run(collect(service, texts))
+
+    assert all(error is None for _, error in results.values())
+    assert service.embed_api_supported is False
+    # Only the first batch probes /api/embed; every text is then embedded on its own
+    assert [path for path, _ in ollama.requests].count("/api/embed") == 1
+    assert [path for path, _ in ollama.requests].count("/api/embeddings") == 8
+    assert ollama.peak_in_flight == 1
+
+def test_batch_keeps_failed_positions():
+    ollama = FakeOllama()
+    handle = ollama.handle
+
+    async def fail_one(request: httpx.Request) -> httpx.Response:
+        if b"bad" in request.content:
+            return httpx.Response(400, text="invalid input")
+        return await handle(request)
+
+    ollama.handle = fail_one
+    service = make_service(ollama)
+    service.max_retries = 1
+    texts = ["first", "bad", "third"]
+    embeddings = asyncio.run(service.get_embeddings_batch(texts, batch_size=2))
+
+    assert len(embeddings) == 3
+    assert embeddings[1] is None
+    expected = np.array(ollama.vector("third"), dtype=np.float32)
+    np.testing.assert_allclose(embeddings[2], expected / np.linalg.norm(expected), rtol=1e-6)
+
+def test_long_text_is_sent_in_full():
+    ollama = FakeOllama()
+    service = make_service(ollama)
+    text = "  " + "word " * 3000
+    asyncio.run(service.get_embedding(text))
+    assert ollama.requests[-1][1]["prompt"] == text.strip()
+
+def test_calls_in_flight_stay_within_the_limit():
+    ollama = FakeOllama(delay=0.02)
+    service = make_service(ollama, embed_batch_size=1, initial_concurrency=3, min_concurrency=3, max_concurrency=3)
+    results = asyncio.run(collect(service, [f"text {i}" for i in range(12)]))
+
+    assert len(results) == 12
+    assert ollama.peak_in_flight == 3
+    assert service.get_concurrency_stats()["in_flight"] == 0
+
+def test_input_is_read_only_as_slots_free_up():
+    ollama = FakeOllama(delay=0.02)
+    service = make_service(ollama, embed_batch_size=1, initial_concurrency=2, min_concurrency=2, max_concurrency=2)
+    consumed = []
+
+    async def records():
+        for i in range(10):
+            consumed.append(i)
+            yield f"text {i}"
+
+    async def first_result():
+        stream = service.embed_many(records())
+        text, _, _ = await stream.__anext__()
+        read = len(consumed)
+        await stream.aclose()
+        return text, read
+
+    text, read = asyncio.run(first_result())
+    assert text == "text 0"
+    # Two calls in flight and the next record waiting for a slot, not all ten
+    assert read <= 4
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services.embedding_service import EmbeddingService
+from services.http_client import create_async_client, get_pool_stats
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    """Answers /api/embeddings and records the client port of every request"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.client_ports.append(self.client_address[1])
+        body = json.dumps({"embedding": [1.0, 0.0, 0.0, 0.0]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), EmbeddingHandler)
+    httpd.client_ports = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_sequential_requests_reuse_one_connection(server):
+    async def run():
+        service = EmbeddingService(ollama_url=f"http://127.0.0.1:{server.server_port}", cache_path=None)
+        await service.start()
+        client = service._client
+        for i in range(5):
+            await service.get_embedding(f"query {i}")
+        stats = service.get_pool_stats()
+        same_client = service._client is client
+        await service.close()
+        return stats, same_client, service.get_pool_stats()
+
+    stats, same_client, closed_stats = asyncio.run(run())
+    assert same_client
+    assert len(server.client_ports) == 5
+    assert len(set(server.client_ports)) == 1
+    assert stats["open"] and stats["connections"] == 1 and stats["idle"] == 1
+    assert closed_stats["open"] is False
+
+def test_pool_stats_of_missing_client():
+    assert get_pool_stats(None) == {"open": False, "connections": 0, "in_use": 0, "idle": 0, "pending_requests": 0}
+
+def test_client_limits_follow_arguments():
+    async def run():
+        client = create_async_client(max_connections=3, max_keepalive_connections=2, request_timeout=7.0)
+        pool = client._transport._pool
+        limits = (pool._max_connections, pool._max_keepalive_connections, client.timeout.read)
+        await client.aclose()
+        return limits
+
+    assert asyncio.run(run()) == (3, 2, 7.0)
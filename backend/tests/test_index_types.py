@@ -0,0 +1,70 @@
+import pytest
+
+from conftest import add_notes, close_store, exact_top_k
+
+QUERIES = [3, 150, 299]
+
+def top_ids(store, query, top_k=5, **kwargs):
+    return [result.note_id for result in store.search(query, top_k=top_k, **kwargs)]
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw"])
+def test_convert_round_trip_keeps_exact_results(make_store, vectors, index_type):
+    store = make_store(nlist=8, nprobe=8, ef_search=128)
+    add_notes(store, vectors, 0, 300)
+    before = {query: top_ids(store, vectors[query]) for query in QUERIES}
+    generation = store.generation
+
+    store.convert_index(index_type)
+    assert store.current_index_type() == index_type
+    assert store.index.ntotal == 300
+    assert store.generation == generation + 1
+    # Probing every list or a wide HNSW beam is exhaustive on this little data
+    for query in QUERIES:
+        assert top_ids(store, vectors[query]) == before[query]
+
+    store.convert_index("flat")
+    assert store.current_index_type() == "flat"
+    assert {query: top_ids(store, vectors[query]) for query in QUERIES} == before
+
+def test_converted_type_survives_a_restart(make_store, vectors):
+    store = make_store(nlist=8)
+    add_notes(store, vectors, 0, 300)
+    store.convert_index("ivf_flat")
+    # As /index/convert does, so the snapshot is written before returning
+    store.save_index(snapshot=True)
+    close_store(store)
+
+    reopened = make_store(nlist=8)
+    assert reopened.current_index_type() == "ivf_flat"
+    assert reopened.index.ntotal == 300
+    assert top_ids(reopened, vectors[42], top_k=1, nprobe=8) == ["n42"]
+
+def test_ivf_store_trains_once_enough_vectors_exist(make_store, vectors):
+    store = make_store(index_type="ivf_flat", nlist=8, ann_min_vectors=250)
+    add_notes(store, vectors, 0, 200)
+    assert store.current_index_type() == "flat"
+
+    add_notes(store, vectors, 200, 300)
+    assert store.current_index_type() == "ivf_flat"
+    assert top_ids(store, vectors[7], top_k=3, nprobe=8) == exact_top_k(vectors[:300], vectors[7], 3)
+
+def test_ivf_pq_compresses_and_still_finds_the_query(make_store, vectors):
+    store = make_store(nlist=4, pq_m=8, pq_nbits=4)
+    add_notes(store, vectors, 0, 300)
+    store.convert_index("ivf_pq")
+
+    assert store.current_index_type() == "ivf_pq"
+    assert store.current_encoding() == "pq"
+    hits = sum(top_ids(store, vectors[i], top_k=5, nprobe=4)[0] == f"n{i}" for i in range(0, 300, 10))
+    assert hits >= 25
+
+def test_ivf_needs_enough_training_vectors(make_store, vectors):
+    store = make_store(nlist=64)
+    add_notes(store, vectors, 0, 20)
+    with pytest.raises(ValueError, match="needs at least 64 training vectors"):
+        store.convert_index("ivf_flat")
+    assert store.current_index_type() == "flat"
+
+def test_unknown_index_type_is_rejected(make_store):
+    with pytest.raises(ValueError, match="Unknown index type"):
+        make_store(index_type="lsh")
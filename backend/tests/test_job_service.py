@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from conftest import FakeOllama, make_embedding_service
+from models import MimicRecord
+from services.chunker import NoteChunker
+from services.job_service import JobManager
+
+def records(count: int, prefix: str = "r"):
+    return [MimicRecord(note_id=f"{prefix}{i}", subject_id=i % 3, hadm_id=1, charttime="2020-01-01",
+                        cleaned_text=f"patient {i} admitted with {prefix} complaint") for i in range(count)]
+
+@pytest.fixture
+def make_jobs(tmp_path, make_store):
+    """JobManager factory over one fake Ollama, vector store and jobs database"""
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+
+    def make() -> JobManager:
+        return JobManager(make_embedding_service(ollama), store, NoteChunker(),
+                          db_path=str(tmp_path / "jobs.db"), write_batch_size=8, progress_interval=0.0)
+
+    make.store = store
+    return make
+
+async def wait_for(jobs: JobManager, job_id: str):
+    for _ in range(500):
+        job = await jobs.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+def test_job_runs_to_completion(make_jobs):
+    async def run():
+        jobs = make_jobs()
+        await jobs.start()
+        submitted = await jobs.submit(records(20))
+        assert submitted["status"] == "queued"
+        assert submitted["total"] == 20
+        job = await wait_for(jobs, submitted["job_id"])
+        stats = await jobs.get_stats()
+        listed = await jobs.list(status="completed")
+        spooled = jobs._query("SELECT COUNT(*) FROM job_records")[0][0]
+        await jobs.close()
+        return job, stats, listed, spooled
+
+    job, stats, listed, spooled = asyncio.run(run())
+    assert job["status"] == "completed"
+    assert (job["processed"], job["vectorized"], job["failed"], job["progress"]) == (20, 20, 0, 100)
+    assert stats["by_status"]["completed"] == 1
+    assert [listed_job["job_id"] for listed_job in listed] == [job["job_id"]]
+    assert spooled == 0
+    assert make_jobs.store.metadata_store.count() == 20
+
+def test_queued_job_can_be_cancelled(make_jobs):
+    async def run():
+        jobs = make_jobs()
+        await jobs.start()
+        first = await jobs.submit(records(40))
+        second = await jobs.submit(records(5, prefix="q"))
+        cancelled = await jobs.cancel(second["job_id"])
+        finished = await wait_for(jobs, first["job_id"])
+        unknown = await jobs.cancel("missing")
+        await jobs.close()
+        return cancelled, finished, unknown
+
+    cancelled, finished, unknown = asyncio.run(run())
+    assert cancelled["status"] == "cancelled"
+    assert cancelled["message"] == "Cancelled before it started"
+    assert finished["status"] == "completed"
+    assert unknown is None
+    assert not make_jobs.store.metadata_store.existing_parent_ids(["q0"])
+
+def test_interrupted_job_resumes_on_start(make_jobs):
+    async def interrupt():
+        jobs = make_jobs()
+        # Never started, as if the process stopped while the job was running
+        jobs._queue = asyncio.Queue()
+        job = await jobs.submit(records(12))
+        jobs._update(job["job_id"], status="running", attempts=1)
+        await jobs.close()
+        return job["job_id"]
+
+    async def resume(job_id: str):
+        jobs = make_jobs()
+        await jobs.start()
+        job = await wait_for(jobs, job_id)
+        await jobs.close()
+        return job
+
+    job = asyncio.run(resume(asyncio.run(interrupt())))
+    assert job["status"] == "completed"
+    assert job["attempts"] == 2
+    assert job["vectorized"] == 12
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from conftest import note_metadata
+from services.lexical_index import LexicalIndex, tokenize
+
+DOCS = [
+    "patient with chest pain and dyspnea",
+    "chest pain resolved, troponin negative",
+    "hyperkalemia k+ 6.1 treated with insulin",
+    "diabetes i10.9 on insulin insulin pump",
+    "routine follow up visit",
+]
+
+@pytest.fixture
+def index(tmp_path):
+    lexical = LexicalIndex(str(tmp_path / "lexical.npz"))
+    lexical.add_many(range(len(DOCS)), DOCS)
+    return lexical
+
+def ranked(index, query, **kwargs):
+    return index.search(query, 10, **kwargs)[1].tolist()
+
+def test_tokenize_keeps_clinical_codes_and_drops_stopwords():
+    assert tokenize("The K+ was 6.1 and the ICD is I10.9 / s/p CABG") == ["k+", "6.1", "icd", "i10.9", "s/p", "cabg"]
+
+def test_bm25_prefers_term_frequency_and_rare_terms(index):
+    # Doc 3 mentions insulin twice
+    assert ranked(index, "insulin") == [3, 2]
+    # "troponin" is rarer than "chest", so doc 1 outranks doc 0
+    assert ranked(index, "chest troponin") == [1, 0]
+    assert ranked(index, "k+") == [2]
+    assert ranked(index, "unrelated words") == []
+
+def test_candidate_ids_restrict_the_search(index):
+    assert ranked(index, "chest pain", candidate_ids=[0, 4]) == [0]
+
+def test_removed_positions_stop_matching(index):
+    index.remove([3], [DOCS[3]])
+    assert ranked(index, "insulin") == [2]
+    # Without the texts every posting list is filtered
+    index.remove([1])
+    assert ranked(index, "chest") == [0]
+
+def test_snapshot_round_trip(index, tmp_path):
+    index.write_snapshot(index.snapshot())
+    loaded = LexicalIndex(index.index_path)
+    assert loaded.load()
+    assert loaded.get_stats() == index.get_stats()
+    for query in ("chest pain", "insulin", "i10.9"):
+        scores, ids = index.search(query, 5)
+        loaded_scores, loaded_ids = loaded.search(query, 5)
+        assert ids.tolist() == loaded_ids.tolist()
+        np.testing.assert_allclose(scores, loaded_scores)
+
+def fake_hits(*parent_ids):
+    return [{"index": i, "similarity": 1.0, "metadata": {"parent_id": parent_id}} for i, parent_id in enumerate(parent_ids)]
+
+def test_rank_fusion_favours_notes_both_rankers_agree_on(make_store):
+    store = make_store(rrf_k=60)
+    fused = store._fuse_hits((fake_hits("a", "b", "c"), fake_hits("d", "b", "a")))
+
+    assert [hit["metadata"]["parent_id"] for hit in fused] == ["a", "b", "d", "c"]
+    assert fused[0]["similarity"] == pytest.approx(1 / 61 + 1 / 63)
+    assert fused[1]["similarity"] == pytest.approx(2 / 62)
+
+def test_hybrid_search_surfaces_keyword_matches_dense_search_misses(make_store, vectors):
+    store = make_store(hybrid_candidates=10)
+    metadatas = [note_metadata(i) for i in range(200)]
+    metadatas[150]["cleaned_text"] = "note 150 pheochromocytoma workup"
+    store.add_vectors([metadata["note_id"] for metadata in metadatas], vectors[:200], metadatas)
+
+    dense = [result.note_id for result in store.search(vectors[3], top_k=5)]
+    hybrid = [result.note_id for result in store.hybrid_search("pheochromocytoma", vectors[3], top_k=5)]
+    lexical = [result.note_id for result in store.lexical_search("pheochromocytoma", top_k=5)]
+
+    assert "n150" not in dense
+    assert lexical == ["n150"]
+    # Each is ranked first by one ranker; the tied fused scores keep the dense hit first
+    assert hybrid[:2] == ["n3", "n150"]
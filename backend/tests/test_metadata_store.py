@@ -0,0 +1,50 @@
+from services.chunker import NoteChunker
+from services.metadata_store import MetadataStore
+
+NOTE = ("  \nChief Complaint:\nshortness of breath\n\n\n"
+        "History of Present Illness:\nThe patient is a 67 year old man with COPD who presents with "
+        "worsening dyspnea over three days. The patient reports productive cough and fevers.\n\n\n"
+        "Discharge Medications:\nalbuterol, prednisone taper, azithromycin. The patient was "
+        "counselled on inhaler technique and smoking cessation.\n  ")
+
+def store_chunks(store: MetadataStore, note_id: str, text: str, chunker: NoteChunker, parent_text: bool = True):
+    """Store a note's chunks the way the ingest pipeline does"""
+    chunks = chunker.split(text)
+    stitched = len(chunks) == 1 and chunks[0].text == text
+    start = store.max_index() + 1
+    store.add_many(
+        (start + chunk.chunk_index, f"{note_id}#{chunk.chunk_index}", {
+            "subject_id": 1,
+            "hadm_id": 1,
+            "charttime": "2020-01-01",
+            "cleaned_text": chunk.text,
+            "parent_id": note_id,
+            "chunk_index": chunk.chunk_index,
+            "chunk_start": chunk.start,
+            "parent_text": text if parent_text and chunk.chunk_index == 0 and not stitched else None
+        })
+        for chunk in chunks
+    )
+    return chunks
+
+def test_chunked_note_text_round_trips():
+    store = MetadataStore(":memory:")
+    chunker = NoteChunker(chunk_size=120, chunk_overlap=40, min_chunk_size=20)
+    chunks = store_chunks(store, "a", NOTE, chunker)
+    assert len(chunks) > 2
+    assert any(later.start < earlier.start + len(earlier.text) for earlier, later in zip(chunks, chunks[1:]))
+
+    store_chunks(store, "b", "short note", chunker)
+    store_chunks(store, "c", "\n padded note \n", chunker)
+    assert store.get_note_texts(["a", "b", "c", "missing"]) == {
+        "a": NOTE, "b": "short note", "c": "\n padded note \n"
+    }
+
+def test_rows_without_parent_text_are_spliced_by_offset():
+    store = MetadataStore(":memory:")
+    chunker = NoteChunker(chunk_size=120, chunk_overlap=40, min_chunk_size=20)
+    store_chunks(store, "a", NOTE, chunker, parent_text=False)
+
+    text = store.get_note_texts(["a"])["a"]
+    # Only whitespace between chunks is lost; every word comes back once and in order
+    assert text.split() == NOTE.split()
@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from services.metrics import MetricsRegistry
+
+def samples(text: str) -> dict:
+    """Sample name with labels -> value, from Prometheus text"""
+    parsed = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            parsed[name] = float(value)
+    return parsed
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+def test_counter_and_gauge_render_per_label_set(registry):
+    counter = registry.counter("jobs_total", "Jobs by outcome", ("outcome",))
+    counter.inc(outcome="ok")
+    counter.inc(2, outcome="ok")
+    counter.inc(outcome='bad "quote"')
+    registry.gauge("queue_depth", "Queued jobs").set(7)
+
+    text = registry.render()
+    assert "# HELP jobs_total Jobs by outcome\n# TYPE jobs_total counter" in text
+    assert samples(text) == {
+        'jobs_total{outcome="ok"}': 3.0,
+        'jobs_total{outcome="bad \\"quote\\""}': 1.0,
+        "queue_depth": 7.0,
+    }
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage="embed")
+
+    parsed = samples(registry.render())
+    assert parsed['latency_seconds_bucket{stage="embed",le="0.1"}'] == 2
+    assert parsed['latency_seconds_bucket{stage="embed",le="1.0"}'] == 3
+    assert parsed['latency_seconds_bucket{stage="embed",le="+Inf"}'] == 4
+    assert parsed['latency_seconds_count{stage="embed"}'] == 4
+    assert parsed['latency_seconds_sum{stage="embed"}'] == pytest.approx(3.65)
+
+def test_histogram_times_a_block(registry, monkeypatch):
+    histogram = registry.histogram("block_seconds", "Block time", buckets=(1.0,))
+    ticks = iter([10.0, 10.25])
+    monkeypatch.setattr("services.metrics.time.perf_counter", lambda: next(ticks))
+    with histogram.time():
+        pass
+    assert samples(registry.render())["block_seconds_sum"] == 0.25
+
+def test_callback_metrics_are_read_at_scrape_time(registry):
+    sizes = {"a": 1}
+    registry.callback("cache_entries", "Entries per cache", "gauge",
+                      lambda: [({"cache": name}, size) for name, size in sizes.items()] + [({"cache": "off"}, None)],
+                      ("cache",))
+    assert samples(registry.render()) == {'cache_entries{cache="a"}': 1.0}
+    sizes["b"] = 5
+    assert samples(registry.render())['cache_entries{cache="b"}'] == 5.0
+
+def test_metrics_endpoint_reports_requests_by_route_template():
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.delete("/subjects/123")
+            await client.delete("/subjects/456")
+            return await client.get("/metrics")
+
+    response = asyncio.run(run())
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    parsed = samples(response.text)
+    # Both deletes share one series keyed on the route template, not the raw path
+    key = 'rag_http_request_duration_seconds_count{method="DELETE",route="/subjects/{subject_id}",status="500"}'
+    assert parsed[key] >= 2
+    assert not any("/subjects/123" in name for name in parsed)
+    assert "# TYPE rag_cache_hits_total counter" in response.text
@@ -0,0 +1,113 @@
+import asyncio
+import random
+
+import numpy as np
+import pytest
+
+from conftest import FakeOllama, make_embedding_service
+from models import MimicRecord
+from services.chunker import NoteChunker
+from services.ingest_service import IngestPipeline
+from services.near_duplicates import NearDuplicateDetector
+
+WORDS = ("patient admitted with fever cough chest pain started antibiotics lactate trended down blood "
+         "cultures negative discharged home follow up clinic creatinine stable heparin metoprolol").split()
+
+def make_note(seed: int, length: int = 300) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randint(0, 9)) for _ in range(length))
+
+def copy_forward(text: str, edits: int, seed: int = 0) -> str:
+    """The note with a few words changed, as in a progress note carried over to the next day"""
+    rng = random.Random(seed)
+    words = text.split()
+    for position in rng.sample(range(len(words)), edits):
+        words[position] = "edited"
+    return " ".join(words)
+
+@pytest.fixture
+def detector():
+    return NearDuplicateDetector(threshold=0.9)
+
+def test_signature_similarity_tracks_shingle_overlap(detector):
+    note = make_note(1)
+    same = detector.similarity(detector.signature(note), detector.signature(note))
+    close = detector.similarity(detector.signature(note), detector.signature(copy_forward(note, 2)))
+    unrelated = detector.similarity(detector.signature(note), detector.signature(make_note(2)))
+
+    assert same == 1.0
+    assert close >= 0.9
+    assert unrelated < 0.2
+    assert detector.signature("the and of") is None
+
+def test_near_duplicates_share_a_band_bucket(detector):
+    note = make_note(3)
+    buckets = set(detector.band_buckets(detector.signature(note)))
+    assert buckets & set(detector.band_buckets(detector.signature(copy_forward(note, 2))))
+    assert not buckets & set(detector.band_buckets(detector.signature(make_note(4))))
+
+def test_bands_put_the_collision_midpoint_below_the_threshold():
+    for threshold in (0.5, 0.8, 0.9, 0.95):
+        detector = NearDuplicateDetector(threshold=threshold)
+        assert detector.bands * detector.rows == detector.num_perm
+        assert (1 / detector.bands) ** (1 / detector.rows) <= threshold
+
+def test_best_match_picks_the_most_similar_candidate_over_the_threshold(detector):
+    note = make_note(5)
+    signature = detector.signature(note)
+    candidates = {
+        "far": detector.signature(copy_forward(note, 60)),
+        "near": detector.signature(copy_forward(note, 4)),
+        "nearest": detector.signature(copy_forward(note, 1)),
+    }
+    assert detector.best_match(signature, candidates)[0] == "nearest"
+    assert detector.best_match(signature, {"far": candidates["far"]}) is None
+
+@pytest.mark.parametrize("kwargs", [{"threshold": 0.0}, {"threshold": 1.5}, {"policy": "merge"}])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        NearDuplicateDetector(**kwargs)
+
+def record(note_id: str, text: str, subject_id: int = 1) -> MimicRecord:
+    return MimicRecord(note_id=note_id, subject_id=subject_id, hadm_id=1, charttime="2020-01-01", cleaned_text=text)
+
+def ingest(store, ollama, records, policy="link"):
+    async def run():
+        pipeline = IngestPipeline(make_embedding_service(ollama), store, NoteChunker(), len(records),
+                                  near_duplicates=NearDuplicateDetector(threshold=0.9, policy=policy))
+        lines = [line async for line in pipeline.run(records)]
+        return pipeline, lines
+    return asyncio.run(run())
+
+def embedded_texts(ollama):
+    return [text for _, payload in ollama.requests for text in payload["input"]]
+
+def test_copy_forward_notes_are_linked_instead_of_embedded(make_store):
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+    day1 = make_note(10)
+    records = [record("day1", day1), record("day2", copy_forward(day1, 1)),
+               record("other-subject", day1, subject_id=2), record("unrelated", make_note(11))]
+
+    pipeline, _ = ingest(store, ollama, records)
+
+    assert (pipeline.vectorized_count, pipeline.duplicate_count, pipeline.processed_count) == (3, 1, 4)
+    # Only day2 contains "edited"; none of its text went to Ollama
+    assert not any("edited" in text for text in embedded_texts(ollama))
+    assert store.metadata_store.get_duplicates(["day1"]) == {"day1": ["day2"]}
+    results = {result.note_id: result for result in store.search(np.array(ollama.vector(day1)), top_k=3)}
+    assert results["day1"].duplicate_note_ids == ["day2"]
+    assert results["other-subject"].duplicate_note_ids == []
+
+def test_later_runs_match_stored_signatures(make_store):
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+    note = make_note(12)
+    ingest(store, ollama, [record("first", note)])
+    sent = len(embedded_texts(ollama))
+
+    pipeline, _ = ingest(store, ollama, [record("second", copy_forward(note, 1))], policy="skip")
+    assert pipeline.duplicate_count == 1
+    assert len(embedded_texts(ollama)) == sent
+    # Skipped duplicates are not linked
+    assert store.metadata_store.get_duplicates(["first"]) == {}
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import httpx
+import numpy as np
+import pytest
+
+import main
+from conftest import FakeOllama, make_embedding_service, note_metadata
+from services.llm_service import LLMService
+from services.ttl_cache import TTLCache
+
+class FakeChat:
+    """/api/chat streaming the answer a few characters per line, after `failures` 500s"""
+
+    def __init__(self, answer: str = "Chest pain was ruled out.", failures: int = 0, cut_after: int = None):
+        self.answer = answer
+        self.failures = failures
+        self.cut_after = cut_after
+        self.payloads = []
+
+    async def lines(self):
+        pieces = [self.answer[i:i + 6] for i in range(0, len(self.answer), 6)]
+        for i, piece in enumerate(pieces):
+            if self.cut_after is not None and i == self.cut_after:
+                return
+            yield json.dumps({"model": "fake", "message": {"content": piece}, "done": False}).encode() + b"\n"
+        yield json.dumps({"model": "fake", "message": {"content": ""}, "done": True,
+                          "prompt_eval_count": 42, "eval_count": len(pieces)}).encode() + b"\n"
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.payloads.append(json.loads(request.content))
+        if self.failures:
+            self.failures -= 1
+            return httpx.Response(500, text="model loading")
+        return httpx.Response(200, content=self.lines())
+
+def make_llm(chat: FakeChat) -> LLMService:
+    llm = LLMService()
+    llm.retry_delay = 0
+    llm._client = httpx.AsyncClient(transport=httpx.MockTransport(chat.handle))
+    return llm
+
+async def collect(llm: LLMService):
+    return [chunk async for chunk in llm.stream_chat([{"role": "user", "content": "q"}])]
+
+def test_stream_chat_yields_every_line_until_done():
+    chat = FakeChat()
+    chunks = asyncio.run(collect(make_llm(chat)))
+
+    assert "".join(chunk["message"]["content"] for chunk in chunks) == chat.answer
+    assert chunks[-1]["done"] and chunks[-1]["eval_count"] == len(chunks) - 1
+    assert chat.payloads[0]["stream"] is True
+    assert chat.payloads[0]["keep_alive"] == "30m"
+
+def test_errors_before_the_first_line_are_retried():
+    chat = FakeChat(failures=2)
+    chunks = asyncio.run(collect(make_llm(chat)))
+    assert len(chat.payloads) == 3
+    assert chunks[-1]["done"]
+
+def test_a_stream_cut_short_is_not_retried():
+    chat = FakeChat(cut_after=2)
+    with pytest.raises(Exception, match="closed the stream"):
+        asyncio.run(collect(make_llm(chat)))
+    assert len(chat.payloads) == 1
+
+@pytest.fixture
+def rag_api(make_store, monkeypatch):
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+    metadatas = [note_metadata(i) for i in range(20)]
+    store.add_vectors([metadata["note_id"] for metadata in metadatas],
+                      np.array([ollama.vector(metadata["cleaned_text"]) for metadata in metadatas]), metadatas)
+    chat = FakeChat()
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "embedding_service", make_embedding_service(ollama))
+    monkeypatch.setattr(main, "llm_service", make_llm(chat))
+    monkeypatch.setattr(main, "search_result_cache", TTLCache(max_size=16))
+    return chat
+
+def post_rag(payload):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/rag", json=payload)
+    return asyncio.run(run())
+
+def test_rag_streams_sources_tokens_then_done(rag_api):
+    response = post_rag({"query": "note 7 word7", "top_k": 2})
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    types = [event["type"] for event in events]
+    assert types[0] == "sources" and types[-1] == "done"
+    assert set(types[1:-1]) == {"token"}
+    assert events[0]["results"][0]["note_id"] == "n7"
+    assert "".join(event["content"] for event in events if event["type"] == "token") == rag_api.answer
+    done = events[-1]
+    assert (done["model_used"], done["prompt_tokens"], done["context"]["records_used"]) == ("fake", 42, 2)
+    assert done["timings"]["first_token_ms"] <= done["timings"]["total_ms"]
+    # The retrieved notes were put into the prompt
+    assert "word7" in json.dumps(rag_api.payloads[0]["messages"])
+
+def test_rag_can_stream_server_sent_events(rag_api):
+    response = post_rag({"query": "note 3 word3", "format": "sse"})
+    blocks = [block for block in response.text.split("\n\n") if block]
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert blocks[0].startswith("event: sources\ndata: ")
+    assert blocks[-1].startswith("event: done\ndata: ")
+
+def test_rag_rejects_unknown_formats(rag_api):
+    response = post_rag({"query": "x", "format": "xml"})
+    assert response.status_code == 400
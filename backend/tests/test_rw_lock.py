@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import add_notes
+from services.rw_lock import ReadWriteLock
+
+TIMEOUT = 2.0
+
+def start(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    barrier = threading.Barrier(3, timeout=TIMEOUT)
+
+    def reader():
+        with lock.read():
+            # Only passes if all three readers hold the lock at once
+            barrier.wait()
+
+    threads = [start(reader) for _ in range(3)]
+    for thread in threads:
+        thread.join(TIMEOUT)
+    assert not barrier.broken
+
+def test_writer_excludes_readers_and_writers():
+    lock = ReadWriteLock()
+    events = []
+    writing = threading.Event()
+    release = threading.Event()
+
+    def writer():
+        with lock.write():
+            writing.set()
+            release.wait(TIMEOUT)
+            events.append("writer done")
+
+    def reader():
+        with lock.read():
+            events.append("reader")
+
+    def second_writer():
+        with lock.write():
+            events.append("second writer")
+
+    start(writer)
+    writing.wait(TIMEOUT)
+    others = [start(reader), start(second_writer)]
+    time.sleep(0.05)
+    assert events == []
+    release.set()
+    for thread in others:
+        thread.join(TIMEOUT)
+    assert events[0] == "writer done"
+    assert sorted(events[1:]) == ["reader", "second writer"]
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = ReadWriteLock()
+    order = []
+    reading = threading.Event()
+    release = threading.Event()
+
+    def first_reader():
+        with lock.read():
+            reading.set()
+            release.wait(TIMEOUT)
+
+    def writer():
+        with lock.write():
+            order.append("writer")
+
+    def late_reader():
+        with lock.read():
+            order.append("late reader")
+
+    first = start(first_reader)
+    reading.wait(TIMEOUT)
+    blocked_writer = start(writer)
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    blocked_reader = start(late_reader)
+    time.sleep(0.05)
+    # The late reader queues behind the writer instead of joining the first reader
+    assert order == []
+    release.set()
+    for thread in (first, blocked_writer, blocked_reader):
+        thread.join(TIMEOUT)
+    assert order == ["writer", "late reader"]
+
+def test_reentrant_use_by_one_thread():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+    with lock.read():
+        with lock.read():
+            pass
+        with pytest.raises(RuntimeError, match="write lock while holding the read lock"):
+            with lock.write():
+                pass
+    # Fully released: a writer on another thread gets in
+    acquired = threading.Event()
+
+    def writer():
+        with lock.write():
+            acquired.set()
+
+    start(writer).join(TIMEOUT)
+    assert acquired.is_set()
+
+def test_slow_index_work_does_not_block_the_event_loop(make_store, vectors, monkeypatch):
+    store = make_store()
+    add_notes(store, vectors, 0, 50)
+    add_vectors = store.add_vectors
+
+    def slow_add(*args, **kwargs):
+        with store._lock.write():
+            time.sleep(0.2)
+            return add_vectors(*args, **kwargs)
+
+    monkeypatch.setattr(store, "add_vectors", slow_add)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        added = await store.run_in_executor(add_notes, store, vectors, 50, 60)
+        ticking.cancel()
+        return added, ticks
+
+    added, ticks = asyncio.run(run())
+    assert added == 10
+    # The loop kept running while the write held the index lock on the executor
+    assert ticks >= 10
@@ -0,0 +1,97 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import main
+from conftest import FakeOllama, make_embedding_service, note_metadata
+from services import ttl_cache
+from services.ttl_cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    cache = TTLCache(max_size=4, ttl_seconds=10.0)
+    cache.put("q", [1])
+
+    clock.now = 9.9
+    assert cache.get("q") == [1]
+    clock.now = 10.1
+    assert cache.get("q") is None
+    assert cache.get_stats()["entries"] == 0
+
+def test_least_recently_used_entry_is_dropped_when_full():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.get_stats()["evictions"] == 1
+
+@pytest.fixture
+def search_services(make_store, monkeypatch):
+    """Point main's globals at a small store and an embedding service over a fake Ollama"""
+    ollama = FakeOllama()
+    store = make_store(dimension=ollama.dimension)
+    service = make_embedding_service(ollama)
+    monkeypatch.setattr(main, "vector_store", store)
+    monkeypatch.setattr(main, "embedding_service", service)
+    monkeypatch.setattr(main, "search_result_cache", TTLCache(max_size=16))
+
+    searches = []
+    search = store.search
+
+    def counting_search(**kwargs):
+        searches.append(kwargs["top_k"])
+        return search(**kwargs)
+
+    monkeypatch.setattr(store, "search", counting_search)
+    return ollama, store, searches
+
+def add_note(ollama: FakeOllama, store, i: int):
+    metadata = note_metadata(i)
+    store.add_vectors([metadata["note_id"]], np.array([ollama.vector(metadata["cleaned_text"])]), [metadata])
+
+def test_repeated_search_is_served_from_cache_until_the_store_changes(search_services):
+    ollama, store, searches = search_services
+    for i in range(5):
+        add_note(ollama, store, i)
+    query = note_metadata(9)["cleaned_text"]
+
+    async def run():
+        first = await main.retrieve(query, top_k=3)
+        repeat = await main.retrieve(query, top_k=3)
+        add_note(ollama, store, 9)
+        after_add = await main.retrieve(query, top_k=3)
+        return first, repeat, after_add
+
+    first, repeat, after_add = asyncio.run(run())
+    assert repeat is first
+    assert len(searches) == 2
+    # The generation bump invalidated the cached results, so the new note is found
+    assert "n9" not in [result.note_id for result in first]
+    assert after_add[0].note_id == "n9"
+    # The query was embedded once; later lookups hit the query-embedding cache
+    assert len(ollama.requests) == 1
+
+def test_different_parameters_are_cached_separately(search_services):
+    ollama, store, searches = search_services
+    for i in range(5):
+        add_note(ollama, store, i)
+
+    async def run():
+        await main.retrieve("note 1 word1", top_k=2)
+        await main.retrieve("note 1 word1", top_k=4)
+        await main.retrieve("note 1 word1", top_k=2, subject_id_filter=1)
+
+    asyncio.run(run())
+    assert searches == [2, 4, 2]
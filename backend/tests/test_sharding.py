@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from conftest import add_notes, close_store
+from services.sharded_index import ShardLayout
+
+def result_ids(results):
+    return [(result.note_id, round(result.similarity_score, 5)) for result in results]
+
+def test_layout_assigns_shards():
+    positions = np.arange(10)
+    assert ShardLayout().assign(positions).tolist() == [0] * 10
+    assert ShardLayout("subject", num_shards=3).assign(positions, [4, 5, None, 9, 4, 1, 2, 3, 0, 7]).tolist() == \
+        [1, 2, 0, 0, 1, 1, 2, 0, 0, 1]
+    assert ShardLayout("time", shard_vectors=4).assign(positions).tolist() == [0, 0, 0, 0, 1, 1, 1, 1, 2, 2]
+    assert ShardLayout("time", shard_vectors=4).shard_count(9) == 3
+
+def test_layout_tags_round_trip():
+    for layout in (ShardLayout(), ShardLayout("subject", num_shards=5), ShardLayout("time", shard_vectors=1000)):
+        assert ShardLayout.from_tag(layout.tag) == layout
+    with pytest.raises(ValueError):
+        ShardLayout("month")
+
+def test_subject_shards_hold_their_subjects(make_store, vectors):
+    store = make_store(shard_by="subject", num_shards=3)
+    add_notes(store, vectors, 0, 140)
+    positions = np.arange(140, dtype=np.int64)
+    # Note n<i> belongs to subject i % 7
+    assert store.index.locate(positions).tolist() == [(i % 7) % 3 for i in range(140)]
+    assert store.get_stats()["shards"] == [60, 40, 40]
+
+def test_time_shards_follow_ingest_order(make_store, vectors):
+    store = make_store(shard_by="time", shard_vectors=50)
+    add_notes(store, vectors, 0, 120)
+    assert store.get_stats()["shards"] == [50, 50, 20]
+
+@pytest.mark.parametrize("shard_options", [
+    {"shard_by": "subject", "num_shards": 3},
+    {"shard_by": "time", "shard_vectors": 50}
+])
+def test_merged_top_k_matches_unsharded(tmp_path, make_store, vectors, shard_options):
+    (tmp_path / "plain").mkdir()
+    unsharded = make_store(index_path=str(tmp_path / "plain" / "faiss_index.bin"),
+                           metadata_path=str(tmp_path / "plain.db"))
+    sharded = make_store(**shard_options)
+    for store in (unsharded, sharded):
+        add_notes(store, vectors, 0, 300)
+        store.delete_notes(["n4", "n150"])
+
+    queries = vectors[300:310]
+    for query in queries:
+        assert result_ids(sharded.search(query, top_k=10)) == result_ids(unsharded.search(query, top_k=10))
+        assert result_ids(sharded.search(query, top_k=5, subject_id_filter=3)) == \
+            result_ids(unsharded.search(query, top_k=5, subject_id_filter=3))
+
+    top_ks = [3] * len(queries)
+    assert [result_ids(results) for results in sharded.search_batch(queries, top_ks)] == \
+        [result_ids(results) for results in unsharded.search_batch(queries, top_ks)]
+
+def test_sharded_store_reloads(make_store, vectors):
+    store = make_store(shard_by="subject", num_shards=3)
+    add_notes(store, vectors, 0, 100)
+    store.save_index(snapshot=True)
+    expected = result_ids(store.search(vectors[500], top_k=5))
+    close_store(store)
+
+    store = make_store(shard_by="subject", num_shards=3)
+    assert store.get_stats()["shards"] == [43, 29, 28]
+    assert result_ids(store.search(vectors[500], top_k=5)) == expected
+
+    # A different configured layout reshards the loaded vectors
+    close_store(store)
+    store = make_store(shard_by="subject", num_shards=2)
+    assert sum(store.get_stats()["shards"]) == 100
+    assert result_ids(store.search(vectors[500], top_k=5)) == expected
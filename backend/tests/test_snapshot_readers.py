@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from conftest import DIMENSION, add_notes, note_metadata
+from services.vector_store import VectorStore
+
+@pytest.fixture
+def publish_dir(tmp_path):
+    return str(tmp_path / "published")
+
+@pytest.fixture
+def writer(make_store, publish_dir):
+    # Publishing is driven by explicit snapshots in these tests
+    return make_store(publish_dir=publish_dir, publish_interval_seconds=3600)
+
+@pytest.fixture
+def open_reader(tmp_path, publish_dir):
+    """Read-only workers over the writer's metadata and published snapshots"""
+    readers = []
+
+    def open_reader() -> VectorStore:
+        reader = VectorStore(metadata_path=str(tmp_path / "metadata.db"), dimension=DIMENSION,
+                             publish_dir=publish_dir, read_only=True, executor_threads=1)
+        readers.append(reader)
+        return reader
+
+    yield open_reader
+    for reader in readers:
+        reader.close()
+        if reader.metadata_store is not None:
+            reader.metadata_store.close()
+
+def note_ids(store, query, top_k=3):
+    return [result.note_id for result in store.search(query, top_k=top_k)]
+
+def test_reader_swaps_to_each_published_generation(writer, open_reader, vectors):
+    reader = open_reader()
+    assert not reader.is_initialized()
+    assert reader.refresh() is False
+
+    add_notes(writer, vectors, 0, 100)
+    writer.save_index(snapshot=True)
+    assert reader.refresh() is True
+    assert reader.published_generation == 1
+    assert note_ids(reader, vectors[42], top_k=1) == ["n42"]
+
+    # Checkpointed but not yet published: the reader keeps serving generation 1
+    add_notes(writer, vectors, 100, 150)
+    writer.save_index()
+    assert reader.refresh() is False
+    assert "n120" not in note_ids(reader, vectors[120])
+
+    generation = reader.generation
+    writer.save_index(snapshot=True)
+    assert reader.refresh() is True
+    assert reader.generation > generation
+    assert (reader.published_generation, reader.index.ntotal) == (2, 150)
+    assert note_ids(reader, vectors[120], top_k=1) == ["n120"]
+
+def test_deletes_reach_readers_before_the_next_snapshot(writer, open_reader, vectors):
+    add_notes(writer, vectors, 0, 100)
+    writer.save_index(snapshot=True)
+    reader = open_reader()
+    assert note_ids(reader, vectors[7], top_k=1) == ["n7"]
+
+    generation = reader.generation
+    writer.delete_notes(["n7"])
+    writer.save_index()
+    # No new generation, but the metadata change invalidates cached results
+    assert reader.refresh() is False
+    assert reader.generation == generation + 1
+    assert "n7" not in note_ids(reader, vectors[7])
+
+def test_readers_reject_writes(writer, open_reader, vectors):
+    add_notes(writer, vectors, 0, 10)
+    writer.save_index(snapshot=True)
+    reader = open_reader()
+
+    with pytest.raises(RuntimeError, match="read-only"):
+        reader.add_vectors(["x"], vectors[:1], [note_metadata(999)])
+    with pytest.raises(RuntimeError, match="read-only"):
+        reader.delete_notes(["n1"])
+    assert writer.metadata_store.count() == 10
+
+def test_only_the_two_newest_generations_are_kept(writer, vectors, publish_dir):
+    for generation in range(4):
+        add_notes(writer, vectors, generation * 10, generation * 10 + 10)
+        writer.save_index(snapshot=True)
+
+    suffixes = {name.split(".")[-2] for name in os.listdir(publish_dir) if name != "manifest.json"}
+    assert suffixes == {"3", "4"}
+
+def test_read_only_store_needs_a_publish_dir(tmp_path):
+    with pytest.raises(ValueError, match="publish_dir"):
+        VectorStore(metadata_path=str(tmp_path / "metadata.db"), read_only=True)
+
+def test_readers_warn_when_faiss_cannot_map_the_index(writer, open_reader, vectors, monkeypatch, caplog):
+    monkeypatch.setattr("services.vector_store.SNAPSHOT_MMAP_ALL", False)
+    add_notes(writer, vectors, 0, 10)
+    writer.save_index(snapshot=True)
+
+    with caplog.at_level("WARNING", logger="services.vector_store"):
+        open_reader()
+    assert "cannot memory-map flat indexes" in caplog.text
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from conftest import note_metadata
+
+RARE_SUBJECT = 99
+RARE_NOTES = [17, 233, 401, 588]
+
+@pytest.fixture
+def subject_store(make_store, vectors):
+    """Factory for a store of 600 notes where only RARE_NOTES belong to RARE_SUBJECT"""
+    def make(**kwargs):
+        store = make_store(**kwargs)
+        metadatas = [note_metadata(i, subject_id=RARE_SUBJECT if i in RARE_NOTES else i % 7) for i in range(600)]
+        store.add_vectors([metadata["note_id"] for metadata in metadatas], vectors, metadatas)
+        return store
+    return make
+
+def subject_top_k(vectors, query, subject_notes, k):
+    """Exact cosine ranking restricted to the given note numbers"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized[subject_notes] @ (query / np.linalg.norm(query))
+    return [f"n{subject_notes[i]}" for i in np.argsort(-scores)][:k]
+
+@pytest.mark.parametrize("exact_filter_max_ids", [20_000, 0], ids=["numpy", "id-selector"])
+def test_rare_subject_is_found_far_from_the_query(subject_store, vectors, exact_filter_max_ids):
+    store = subject_store(exact_filter_max_ids=exact_filter_max_ids)
+    # The query is note 0 itself, so the global top hits all belong to other subjects
+    results = store.search(vectors[0], top_k=3, subject_id_filter=RARE_SUBJECT)
+
+    assert [result.note_id for result in results] == subject_top_k(vectors, vectors[0], RARE_NOTES, 3)
+    assert {result.subject_id for result in results} == {RARE_SUBJECT}
+
+def test_filter_returns_fewer_hits_than_top_k_when_the_subject_is_small(subject_store, vectors):
+    store = subject_store()
+    results = store.search(vectors[5], top_k=10, subject_id_filter=RARE_SUBJECT)
+    assert sorted(result.note_id for result in results) == sorted(f"n{i}" for i in RARE_NOTES)
+    assert store.search(vectors[5], top_k=10, subject_id_filter=12345) == []
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw"])
+def test_ann_indexes_filter_the_same_way(subject_store, vectors, index_type):
+    store = subject_store(nlist=8)
+    store.convert_index(index_type)
+    subject_notes = [i for i in range(600) if i % 7 == 3 and i not in RARE_NOTES]
+
+    for exact_filter_max_ids in (20_000, 0):
+        store.exact_filter_max_ids = exact_filter_max_ids
+        results = store.search(vectors[10], top_k=5, subject_id_filter=3, nprobe=8, ef_search=256)
+        assert [result.note_id for result in results] == subject_top_k(vectors, vectors[10], subject_notes, 5)
@@ -0,0 +1,89 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from services.upload_parser import UploadError, UploadParser, detect_format
+
+CSV_HEADER = "note_id,subject_id,hadm_id,charttime,text\n"
+
+async def byte_chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def parse(parser: UploadParser, data: str, chunk_size: int = 7) -> List:
+    """Records parsed from data delivered in small chunks"""
+    async def collect():
+        return [record async for record in parser.records(byte_chunks(data.encode(), chunk_size))]
+    return asyncio.run(collect())
+
+def test_csv_quoted_fields_span_lines():
+    data = (CSV_HEADER
+            + 'a1,1,10,2020-01-01,"Line one\nline two, with a comma\n\nand ""quotes"""\n'
+            + "a2,2,20,2020-01-02,plain text\n")
+    parser = UploadParser("csv")
+    records = parse(parser, data)
+    assert [record.note_id for record in records] == ["a1", "a2"]
+    assert records[0].cleaned_text == 'Line one\nline two, with a comma\n\nand "quotes"'
+    assert parser.rows_read == 2
+    assert parser.rows_invalid == 0
+
+def test_csv_ending_inside_a_quoted_field_fails():
+    parser = UploadParser("csv")
+    with pytest.raises(UploadError, match="inside a quoted field"):
+        parse(parser, CSV_HEADER + 'a1,1,10,2020-01-01,"never closed\nstill open\n')
+
+def test_csv_unbalanced_quote_hits_the_record_limit():
+    parser = UploadParser("csv", max_record_bytes=64)
+    data = CSV_HEADER + 'a1,1,10,2020-01-01,"open\n' + "a2,2,20,2020-01-02,more text\n" * 10
+    with pytest.raises(UploadError, match="unbalanced quotes"):
+        parse(parser, data)
+
+def test_csv_invalid_rows_are_skipped():
+    data = (CSV_HEADER
+            + "a1,1,10,2020-01-01,ok\n"
+            + "a2,,20,2020-01-02,no subject\n"
+            + "a3,x,30,2020-01-03,bad subject\n"
+            + "a4,4,40,2020-01-04,   \n")
+    parser = UploadParser("csv")
+    assert [record.note_id for record in parse(parser, data)] == ["a1"]
+    assert parser.rows_read == 4
+    assert parser.rows_invalid == 3
+    assert parser.errors[0] == "row 2: missing subject_id"
+    assert parser.errors[1].startswith("row 3 (a3): subject_id")
+    assert parser.errors[2] == "row 4 (a4): empty text"
+
+def test_jsonl_bad_lines_are_counted_and_skipped():
+    data = ('{"note_id": "j1", "subject_id": 1, "hadm_id": 10, "charttime": "2020", "cleaned_text": "ok"}\n'
+            "\n"
+            '{"note_id": "j2", "subject_id": \n'
+            "[1, 2, 3]\n"
+            '{"note_id": "j3", "subject_id": 3, "hadm_id": 30, "charttime": "2020", "text": "aliased"}')
+    parser = UploadParser("jsonl")
+    records = parse(parser, data)
+    assert [record.note_id for record in records] == ["j1", "j3"]
+    assert records[1].cleaned_text == "aliased"
+    assert parser.rows_read == 4
+    assert parser.rows_invalid == 2
+    assert parser.errors[0].startswith("line 3: invalid JSON")
+    assert parser.errors[1] == "line 4: expected a JSON object"
+
+def test_overlong_line_fails():
+    parser = UploadParser("jsonl", max_record_bytes=32)
+    with pytest.raises(UploadError, match="Line longer than 32 bytes"):
+        parse(parser, '{"note_id": "' + "x" * 100 + '"}\n')
+
+def test_kept_errors_are_capped():
+    parser = UploadParser("jsonl", max_errors_kept=2)
+    parse(parser, "not json\n" * 5)
+    assert parser.rows_invalid == 5
+    assert len(parser.errors) == 2
+
+def test_detect_format():
+    assert detect_format("jsonl", "notes.csv", None) == "jsonl"
+    assert detect_format(None, "notes.jsonl", None) == "jsonl"
+    assert detect_format(None, None, "text/csv; charset=utf-8") == "csv"
+    with pytest.raises(UploadError):
+        detect_format("xlsx", None, None)
+    with pytest.raises(UploadError):
+        detect_format(None, "notes.bin", "application/octet-stream")
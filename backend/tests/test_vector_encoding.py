@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from conftest import DIMENSION, add_notes, close_store
+
+TOP_K = 10
+
+@pytest.fixture
+def clustered_vectors() -> np.ndarray:
+    """Vectors concentrated near a low-rank subspace, so near neighbours are close calls"""
+    rng = np.random.default_rng(1)
+    basis = rng.standard_normal((8, DIMENSION)).astype(np.float32)
+    vectors = rng.standard_normal((1050, 8)).astype(np.float32) @ basis
+    vectors += 0.3 * rng.standard_normal(vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exact_hits(vectors: np.ndarray, queries: np.ndarray):
+    """float32 top-k note ids and similarities of every query"""
+    scores = queries @ vectors.T
+    order = np.argsort(-scores, axis=1)[:, :TOP_K]
+    return [[f"n{i}" for i in row] for row in order], np.take_along_axis(scores, order, axis=1)
+
+def recall(store, queries: np.ndarray, expected) -> float:
+    found = [{result.note_id for result in store.search(query, top_k=TOP_K)} for query in queries]
+    return float(np.mean([len(hits & set(truth)) / TOP_K for hits, truth in zip(found, expected)]))
+
+@pytest.mark.parametrize("encoding", ["fp16", "int8"])
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_rerank_recovers_float32_results(make_store, clustered_vectors, index_type, encoding):
+    vectors, queries = clustered_vectors[:1000], clustered_vectors[1000:]
+    expected, expected_scores = exact_hits(vectors, queries)
+
+    store = make_store(exact_rerank=True, rerank_factor=4)
+    add_notes(store, vectors, 0, 1000)
+    store.convert_index(index_type, encoding)
+    assert store.current_encoding() == encoding
+    assert store._reranks()
+
+    reranked = recall(store, queries, expected)
+    assert reranked >= 0.98
+
+    # Re-ranked hits carry their exact float32 similarities
+    results = store.search(queries[0], top_k=TOP_K)
+    assert [result.note_id for result in results] == expected[0]
+    np.testing.assert_allclose([result.similarity_score for result in results], expected_scores[0], atol=1e-5)
+
+    # Without the vector file the store searches the compressed codes alone
+    vector_file, store.vector_file = store.vector_file, None
+    assert reranked >= recall(store, queries, expected)
+    store.vector_file = vector_file
+
+def test_int8_without_rerank_loses_precision(make_store, clustered_vectors):
+    vectors, queries = clustered_vectors[:1000], clustered_vectors[1000:]
+    _, expected_scores = exact_hits(vectors, queries)
+
+    store = make_store()
+    add_notes(store, vectors, 0, 1000)
+    store.convert_index("flat", "int8")
+    assert store.vector_file is None
+    assert not store._reranks()
+
+    scores = [store.search(query, top_k=1)[0].similarity_score for query in queries]
+    assert not np.allclose(scores, expected_scores[:, 0], atol=1e-5)
+
+def test_compressed_store_reranks_after_restart(make_store, clustered_vectors):
+    vectors, queries = clustered_vectors[:1000], clustered_vectors[1000:]
+    expected, _ = exact_hits(vectors, queries)
+
+    store = make_store(vector_encoding="fp16", exact_rerank=True)
+    add_notes(store, vectors, 0, 600)
+    store.save_index(snapshot=True)
+    # The rest only reaches the vector log and vector file before the restart
+    add_notes(store, vectors, 600, 1000)
+    store.save_index()
+    close_store(store)
+
+    store = make_store(vector_encoding="fp16", exact_rerank=True)
+    assert store.current_encoding() == "fp16"
+    assert store.index.ntotal == 1000
+    assert recall(store, queries, expected) >= 0.98
@@ -0,0 +1,90 @@
+from conftest import add_notes, close_store, exact_top_k, note_metadata
+
+def hnsw_store(make_store, **kwargs):
+    # Rebuilds only when asked, so the tests see the tombstones
+    return make_store(index_type="hnsw", rebuild_deleted_fraction=1.0, **kwargs)
+
+def result_ids(store, query, top_k=5):
+    return [result.note_id for result in store.search(query, top_k=top_k)]
+
+def test_delete_tombstones_hnsw_vectors(make_store, vectors):
+    store = hnsw_store(make_store)
+    add_notes(store, vectors, 0, 200)
+    assert store.current_index_type() == "hnsw"
+
+    assert store.delete_notes(["n10", "n11", "missing"]) == {"notes": 2, "vectors": 2}
+    assert store.tombstones == {10, 11}
+    assert store.index.ntotal == 200
+    assert store.get_stats()["total_vectors"] == 198
+    assert "n10" not in result_ids(store, vectors[10])
+    assert result_ids(store, vectors[10], top_k=3) == exact_top_k(vectors[:200], vectors[10], 3, exclude={"n10", "n11"})
+
+    assert store.delete_notes(["n10"]) == {"notes": 0, "vectors": 0}
+
+def test_flat_index_deletes_in_place(make_store, vectors):
+    store = make_store()
+    add_notes(store, vectors, 0, 50)
+    store.delete_notes(["n7"])
+    assert store.tombstones == set()
+    assert store.index.ntotal == 49
+    assert "n7" not in result_ids(store, vectors[7])
+
+def test_upsert_replaces_a_note(make_store, vectors):
+    store = hnsw_store(make_store)
+    add_notes(store, vectors, 0, 100)
+
+    metadata = dict(note_metadata(5), cleaned_text="corrected note 5")
+    assert store.upsert_vectors(["n5"], vectors[300:301], [metadata]) == 1
+    assert store.metadata_store.count() == 100
+    assert len(store.tombstones) == 1
+
+    results = store.search(vectors[300], top_k=1)
+    assert results[0].note_id == "n5"
+    assert results[0].cleaned_text == "corrected note 5"
+    # The old vector no longer matches its note
+    assert "n5" not in result_ids(store, vectors[5], top_k=3)
+
+def test_rebuild_drops_tombstones(make_store, vectors):
+    store = hnsw_store(make_store)
+    add_notes(store, vectors, 0, 200)
+    store.delete_notes([f"n{i}" for i in range(0, 200, 4)])
+    expected = exact_top_k(vectors[:200], vectors[101], 5, exclude={f"n{i}" for i in range(0, 200, 4)})
+
+    store.rebuild_index(background=False)
+    assert store.tombstones == set()
+    assert store.index.ntotal == 150
+    assert store.current_index_type() == "hnsw"
+    assert result_ids(store, vectors[101]) == expected
+
+    # The rebuilt index is what a restart loads
+    close_store(store)
+    store = hnsw_store(make_store)
+    assert store.index.ntotal == 150
+    assert store.tombstones == set()
+    assert result_ids(store, vectors[101]) == expected
+
+def test_checkpoint_rebuilds_once_tombstones_pile_up(make_store, vectors):
+    store = make_store(index_type="hnsw", rebuild_deleted_fraction=0.1)
+    add_notes(store, vectors, 0, 100)
+    store.save_index(snapshot=True)
+
+    store.delete_notes([f"n{i}" for i in range(5)])
+    store.save_index(snapshot=True)
+    assert len(store.tombstones) == 5
+
+    store.delete_notes([f"n{i}" for i in range(5, 15)])
+    store.save_index(snapshot=True)
+    assert store.tombstones == set()
+    assert store.index.ntotal == 85
+
+def test_tombstones_survive_a_restart(make_store, vectors):
+    store = hnsw_store(make_store)
+    add_notes(store, vectors, 0, 100)
+    store.save_index(snapshot=True)
+    store.delete_notes(["n42"])
+    store.save_index()
+    close_store(store)
+
+    store = hnsw_store(make_store)
+    assert store.tombstones == {42}
+    assert "n42" not in result_ids(store, vectors[42])
@@ -0,0 +1,88 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+
+from conftest import DIMENSION, add_notes, close_store, note_metadata
+
+def write_legacy_store(tmp_path, vectors: np.ndarray):
+    """An index and metadata.pkl as saved before metadata moved to SQLite"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(DIMENSION)
+    index.add(normalized)
+    faiss.write_index(index, str(tmp_path / "faiss_index.bin"))
+
+    ids = [f"n{i}" for i in range(len(vectors))]
+    data = {
+        "metadata": {note_id: note_metadata(i) for i, note_id in enumerate(ids)},
+        "id_to_index": {note_id: i for i, note_id in enumerate(ids)},
+        "index_to_id": {i: note_id for i, note_id in enumerate(ids)},
+        "next_index": len(ids),
+        "dimension": DIMENSION
+    }
+    with open(tmp_path / "metadata.pkl", "wb") as f:
+        pickle.dump(data, f)
+
+def test_pickled_metadata_is_migrated_to_sqlite(tmp_path, make_store, vectors):
+    write_legacy_store(tmp_path, vectors[:50])
+
+    store = make_store()
+    assert store.metadata_store.count() == 50
+    assert store.next_index == 50
+    assert not os.path.exists(tmp_path / "metadata.pkl")
+    assert os.path.exists(tmp_path / "metadata.pkl.migrated")
+
+    results = store.search(vectors[17], top_k=1)
+    assert results[0].note_id == "n17"
+    assert results[0].cleaned_text == "note 17 word17"
+
+    # New notes continue after the migrated positions
+    add_notes(store, vectors, 50, 60)
+    store.save_index(snapshot=True)
+    close_store(store)
+
+    store = make_store()
+    assert store.metadata_store.count() == 60
+    assert store.search(vectors[55], top_k=1)[0].note_id == "n55"
+
+def test_vector_log_is_replayed_after_a_crash(make_store, vectors):
+    store = make_store(compact_after_vectors=10_000)
+    add_notes(store, vectors, 0, 100)
+    store.save_index(snapshot=True)
+
+    # Checkpointed into the log only, then never snapshotted
+    add_notes(store, vectors, 100, 150)
+    store.delete_notes(["n3", "n120"])
+    store.save_index()
+    assert store.vector_log.records_since_snapshot == 50
+
+    # Logged but never checkpointed, so lost in the crash
+    add_notes(store, vectors, 150, 170)
+    close_store(store, crash=True)
+
+    store = make_store(compact_after_vectors=10_000)
+    assert store.next_index == 150
+    assert store.index.ntotal == 148
+    assert store.metadata_store.count() == 148
+    assert store.search(vectors[130], top_k=1)[0].note_id == "n130"
+    assert "n3" not in [result.note_id for result in store.search(vectors[3], top_k=5)]
+    assert "n120" not in [result.note_id for result in store.search(vectors[120], top_k=5)]
+    assert "n160" not in [result.note_id for result in store.search(vectors[160], top_k=5)]
+
+    # Positions of the lost vectors are reused without clashing
+    add_notes(store, vectors, 150, 160)
+    assert store.search(vectors[155], top_k=1)[0].note_id == "n155"
+
+def test_crash_before_first_snapshot_rebuilds_from_log(tmp_path, make_store, vectors, monkeypatch):
+    store = make_store(compact_after_vectors=10_000)
+    add_notes(store, vectors, 0, 40)
+    # Crash after the first checkpoint but before its snapshot was written
+    monkeypatch.setattr(store, "compact", lambda background=True: None)
+    store.save_index()
+    close_store(store, crash=True)
+    assert not os.path.exists(tmp_path / "faiss_index.bin")
+
+    store = make_store(compact_after_vectors=10_000)
+    assert store.index.ntotal == 40
+    assert store.search(vectors[25], top_k=1)[0].note_id == "n25"